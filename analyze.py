@@ -1,49 +1,342 @@
 import os
-from program.format_data import format_data 
-from program.demographics import run_demographics
-from program.clean_for_qualitative import clean_data_for_qualitative
-from program.validation import run_validation
-from program.standardize import run_standardize
-from program.check_strength import run_strength_check
-from program.regression import run_regression
-from program.qualitative import run_qualitative_analysis
+import glob
+import argparse
+from program.figures import configure_figures, shutdown_figures
+from program.profiling import configure_profiling, save_run_profile
+
+# 各ステップの分析モジュール（scipy・janome 等を含む）はステップの実行時に読み込み，
+# --help や軽いステップの起動を速くする
 
 # 設定: データディレクトリと出力先
 RAW_DATA_DIR = '.'
 OUTPUT_DIR = './generated'
 
-def main():
-    print("=== Analysis Pipeline Started ===")
-    
-    # 1. データ整形: 実験ログと記述回答を結合し，分析可能な形式へ変換する
-    df = format_data(RAW_DATA_DIR, OUTPUT_DIR)
+# 並列数の既定値（-j で指定する）: 2以上で独立したステップの並列実行に加え，
+# 各ステップ内の参加者ファイルの読み込み・形態素解析・ブートストラップ・並べ替え検定をプロセス並列化する
+N_JOBS = 1
+
+# グラフ描画用のバックグラウンドのワーカープロセス数（0で各ステップ内で描画する）
+FIGURE_JOBS = 1
+
+# 中間データの保存先（各ステップ間の受け渡しに使用）とCSV出力の有無
+STORE_DIR = os.path.join(OUTPUT_DIR, '.store')
+EXPORT_CSV = True
+
+# 標準化後の値の型（'float32' にするとメモリ使用量が半分になる）
+STANDARDIZE_DTYPE = 'float64'
+
+# 回帰係数の参加者単位ブートストラップ（再標本数．0で実行しない）と乱数のシード
+BOOTSTRAP_RESAMPLES = 0
+BOOTSTRAP_SEED = 0
+
+# 操作強度の検定の方法（'parametric' または 'permutation'）と並べ替え検定の回数・乱数のシード
+STRENGTH_TEST = 'parametric'
+N_PERMUTATIONS = 10000
+PERMUTATION_SEED = 0
+
+# 十分統計量の保存先（参加者を追加した際にレポートを逐次更新するために使用）と，
+# 追加後のレポートの出力先（パイプラインの出力とは別に保存する）
+SUFFSTATS_PATH = os.path.join(OUTPUT_DIR, 'suffstats.sqlite')
+APPEND_OUTPUT_DIR = os.path.join(OUTPUT_DIR, 'appended')
+
+# メモリに載らない規模のデータ用の分割実行（python analyze.py --chunked）の1チャンクあたりの参加者数
+CHUNK_PARTICIPANTS = 5000
+
+
+def set_jobs(n_jobs):
+    """
+    各ステップ内のプロセス並列数を設定する（ステップを実行するワーカープロセスの初期化にも用いる）
+    """
+    global N_JOBS
+    N_JOBS = n_jobs
 
-    # 2. 参加者属性の集計: 年齢・性別等の基本統計量を算出する
-    run_demographics(df, OUTPUT_DIR)
 
-    # 3. 定性データの匿名化: 個人特定につながる情報（年齢・性別・所要時間）を削除する
+def raw_data_signature():
+    """
+    実験データファイルの一覧（パス・サイズ・更新時刻）．データ整形ステップの入力の識別に用いる
+    """
+    paths = sorted(
+        glob.glob(os.path.join(RAW_DATA_DIR, 'quant_data', '*.csv')) +
+        glob.glob(os.path.join(RAW_DATA_DIR, 'qual_data', '*.txt'))
+    )
+    signature = []
+    for path in paths:
+        st = os.stat(path)
+        signature.append([os.path.relpath(path, RAW_DATA_DIR), st.st_size, st.st_mtime_ns])
+    return signature
+
+
+# 1. データ整形: 実験ログと記述回答を結合し，分析可能な形式へ変換する
+def step_format(inputs):
+    from program.format_data import format_data
+    return format_data(
+        RAW_DATA_DIR, OUTPUT_DIR, n_jobs=N_JOBS, store_dir=STORE_DIR, export_csv=EXPORT_CSV,
+        cache_dir=os.path.join(OUTPUT_DIR, '.cache', 'format_data')
+    )
+
+# 2. 参加者属性の集計: 年齢・性別等の基本統計量を算出する
+def step_demographics(inputs):
+    if inputs['format'] is not None:
+        from program.demographics import run_demographics
+        run_demographics(inputs['format']['participants'], OUTPUT_DIR)
+
+# 3. 定性データの匿名化: 個人特定につながる情報（年齢・性別・所要時間）を含まない回答テーブルのみを用いる
+def step_anonymize(inputs):
+    from program.clean_for_qualitative import clean_data_for_qualitative
+    from program.store import save_frame
     tidy_file_path = os.path.join(OUTPUT_DIR, 'integrated_tidy_data.csv')
-    df_anon = clean_data_for_qualitative(tidy_file_path, OUTPUT_DIR)
+    responses = inputs['format']['responses'] if inputs['format'] is not None else None
+    df_anon = clean_data_for_qualitative(
+        tidy_file_path, OUTPUT_DIR, store_dir=STORE_DIR, export_csv=EXPORT_CSV, responses=responses
+    )
+    df_anon = fill_missing_q7(df_anon)
+    save_frame(df_anon, STORE_DIR, 'integrated_tidy_data_anon')
+    return df_anon
+
+def fill_missing_q7(df_anon):
     # 欠損値（-1）を1に置換
     df_anon[['q7']] = df_anon[['q7']].replace(-1, 1)
+    return df_anon
+
+# 4. 操作チェックと妥当性検証: 各実験条件が意図通りに機能したかをt検定により検証する
+def step_validation(inputs):
+    from program.validation import run_validation
+    run_validation(inputs['anonymize'], OUTPUT_DIR)
+
+# 5. 被験者内標準化
+def step_standardize(inputs):
+    from program.standardize import run_standardize
+    return run_standardize(
+        inputs['anonymize'], OUTPUT_DIR, store_dir=STORE_DIR, export_csv=EXPORT_CSV, dtype=STANDARDIZE_DTYPE
+    )
+
+# 6. 操作強度の均質性検証（分散分析）-> 結果が均一でなかった場合はTukey-Kramer法を用いた多重比較を行う
+def step_strength(inputs):
+    from program.check_strength import run_strength_check
+    run_strength_check(
+        inputs['standardize'], OUTPUT_DIR,
+        backend=STRENGTH_TEST, n_perm=N_PERMUTATIONS, seed=PERMUTATION_SEED, n_jobs=N_JOBS
+    )
+
+# 7. 重回帰分析
+def step_regression(inputs):
+    from program.regression import run_regression
+    return run_regression(
+        inputs['standardize'], OUTPUT_DIR, n_boot=BOOTSTRAP_RESAMPLES, seed=BOOTSTRAP_SEED, n_jobs=N_JOBS
+    )
+
+# 8. 多重共線性の検証: 重回帰分析の積和行列からVIFと条件指数を算出する
+def step_vif(inputs):
+    from program.multico import run_multicollinearity_check
+    run_multicollinearity_check(None, OUTPUT_DIR, design=inputs['regression'])
 
-    # 4. 操作チェックと妥当性検証: 各実験条件が意図通りに機能したかをt検定により検証する
-    run_validation(df_anon, OUTPUT_DIR)
+# 十分統計量: 参加者を追加した際のレポートの逐次更新用（python analyze.py --append）
+def step_suffstats(inputs):
+    from program.suffstats import build_suffstats
+    build_suffstats(inputs['anonymize'], SUFFSTATS_PATH)
 
-    # 5. 被験者内標準化
-    df_std = run_standardize(df_anon, OUTPUT_DIR)
-    
-    # 6. 操作強度の均質性検証（分散分析）-> 結果が均一でなかった場合はTukey-Kramer法を用いた多重比較を行う
-    run_strength_check(df_std, OUTPUT_DIR)
+# 9. 定性分析: 自由記述回答に対する形態素解析・頻出語分析
+def step_qualitative(inputs):
+    if inputs['anonymize'] is not None:
+        from program.qualitative import run_qualitative_analysis
+        run_qualitative_analysis(inputs['anonymize'], OUTPUT_DIR, n_jobs=N_JOBS)
+
+
+# ステップグラフ: 各ステップの依存関係・コード・パラメータ・出力ファイル
+STEPS = {
+    'format': {
+        'run': step_format, 'deps': [],
+        'params': {'export_csv': EXPORT_CSV},
+        'outputs': ['integrated_tidy_data.csv'],
+        'store': {'participants': 'participants', 'responses': 'responses'},
+        'source': raw_data_signature,
+    },
+    'demographics': {
+        'run': step_demographics, 'deps': ['format'],
+        'outputs': ['demographics_report.txt'],
+    },
+    'anonymize': {
+        'run': step_anonymize, 'deps': ['format'],
+        'params': {'export_csv': EXPORT_CSV},
+        'outputs': ['integrated_tidy_data_anon.csv'],
+        'store': 'integrated_tidy_data_anon',
+    },
+    'validation': {
+        'run': step_validation, 'deps': ['anonymize'],
+        'outputs': ['manipulation_check.txt', 'manipulation_check_grid.csv'],
+    },
+    'standardize': {
+        'run': step_standardize, 'deps': ['anonymize'],
+        'params': {'export_csv': EXPORT_CSV, 'dtype': STANDARDIZE_DTYPE},
+        'outputs': ['standardized_data.csv'],
+        'store': 'standardized_data',
+    },
+    'strength': {
+        'run': step_strength, 'deps': ['standardize'],
+        'params': {'backend': STRENGTH_TEST, 'n_perm': N_PERMUTATIONS, 'seed': PERMUTATION_SEED},
+        'outputs': ['strength_check.txt', 'strength_anova.csv', 'strength_posthoc.csv', 'post-hoc_level*.txt', 'figures/strength_check.png'],
+    },
+    'regression': {
+        'run': step_regression, 'deps': ['standardize'],
+        'params': {'n_boot': BOOTSTRAP_RESAMPLES, 'seed': BOOTSTRAP_SEED},
+        'outputs': ['regression_report.txt', 'figures/reg_comparison.png'],
+    },
+    'vif': {
+        'run': step_vif, 'deps': ['regression'],
+        'outputs': ['vif_report.txt'],
+    },
+    'suffstats': {
+        'run': step_suffstats, 'deps': ['anonymize'],
+        # 十分統計量は --append で参加者を追加するため，キャッシュから復元して上書きしない
+        # （作り直すのは匿名化データ・コードが変わった場合と，ファイルがない場合のみ）
+        'persist': ['suffstats.sqlite'],
+    },
+    'qualitative': {
+        'run': step_qualitative, 'deps': ['anonymize'],
+        'outputs': ['qualitative_*.csv', 'figures/qualitative_heatmap.png'],
+    },
+}
+
+
+# コマンド名（python analyze.py <command> ...）とステップ名の対応．ステップ名もそのまま指定できる
+COMMANDS = {'validate': 'validation', 'regress': 'regression'}
+
+
+def append_participants(csv_files):
+    """
+    新しい参加者のファイルのみを読み込んで十分統計量を更新し，操作チェック・操作強度の検定・重回帰分析・
+    多重共線性のレポートを APPEND_OUTPUT_DIR に作成する（パイプラインの出力とそのキャッシュは変更しない）．
+    追加した十分統計量はパイプラインを実行しても保持されるが，匿名化データが変わった場合は
+    quant_data のファイルから作り直されるため，追加した参加者のファイルは quant_data にも置いておく
+    """
+    from program.format_data import parse_participant, build_response_table
+    from program.suffstats import update_suffstats, save_suffstats_reports
+
+    if not os.path.exists(SUFFSTATS_PATH):
+        print("[!] Sufficient statistics not found: run 'python analyze.py suffstats' first.")
+        return
+
+    qual_dir = os.path.join(RAW_DATA_DIR, 'qual_data')
+    fragments = []
+    for csv_file in csv_files:
+        fragment, _ = parse_participant(csv_file, qual_dir)
+        if fragment is None:
+            print(f"[!] Failed to read: {csv_file}")
+            continue
+        fragments.append(fragment)
+    if not fragments:
+        return
+
+    # 参加者属性（参加者テーブル）は十分統計量に含めないため回答テーブルのみを作成する
+    df_new = fill_missing_q7(build_response_table(fragments))
+    n_added = update_suffstats(df_new, SUFFSTATS_PATH)
+    print(f"\n[i] Participants appended: {n_added}")
+    if n_added:
+        save_suffstats_reports(SUFFSTATS_PATH, APPEND_OUTPUT_DIR)
+
+
+def run_chunked(chunk_size, n_jobs):
+    """
+    全ステップを PID で分割したチャンクごとに実行する（メモリ使用量はチャンクの大きさで決まる）
+    """
+    from program.chunked import partition_study, run_chunked_analysis
+
+    print(f"=== Analysis Pipeline Started (chunked: {chunk_size} participants per chunk) ===")
+    n_participants = partition_study(
+        RAW_DATA_DIR, STORE_DIR, chunk_size=chunk_size, n_jobs=n_jobs, output_dir=OUTPUT_DIR, export_csv=EXPORT_CSV
+    )
+    if n_participants:
+        run_chunked_analysis(
+            STORE_DIR, OUTPUT_DIR, prepare=fill_missing_q7, stats_path=SUFFSTATS_PATH, export_csv=EXPORT_CSV,
+            standardize_dtype=STANDARDIZE_DTYPE, n_boot=BOOTSTRAP_RESAMPLES, seed=BOOTSTRAP_SEED, n_jobs=n_jobs
+        )
+    print("\n=== All Analysis Steps Completed Successfully ===")
+
+
+def main(argv=None):
+    commands = {step: command for command, step in COMMANDS.items()}
+    parser = argparse.ArgumentParser(description='Analysis pipeline')
+    parser.add_argument(
+        'targets', nargs='*', metavar='command',
+        help=f"steps to run with their dependencies ({', '.join(commands.get(s, s) for s in STEPS)}, all). default: all"
+    )
+    parser.add_argument('--force', action='store_true', help='re-run the steps even if unchanged')
+    parser.add_argument('--no-cache', action='store_true', help='neither read nor write the step cache')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=N_JOBS,
+        help='number of worker processes: independent steps run concurrently, and participant parsing, '
+             'tokenization, bootstrap and permutation tests run in parallel within a step'
+    )
+    parser.add_argument('--no-figures', action='store_true', help='skip rendering the figures (headless batch runs)')
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='record time, CPU time, peak memory, rows and bytes written per step and function in run_profile.json'
+    )
+    parser.add_argument(
+        '--profile-memory', action='store_true',
+        help='also record the tracemalloc peak (implies --profile; slows the run down)'
+    )
+    parser.add_argument(
+        '--profile-dump', action='store_true',
+        help='also save a cProfile dump per step in profiles/<step>.prof (implies --profile)'
+    )
+    parser.add_argument(
+        '--append', nargs='+', metavar='CSV',
+        help=f"add new participants (quantitative CSV files) to the sufficient statistics and write the reports to {APPEND_OUTPUT_DIR}"
+    )
+    parser.add_argument(
+        '--chunked', nargs='?', type=int, const=CHUNK_PARTICIPANTS, metavar='N',
+        help=f"run all steps out of core on PID chunks of N participants (default N: {CHUNK_PARTICIPANTS}); "
+             "the step cache is not used and the strength test is parametric"
+    )
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs needs a positive number of processes")
+    set_jobs(args.jobs)
+    configure_figures(enabled=not args.no_figures, n_jobs=FIGURE_JOBS)
+    configure_profiling(
+        enabled=args.profile, memory=args.profile_memory,
+        dump_dir=os.path.join(OUTPUT_DIR, 'profiles') if args.profile_dump else None
+    )
+
+    if args.append:
+        append_participants(args.append)
+        save_run_profile(OUTPUT_DIR)
+        return
+
+    if args.chunked is not None:
+        if args.targets:
+            parser.error("--chunked runs all steps (no command can be given)")
+        if args.chunked < 1:
+            parser.error("--chunked needs a positive number of participants")
+        try:
+            run_chunked(args.chunked, N_JOBS)
+        finally:
+            shutdown_figures()
+            save_run_profile(OUTPUT_DIR)
+        return
+
+    targets = [COMMANDS.get(t, t) for t in args.targets or ['all']]
+    if 'all' in targets:
+        targets = list(STEPS)
+    unknown = [t for t in targets if t not in STEPS]
+    if unknown:
+        parser.error(f"unknown target(s): {', '.join(unknown)}")
+
+    print("=== Analysis Pipeline Started ===")
 
-    # 7. 重回帰分析
-    run_regression(df_std, OUTPUT_DIR)
-    
-    # 8. 定性分析: 自由記述回答に対する形態素解析・頻出語分析
-    if df_anon is not None:
-        run_qualitative_analysis(df_anon, OUTPUT_DIR)
+    from program.pipeline import run_pipeline
+    try:
+        run_pipeline(
+            STEPS, targets, OUTPUT_DIR, store_dir=STORE_DIR,
+            use_cache=not args.no_cache, force=args.force, n_jobs=N_JOBS,
+            initializer=set_jobs, initargs=(N_JOBS,)
+        )
+    finally:
+        shutdown_figures()
+        save_run_profile(OUTPUT_DIR)
 
     print("\n=== All Analysis Steps Completed Successfully ===")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
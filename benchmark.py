@@ -0,0 +1,191 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import datetime
+import subprocess
+import tracemalloc
+
+# 計測する参加者数の既定値（100000名は --sizes で指定する．形態素解析を含めると数時間かかる）
+DEFAULT_SIZES = [100, 10000]
+
+# 計測するステップとその入力となるステップ
+BENCHMARK_STEPS = {
+    'format': {'deps': []},
+    'validation': {'deps': ['format']},
+    'standardize': {'deps': ['format']},
+    'strength': {'deps': ['standardize']},
+    'regression': {'deps': ['standardize']},
+    'qualitative': {'deps': ['format']},
+}
+
+# 計測結果の保存先（コミットごとの結果を追記する）
+RESULTS_PATH = os.path.join('benchmarks', 'results.jsonl')
+
+
+def git_revision():
+    """
+    計測したコードのコミット（取得できない場合は None）と未コミットの変更の有無
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=root, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        status = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root, capture_output=True, text=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit, bool(status.strip())
+
+
+def make_steps(study_dir, output_dir, n_jobs):
+    """
+    ステップ名と (依存ステップの結果の辞書を受け取り結果を返す関数) の対応
+    """
+    from program.format_data import format_data
+    from program.validation import run_validation
+    from program.standardize import run_standardize
+    from program.check_strength import run_strength_check
+    from program.regression import run_regression
+    from program.qualitative import run_qualitative_analysis
+    from analyze import fill_missing_q7
+
+    def anonymize(tables):
+        # 匿名化（参加者属性を含まない回答テーブルを用いる）と q7 の欠損値の置換
+        # （analyze.py の anonymize ステップと同じ．計測の対象外）
+        return fill_missing_q7(tables['responses'].copy(deep=False))
+
+    return {
+        'format': lambda r: anonymize(
+            format_data(study_dir, output_dir, n_jobs=n_jobs, use_cache=False, export_csv=False)
+        ),
+        'validation': lambda r: run_validation(r['format'], output_dir),
+        'standardize': lambda r: run_standardize(r['format'], output_dir, export_csv=False),
+        'strength': lambda r: run_strength_check(r['standardize'], output_dir, n_jobs=n_jobs),
+        'regression': lambda r: run_regression(r['standardize'], output_dir, n_jobs=n_jobs),
+        'qualitative': lambda r: run_qualitative_analysis(r['format'], output_dir, token_cache=False, n_jobs=n_jobs),
+    }
+
+
+def run_steps(steps, names, memory):
+    """
+    ステップを順に実行し，ステップごとの実行時間（秒）とメモリ使用量のピーク（MB．memory=False の場合は None）を返す．
+    ステップの出力（進捗表示）は抑制する
+    """
+    results, measures = {}, {}
+    for name in names:
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                if memory:
+                    tracemalloc.start()
+                start = time.perf_counter()
+                results[name] = steps[name](results)
+                seconds = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1] / 2 ** 20 if memory else None
+            finally:
+                if memory:
+                    tracemalloc.stop()
+                sys.stdout = stdout
+        measures[name] = (seconds, peak)
+    return measures
+
+
+def load_previous(results_path, commit):
+    """
+    別のコミットでの直近の計測結果 {(参加者数, ステップ): 記録}
+    """
+    previous = {}
+    if not os.path.exists(results_path):
+        return previous
+    with open(results_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('commit') != commit:
+                previous[(record['n_participants'], record['step'])] = record
+    return previous
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the analysis steps on synthetic studies')
+    parser.add_argument(
+        '--sizes', nargs='+', type=int, default=DEFAULT_SIZES,
+        help=f"numbers of participants. default: {' '.join(map(str, DEFAULT_SIZES))}"
+    )
+    parser.add_argument(
+        '--steps', nargs='+', choices=list(BENCHMARK_STEPS), default=list(BENCHMARK_STEPS),
+        help='steps to measure (their inputs are always computed)'
+    )
+    parser.add_argument('--work-dir', default=os.path.join('benchmarks', 'work'), help='where to generate the studies')
+    parser.add_argument('--results', default=RESULTS_PATH, help='JSON lines file the results are appended to')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass (timing only)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of worker processes used by the steps')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic studies')
+    parser.add_argument('--keep', action='store_true', help='keep the generated studies')
+    args = parser.parse_args(argv)
+
+    from program.synthetic import generate_study
+    from program.figures import configure_figures
+    from program.pipeline import resolve_order
+
+    # グラフの描画は計測の対象外とする
+    configure_figures(enabled=False)
+
+    commit, dirty = git_revision()
+    previous = load_previous(args.results, commit)
+    # 計測するステップの入力となるステップも実行する
+    names = resolve_order(BENCHMARK_STEPS, args.steps)
+
+    print(f"=== Benchmark ({commit or 'unknown commit'}{' + local changes' if dirty else ''}) ===")
+    records = []
+    for n in args.sizes:
+        study_dir = os.path.join(args.work_dir, f"study_{n}")
+        output_dir = os.path.join(study_dir, 'generated')
+        if not os.path.exists(os.path.join(study_dir, 'quant_data')):
+            start = time.perf_counter()
+            generate_study(study_dir, n, seed=args.seed)
+            print(f"\n[i] Synthetic study generated: {study_dir} ({time.perf_counter() - start:.1f}s)")
+        os.makedirs(output_dir, exist_ok=True)
+
+        steps = make_steps(study_dir, output_dir, args.jobs)
+        timing = run_steps(steps, names, memory=False)
+        memory = run_steps(steps, names, memory=True) if not args.no_memory else {}
+
+        print(f"\n[Participants: {n}]")
+        print(f"{'Step':<12} {'Time (s)':>10} {'Peak (MB)':>10} {'Prev (s)':>10} {'Ratio':>7}")
+        print("-" * 53)
+        for name in args.steps:
+            seconds = timing[name][0]
+            peak = memory[name][1] if name in memory else None
+            prev = previous.get((n, name))
+            row = f"{name:<12} {seconds:10.3f} " + (f"{peak:10.1f}" if peak is not None else f"{'-':>10}")
+            if prev:
+                row += f" {prev['seconds']:10.3f} {seconds / prev['seconds']:7.2f}"
+            print(row)
+            records.append({
+                'commit': commit, 'dirty': dirty,
+                'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(), 'n_jobs': args.jobs,
+                'n_participants': n, 'step': name, 'seconds': seconds, 'peak_mb': peak,
+            })
+
+        if not args.keep:
+            shutil.rmtree(study_dir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+    with open(args.results, 'a', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    print(f"\n[i] Benchmark results appended: {args.results}")
+
+
+if __name__ == "__main__":
+    main()
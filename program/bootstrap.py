@@ -0,0 +1,111 @@
+import numpy as np
+from scipy import stats
+from concurrent.futures import ProcessPoolExecutor
+
+# 1回の配列演算でまとめて処理する再標本の数
+CHUNK_SIZE = 500
+
+
+def _solve(xtx, xty):
+    """
+    (再標本数, k, k) と (再標本数, k, 目的変数数) の連立方程式をまとめて解く．
+    一括で解けない場合は再標本ごとに解き直し，特異な再標本のみ擬似逆行列を用いる
+    """
+    try:
+        return np.linalg.solve(xtx, xty)
+    except np.linalg.LinAlgError:
+        if xtx.ndim == 2:
+            return np.linalg.pinv(xtx) @ xty
+        return np.stack([_solve(a, b) for a, b in zip(xtx, xty)])
+
+
+def _resample(xtx_blocks, xty_blocks, seed, size):
+    """
+    参加者を復元抽出した size 個の再標本の回帰係数．
+    各参加者の抽出回数を重みとして参加者ごとの積和行列の重み付き和を求め，k×k の連立方程式を解く
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = len(xtx_blocks)
+    weights = rng.multinomial(n_clusters, np.full(n_clusters, 1 / n_clusters), size=size).astype(np.float64)
+    return _solve(np.tensordot(weights, xtx_blocks, axes=1), np.tensordot(weights, xty_blocks, axes=1))
+
+
+# ワーカープロセスごとに1度だけ受け取る参加者ごとの積和行列
+_worker_blocks = None
+
+
+def _init_worker(xtx_blocks, xty_blocks):
+    global _worker_blocks
+    _worker_blocks = (xtx_blocks, xty_blocks)
+
+
+def _resample_chunk(task):
+    seed, size = task
+    return _resample(*_worker_blocks, seed, size)
+
+
+def _quantiles(sorted_boot, probs):
+    """
+    昇順に並べた再標本（再標本数 × ...）から，要素ごとに異なる確率 probs（2 × ...）の分位点を線形補間で求める
+    """
+    n_boot = len(sorted_boot)
+    pos = np.clip(np.nan_to_num(probs, nan=0.5), 0, 1) * (n_boot - 1)
+    lower = np.floor(pos).astype(np.int64)
+    upper = np.minimum(lower + 1, n_boot - 1)
+    frac = pos - lower
+    lo = np.take_along_axis(sorted_boot, lower, axis=0)
+    hi = np.take_along_axis(sorted_boot, upper, axis=0)
+    return lo + (hi - lo) * frac
+
+
+def cluster_bootstrap(xtx_blocks, xty_blocks, n_boot, seed=0, n_jobs=1, alpha=0.05):
+    """
+    クラスター（参加者）単位のブートストラップにより，回帰係数のパーセンタイル信頼区間とBCa信頼区間を求める．
+    xtx_blocks: 参加者ごとの X'X (参加者数 × k × k), xty_blocks: 参加者ごとの X'y (参加者数 × k × 目的変数数)
+    再標本は CHUNK_SIZE 個ずつ配列演算でまとめて処理し，n_jobs >= 2 の場合はプロセス並列で処理する．
+    乱数は seed から SeedSequence でチャンクごとに分岐させるため，並列数によらず結果は同一．
+    BCa の加速度は参加者を1名ずつ除いたジャックナイフ推定量から求める
+    """
+    n_clusters = len(xtx_blocks)
+    sizes = [CHUNK_SIZE] * (n_boot // CHUNK_SIZE)
+    if n_boot % CHUNK_SIZE:
+        sizes.append(n_boot % CHUNK_SIZE)
+    tasks = list(zip(np.random.SeedSequence(seed).spawn(len(sizes)), sizes))
+
+    if n_jobs and n_jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(
+            max_workers=n_jobs, initializer=_init_worker, initargs=(xtx_blocks, xty_blocks)
+        ) as executor:
+            chunks = list(executor.map(_resample_chunk, tasks))
+    else:
+        chunks = [_resample(xtx_blocks, xty_blocks, s, size) for s, size in tasks]
+    boot = np.concatenate(chunks)
+
+    # 全参加者での推定値と，参加者を1名ずつ除いた推定値（ジャックナイフ）
+    total_xtx = xtx_blocks.sum(axis=0)
+    total_xty = xty_blocks.sum(axis=0)
+    estimate = _solve(total_xtx[None], total_xty[None])[0]
+    jackknife = _solve(total_xtx - xtx_blocks, total_xty - xty_blocks)
+
+    z_alpha = stats.norm.ppf([alpha / 2, 1 - alpha / 2])[:, None, None]
+    sorted_boot = np.sort(boot, axis=0)
+    percentile = _quantiles(sorted_boot, np.broadcast_to(stats.norm.cdf(z_alpha), (2,) + estimate.shape))
+
+    # BCa: 偏り補正 z0 と加速度 a による分位点の調整
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z0 = stats.norm.ppf((boot < estimate).mean(axis=0))
+        diff = jackknife.mean(axis=0) - jackknife
+        accel = (diff ** 3).sum(axis=0) / (6 * ((diff ** 2).sum(axis=0)) ** 1.5)
+        probs = stats.norm.cdf(z0 + (z0 + z_alpha) / (1 - accel * (z0 + z_alpha)))
+    bca = _quantiles(sorted_boot, probs)
+
+    return {
+        'n_boot': n_boot,
+        'n_clusters': n_clusters,
+        'seed': seed,
+        'alpha': alpha,
+        'estimate': estimate,
+        'se': boot.std(axis=0, ddof=1),
+        'percentile': percentile,
+        'bca': bca,
+    }
@@ -1,17 +1,32 @@
-import seaborn as sns
-import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
 from scipy import stats
 import os
 
-from program.post_hoc import run_tukey_kramer
+from program.figures import FIGURE_DIR, submit_figure
+from program.post_hoc import tukey_kramer_table, save_posthoc_report
+from program.permutation import permutation_test
+from program.profiling import profiled
 
-def run_strength_check(df_std, output_dir):
+# 変化量を求める対象の質問（レポートは Q1，分散分析の表は全質問）
+STRENGTH_TARGETS = ['q1', 'q2', 'q3', 'q4', 'q5', 'q6', 'q7']
+
+# 検定の方法: 'parametric'（F分布・スチューデント化された範囲の分布）または 'permutation'（並べ替え検定）
+TEST_BACKENDS = ('parametric', 'permutation')
+
+@profiled
+def run_strength_check(df_std, output_dir, target_cols=STRENGTH_TARGETS,
+                       backend='parametric', n_perm=10000, seed=0, n_jobs=1):
     """
     各カテゴリの操作強度（Q1の変化量）の均質性を確認する．
+    target_cols の各質問の変化量についても分散分析を行い，表として保存する．
+    backend='permutation' の場合は分散分析と多重比較の p 値を並べ替え検定（n_perm 回）で求める
     """
 
     # 1. 計算パート
-    results = calculate_strength_stats(df_std)
+    results = calculate_strength_stats(
+        df_std, target_cols, backend=backend, n_perm=n_perm, seed=seed, n_jobs=n_jobs
+    )
     
     if not results:
         print("[!] Strength check calculation failed.")
@@ -21,105 +36,266 @@ def run_strength_check(df_std, output_dir):
     save_strength_outputs(results, output_dir)
 
 
-def calculate_strength_stats(df_std):
+def delta_col(target):
+    return f"Delta_{target.upper()}_std"
+
+
+def compute_deltas(df_std, target_cols=STRENGTH_TARGETS):
+    """
+    刺激条件の各行について，同じ参加者のBase条件との差分（刺激 - Base）を求める．
+    Base の行とはPIDをキーとして1回の結合で対応付ける（同じPIDのBaseが複数ある場合は最後の行）．
+    Base がない，または値が欠損している場合の差分は欠損値とする
+    """
+    target_cols = [c for c in target_cols if c in df_std.columns]
+    is_base = (df_std['Category'] == 'base').to_numpy()
+
+    base = df_std.loc[is_base & df_std['PID'].notna().to_numpy(), ['PID'] + target_cols]
+    base = base.drop_duplicates('PID', keep='last').set_index('PID')
+    stim = df_std.loc[~is_base, ['PID', 'Category', 'Level'] + target_cols]
+
+    pos = base.index.get_indexer(stim['PID'])
+    base_values = np.vstack([base.to_numpy(dtype=np.float64), np.full((1, len(target_cols)), np.nan)])
+    deltas = stim[target_cols].to_numpy(dtype=np.float64) - base_values[pos]
+
+    result = stim.copy()
+    for i, col in enumerate(target_cols):
+        result[delta_col(col)] = deltas[:, i]
+    return result
+
+
+def group_moments(deltas, target_cols=STRENGTH_TARGETS):
+    """
+    (Level, Category) ごとの変化量の件数・平均・標準偏差を全質問について1回の集約で求め，
+    縦長の表（列: Target, Level, Category, n, mean, std）で返す．欠損値は質問ごとに除外する
+    """
+    target_cols = [c for c in target_cols if delta_col(c) in deltas.columns]
+    agg = deltas.groupby(['Level', 'Category'], observed=True)[[delta_col(c) for c in target_cols]].agg(['count', 'mean', 'std'])
+
+    frames = []
+    for col in target_cols:
+        g = agg[delta_col(col)]
+        g = g[g['count'] > 0]
+        frames.append(pd.DataFrame({
+            'Target': col,
+            'Level': g.index.get_level_values('Level'),
+            'Category': g.index.get_level_values('Category').to_numpy(),
+            'n': g['count'].to_numpy(dtype=np.int64),
+            'mean': g['mean'].to_numpy(),
+            'std': g['std'].to_numpy(),
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def delta_sums(deltas, target_cols=STRENGTH_TARGETS):
+    """
+    (Level, Category) ごとの変化量の件数・和・平方和を全質問について求める．
+    参加者を分割して求めた表は足し合わせられる（PID で分割した処理用）．
+    戻り値: 列 Target, Level, Category, n, sum, sumsq の表
+    """
+    target_cols = [c for c in target_cols if delta_col(c) in deltas.columns]
+    values = deltas[[delta_col(c) for c in target_cols]]
+    keys = [deltas['Level'], deltas['Category']]
+    n = values.notna().groupby(keys, observed=True).sum()
+    total = values.groupby(keys, observed=True).sum()
+    total_sq = (values ** 2).groupby(keys, observed=True).sum()
+
+    frames = []
+    for col in target_cols:
+        frames.append(pd.DataFrame({
+            'Target': col,
+            'Level': n.index.get_level_values('Level').to_numpy(),
+            'Category': n.index.get_level_values('Category').to_numpy(),
+            'n': n[delta_col(col)].to_numpy(dtype=np.int64),
+            'sum': total[delta_col(col)].to_numpy(),
+            'sumsq': total_sq[delta_col(col)].to_numpy(),
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def merge_delta_sums(sums_list):
+    """
+    delta_sums の結果を (Target, Level, Category) ごとに足し合わせる
+    """
+    sums = pd.concat([s for s in sums_list if s is not None], ignore_index=True)
+    sums['Category'] = sums['Category'].astype(object)
+    return sums.groupby(['Target', 'Level', 'Category'], sort=False)[['n', 'sum', 'sumsq']].sum().reset_index()
+
+
+def groups_from_sums(sums, target='q1'):
+    """
+    (Level, Category) ごとの件数・和・平方和の表（列: Level, Category, n, sum, sumsq）を
+    group_moments と同じ形式の表に変換する．Target 列がある場合は質問ごとの表として扱う
+    """
+    if 'Target' not in sums.columns:
+        sums = sums.assign(Target=target)
+    sums = sums[sums['n'] > 0].sort_values(['Target', 'Level', 'Category'])
+    n = sums['n'].to_numpy(dtype=np.float64)
+    mean = sums['sum'].to_numpy() / n
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var = (sums['sumsq'].to_numpy() - sums['sum'].to_numpy() * mean) / (n - 1)
+    return pd.DataFrame({
+        'Target': sums['Target'].to_numpy(),
+        'Level': sums['Level'].to_numpy(),
+        'Category': sums['Category'].to_numpy(),
+        'n': sums['n'].to_numpy(dtype=np.int64),
+        'mean': mean,
+        'std': np.sqrt(np.maximum(var, 0)),
+    })
+
+
+def anova_by_level(groups):
+    """
+    群ごとの件数・平均・標準偏差の表から，(Target, Level) ごとの一元配置分散分析（stats.f_oneway と同じ検定）を
+    まとめて行う．列: Target, Level, k（群の数）, n, df_between, df_within, f, p, valid（2群以上）
+    """
+    g = groups.copy()
+    g['sum'] = g['n'] * g['mean']
+    g['m2'] = ((g['n'] - 1) * g['std'] ** 2).where(g['n'] > 1, 0.0)
+
+    keys = ['Target', 'Level']
+    totals = g.groupby(keys, sort=False)[['n', 'sum']].transform('sum')
+    g['between'] = g['n'] * (g['mean'] - totals['sum'] / totals['n']) ** 2
+
+    table = g.groupby(keys, sort=False).agg(
+        k=('Category', 'size'), n=('n', 'sum'), ss_between=('between', 'sum'), ss_within=('m2', 'sum')
+    ).reset_index()
+    table['df_between'] = table['k'] - 1
+    table['df_within'] = table['n'] - table['k']
+    table['valid'] = table['k'] >= 2
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        f_stat = (table['ss_between'] / table['df_between']) / (table['ss_within'] / table['df_within'])
+    f_stat = f_stat.where(table['valid'])
+    table['f'] = f_stat
+    table['p'] = stats.f.sf(f_stat, table['df_between'], table['df_within'])
+    return table.drop(columns=['ss_between', 'ss_within'])
+
+
+def permutation_anova(deltas, anova_table, n_perm=10000, seed=0, n_jobs=1):
+    """
+    分散分析の表の各 (Target, Level) について並べ替え検定を行い，p 値を置き換えた表と
+    全ての水準の多重比較の表（tukey_kramer_table と同じ列構成）を返す．
+    パラメトリックな p 値は p_param 列に残す．乱数は (Target, Level) ごとに seed から分岐させる
+    """
+    table = anova_table.copy()
+    table['p_param'] = table['p']
+    pairs = []
+    for idx, row_seed in zip(table.index, np.random.SeedSequence(seed).spawn(len(table))):
+        if not table.at[idx, 'valid']:
+            continue
+        target, lvl = table.at[idx, 'Target'], table.at[idx, 'Level']
+        values = deltas.loc[deltas['Level'] == lvl, ['Category', delta_col(target)]].dropna()
+        res = permutation_test(values[delta_col(target)], values['Category'], n_perm, seed=row_seed, n_jobs=n_jobs)
+        table.at[idx, 'p'] = res['p']
+        pairs.append(res['pairs'].assign(Target=target, Level=lvl))
+    columns = ['Target', 'Level', 'group1', 'group2', 'meandiff', 'q', 'p_raw', 'p_adj', 'reject']
+    posthoc = pd.concat(pairs, ignore_index=True)[columns] if pairs else pd.DataFrame(columns=columns)
+    return table, posthoc
+
+
+@profiled
+def calculate_strength_stats(df_std, target_cols=STRENGTH_TARGETS,
+                             backend='parametric', n_perm=10000, seed=0, n_jobs=1):
     """
     計算パート
     データの差分計算、記述統計、ANOVA検定を行う。
+    戻り値: deltas（刺激条件の行ごとの変化量）, groups（群ごとの記述統計）, anova（水準ごとの検定結果）,
+    posthoc（全水準・全質問の多重比較．レポートには分散分析で有意差があった水準のみを出力する）の表と検定の方法
     """
     if 'Level' not in df_std.columns:
         print("[!] 'Level' column is missing.")
         return None
+    if backend not in TEST_BACKENDS:
+        raise ValueError(f"Unknown test backend: {backend} ({', '.join(TEST_BACKENDS)})")
 
-    # 必要な列だけコピー
-    data = df_std[['PID', 'Category', 'Level', 'q1']].copy()
+    target_cols = list(dict.fromkeys(['q1'] + [c for c in target_cols if c in df_std.columns]))
+    deltas = compute_deltas(df_std, target_cols)
+    groups = group_moments(deltas, target_cols)
+    anova_table = anova_by_level(groups)
 
-    # Baseとの差分（変化量）の算出
-    base_map = data[data['Category'] == 'base'].set_index('PID')['q1'].to_dict()
-    
-    # 刺激データのみ抽出 (Base以外)
-    stim_df_all = data[data['Category'] != 'base'].copy()
-    
-    # 差分（Stimulus - Base）を計算
-    stim_df_all['Delta_Q1_std'] = stim_df_all.apply(
-        lambda row: row['q1'] - base_map.get(row['PID']) if row['PID'] in base_map else None, axis=1
-    )
-    stim_df_all.dropna(subset=['Delta_Q1_std'], inplace=True)
-    
-    # レベルごとの解析結果を格納する
-    level_analyses = {}
-    levels = sorted(stim_df_all['Level'].unique())
+    if backend == 'permutation':
+        anova_table, posthoc = permutation_anova(deltas, anova_table, n_perm, seed=seed, n_jobs=n_jobs)
+        method = f"Permutation Tukey-Kramer, {n_perm} permutations"
+    else:
+        posthoc = tukey_kramer_table(groups)
+        method = "Tukey-Kramer Method"
+
+    return {
+        'deltas': deltas,
+        'groups': groups,
+        'anova': anova_table,
+        'posthoc': posthoc,
+        'method': method
+    }
 
-    for lvl in levels:
-        stim_df = stim_df_all[stim_df_all['Level'] == lvl].copy()
-        if stim_df.empty:
-            continue
-            
-        # 1. 記述統計
-        desc_stats = stim_df.groupby('Category')['Delta_Q1_std'].agg(['count', 'mean', 'std'])
-        
-        # 2. ANOVA
-        groups = [g['Delta_Q1_std'].values for n, g in stim_df.groupby('Category')]
-        
-        if len(groups) >= 2:
-            f_stat, p_val = stats.f_oneway(*groups)
-            anova_res = {'f': f_stat, 'p': p_val, 'valid': True}
-        else:
-            anova_res = {'f': None, 'p': None, 'valid': False}
-            
-        level_analyses[lvl] = {
-            'stim_df': stim_df,
-            'desc_stats': desc_stats,
-            'anova': anova_res
-        }
 
+def strength_results_from_sums(sums):
+    """
+    (Level, Category) ごとの変化量の件数・和・平方和（Target 列がない場合は Q1）から
+    calculate_strength_stats と同じ形式の結果を作る．
+    個々の値を持たないため，グラフは作成しない（deltas は None）
+    """
+    groups = groups_from_sums(sums)
     return {
-        'stim_df_all': stim_df_all,
-        'level_analyses': level_analyses
+        'deltas': None,
+        'groups': groups,
+        'anova': anova_by_level(groups),
+        'posthoc': tukey_kramer_table(groups),
+        'method': "Tukey-Kramer Method"
     }
 
 
+@profiled
 def save_strength_outputs(results, output_dir):
     """
     出力パート
     """
-    fig_dir = os.path.join(output_dir, 'figures')
-    os.makedirs(fig_dir, exist_ok=True)
-    
-    stim_df_all = results['stim_df_all']
-    level_analyses = results['level_analyses']
-    
+    fig_dir = os.path.join(output_dir, FIGURE_DIR)
+
+    deltas = results['deltas']
+    groups = results['groups']
+    anova_table = results['anova']
+    posthoc = results['posthoc']
+
+    # Q1 の変化量が求まった行（グラフ・多重比較の対象）
+    stim_df_all = None
+    if deltas is not None:
+        stim_df_all = deltas[deltas[delta_col('q1')].notna()]
+
     # --- 1. 統合グラフの作成 (hue='Level') ---
-    stim_df_plot = stim_df_all.copy()
-    stim_df_plot['Level'] = stim_df_plot['Level'].astype(str)
-
-    plt.figure(figsize=(12, 7))
-    sns.boxplot(
-        x='Category', 
-        y='Delta_Q1_std', 
-        hue='Level',
-        data=stim_df_plot, 
-        palette='viridis'
-    )
-    plt.title('Manipulation Strength Check: Comparison by Level')
-    plt.ylabel('Strength of Manipulation (Delta Z-Score of Q1)')
-    plt.xlabel('Manipulation Category')
-    plt.axhline(0, color='gray', linestyle='--', linewidth=0.8)
-    plt.legend(title='Stimulus Level', loc='upper right')
-    plt.tight_layout()
-    
+    # 十分統計量からの報告（個々の値なし）の場合はグラフを更新しない
     plot_path = os.path.join(fig_dir, 'strength_check.png')
-    plt.savefig(plot_path)
-    plt.close()
-    
+    plotted = False
+    if stim_df_all is not None:
+        plotted = submit_figure(
+            'strength_boxplot', stim_df_all[['Category', delta_col('q1'), 'Level']], plot_path,
+            'strength check figure'
+        )
+
+    # 全質問の分散分析・多重比較の表（十分統計量からの報告でも作成する）
+    table_path = os.path.join(output_dir, 'strength_anova.csv')
+    anova_table.to_csv(table_path, index=False, encoding='utf-8-sig')
+    print(f"\n[i] Strength ANOVA table saved: {table_path}")
+    posthoc_path = os.path.join(output_dir, 'strength_posthoc.csv')
+    posthoc.to_csv(posthoc_path, index=False, encoding='utf-8-sig')
+    print(f"\n[i] Strength post-hoc table saved: {posthoc_path}")
+
     # 2. テキストレポート作成 & Post-hoc
     lines = []
     lines.append("="*60)
     lines.append("  Manipulation Strength Check Report (By Level)")
     lines.append("  (Delta Q1 = Stimulus_Z - Base_Z)")
     lines.append("="*60)
-    lines.append(f"\n[Graph Output] {plot_path}")
+    if plotted:
+        lines.append(f"\n[Graph Output] {plot_path}")
+    elif stim_df_all is not None:
+        lines.append("\n[Graph Output] (not rendered: figures disabled)")
+    else:
+        lines.append("\n[Graph Output] (not updated: report from sufficient statistics)")
 
-    for lvl, analysis in level_analyses.items():
+    q1_groups = groups[groups['Target'] == 'q1']
+    q1_anova = anova_table[anova_table['Target'] == 'q1'].set_index('Level')
+    for lvl, desc_stats in q1_groups.groupby('Level', sort=True):
         lines.append(f"\n{'#'*40}")
         lines.append(f"  Level {lvl} Analysis")
         lines.append(f"{'#'*40}")
@@ -128,24 +304,27 @@ def save_strength_outputs(results, output_dir):
         lines.append("\n[Descriptive Statistics]")
         lines.append(f"{'Category':<12} {'N':>5} {'Mean':>8} {'Std':>8}")
         lines.append("-" * 40)
-        for cat, row in analysis['desc_stats'].iterrows():
-            lines.append(f"{cat:<12} {int(row['count']):5d} {row['mean']:8.3f} {row['std']:8.3f}")
+        for row in desc_stats.sort_values('Category').itertuples(index=False):
+            lines.append(f"{row.Category:<12} {int(row.n):5d} {row.mean:8.3f} {row.std:8.3f}")
         lines.append("-" * 40)
 
         # ANOVA
-        anova = analysis['anova']
+        anova = q1_anova.loc[lvl]
         if anova['valid']:
             lines.append(f"\n[ANOVA Results] F={anova['f']:.4f}, p={anova['p']:.4f}")
+            if 'p_param' in anova:
+                lines.append(f"   (p: {results['method']}, parametric p={anova['p_param']:.4f})")
             
             if anova['p'] < 0.05:
                 lines.append(">> Result: Significant difference found (Heterogeneous strength).")
                 
-                # Post-hoc呼び出し
-                try:
-                    run_tukey_kramer(analysis['stim_df'], output_dir, lvl)
+                # Post-hoc: 多重比較の表から該当する水準の結果を出力
+                pairs = posthoc[(posthoc['Target'] == 'q1') & (posthoc['Level'] == lvl)]
+                if pairs.empty:
+                    lines.append("   [!] Post-hoc failed: no comparable groups")
+                else:
+                    save_posthoc_report(pairs, output_dir, lvl, results['method'])
                     lines.append(f"   (See 'post-hoc_level{lvl}.txt' in output dir)")
-                except Exception as e:
-                    lines.append(f"   [!] Post-hoc failed: {e}")
             else:
                 lines.append(">> Result: No significant difference (Homogeneous strength).")
         else:
@@ -0,0 +1,163 @@
+import os
+import glob
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+import pandas as pd
+
+from program.format_data import parse_participant, build_participant_table, build_response_table, join_participants
+from program.store import save_partition, iter_partitions, delete_partitions
+from program.demographics import run_demographics
+from program.validation import paired_ttest_sums, merge_paired_sums, paired_ttest_from_sums, save_validation_outputs
+from program.standardize import run_standardize
+from program.check_strength import (
+    compute_deltas, delta_sums, merge_delta_sums, strength_results_from_sums, save_strength_outputs
+)
+from program.regression import (
+    EXPLANATORY_VARS, TARGETS, design_grams, merge_grams, regression_results_from_grams, save_regression_outputs
+)
+from program.bootstrap import cluster_bootstrap
+from program.multico import run_multicollinearity_check
+from program.suffstats import update_suffstats, registered_pids, warn_dropped_participants
+from program.qualitative import calculate_qualitative_counts, merge_qualitative_counts, save_qualitative_outputs
+from program.figures import wait_figures
+from program.profiling import profiled
+
+# 1チャンクあたりの参加者数の既定値
+CHUNK_PARTICIPANTS = 5000
+
+# 分割して保存する中間データ名
+PARTITIONED_FRAMES = ['participants', 'responses', 'integrated_tidy_data_anon', 'standardized_data']
+
+
+def _append_csv(df, path, first):
+    """
+    チャンクを CSV に追記する（最初のチャンクはヘッダー付きで新規に作成する）
+    """
+    df.to_csv(path, mode='w' if first else 'a', header=first, index=False, encoding='utf-8-sig')
+
+
+@profiled
+def partition_study(base_dir, store_dir, chunk_size=CHUNK_PARTICIPANTS, n_jobs=1, output_dir=None, export_csv=False):
+    """
+    参加者ファイルを chunk_size 名ずつ読み込み，参加者テーブル・回答テーブルを PID で分割した中間データ
+    （participants, responses のチャンク）として保存する．同時にメモリに保持するのは1チャンク分のみ．
+    参加者ごとの整形結果のキャッシュは用いない．PID は参加者ファイルごとに異なるものとする．
+    export_csv=True の場合は統合データを output_dir/integrated_tidy_data.csv にチャンクごとに追記する．
+    戻り値: 読み込んだ参加者数
+    """
+    quant_dir = os.path.join(base_dir, 'quant_data')
+    qual_dir = os.path.join(base_dir, 'qual_data')
+    # 参加者の順序（出力する CSV の行の順序）は format_data と同じ glob の順とする
+    csv_files = [os.path.abspath(p) for p in glob.glob(os.path.join(quant_dir, '*.csv'))]
+
+    for name in PARTITIONED_FRAMES:
+        delete_partitions(store_dir, name)
+
+    n_participants, n_chunks = 0, 0
+    executor = ProcessPoolExecutor(max_workers=n_jobs) if n_jobs and n_jobs > 1 else None
+    try:
+        for start in range(0, len(csv_files), chunk_size):
+            chunk = csv_files[start:start + chunk_size]
+            if executor is not None:
+                chunksize = max(1, len(chunk) // (n_jobs * 4))
+                parsed = list(executor.map(parse_participant, chunk, repeat(qual_dir), chunksize=chunksize))
+            else:
+                parsed = [parse_participant(c, qual_dir) for c in chunk]
+            fragments = [fragment for fragment, _ in parsed if fragment is not None]
+            if not fragments:
+                continue
+
+            participants = build_participant_table(fragments)
+            responses = build_response_table(fragments)
+            save_partition(participants, store_dir, 'participants', n_chunks)
+            save_partition(responses, store_dir, 'responses', n_chunks)
+            if export_csv:
+                _append_csv(
+                    join_participants(participants, responses),
+                    os.path.join(output_dir, 'integrated_tidy_data.csv'), first=n_chunks == 0
+                )
+            n_participants += len(participants)
+            n_chunks += 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    print(f"\n[i] Participants partitioned: {n_participants} ({n_chunks} chunks of up to {chunk_size})")
+    return n_participants
+
+
+@profiled
+def run_chunked_analysis(store_dir, output_dir, prepare=None, stats_path=None, export_csv=False,
+                         standardize_dtype='float64', n_boot=0, seed=0, n_jobs=1):
+    """
+    PID で分割した中間データ（partition_study の結果）をチャンクごとに処理し，全参加者のレポートを作成する．
+    標準化は参加者内で完結するためチャンクごとに行い，妥当性検証・分散分析・重回帰分析（VIFを含む）・定性分析は
+    チャンクごとの十分統計量（件数・和・平方和・積和行列・語の出現回数）を足し合わせてから検定・集計する．
+    メモリに保持するのは1チャンク分のデータと，参加者数・セル数に比例する集計結果のみ．
+    prepare: チャンクの回答テーブルに適用する前処理（欠損値の置換等），
+    stats_path: 指定した場合は十分統計量（--append 用）も作り直す，
+    n_boot >= 1 の場合は参加者ごとの積和行列を保持してブートストラップ信頼区間を求める．
+    個々の変化量を保持しないため，操作強度のグラフは作成せず，検定はパラメトリックな方法のみとする
+    """
+    previous = registered_pids(stats_path) if stats_path else set()
+    if stats_path and os.path.exists(stats_path):
+        os.remove(stats_path)
+
+    paired, strength, blocks = [], [], []
+    grams, qual = None, None
+    n_chunks = 0
+    for i, responses in enumerate(iter_partitions(store_dir, 'responses')):
+        # 参加者属性は参加者テーブルに分かれているため，回答テーブルがそのまま匿名化データとなる
+        # （CSV は前処理の前の値を出力する．analyze.py の anonymize ステップと同じ）
+        if export_csv:
+            _append_csv(responses, os.path.join(output_dir, 'integrated_tidy_data_anon.csv'), first=i == 0)
+        df_anon = prepare(responses) if prepare is not None else responses
+        save_partition(df_anon, store_dir, 'integrated_tidy_data_anon', i)
+
+        paired.append(paired_ttest_sums(df_anon))
+        qual = merge_qualitative_counts(qual, calculate_qualitative_counts(df_anon, output_dir, n_jobs=n_jobs))
+        if stats_path:
+            update_suffstats(df_anon, stats_path)
+
+        # 被験者内標準化（標準化の列のみを置き換える）
+        df_std = run_standardize(df_anon, output_dir, export_csv=False, dtype=standardize_dtype)
+        save_partition(df_std, store_dir, 'standardized_data', i)
+        if export_csv:
+            _append_csv(df_std, os.path.join(output_dir, 'standardized_data.csv'), first=i == 0)
+
+        strength.append(delta_sums(compute_deltas(df_std)))
+        grams = merge_grams(grams, design_grams(df_std))
+        if n_boot:
+            pid_grams = design_grams(df_std, TARGETS, ['PID'])
+            if pid_grams is not None:
+                blocks.append(pid_grams['gram'])
+        n_chunks += 1
+
+    if not n_chunks:
+        print("[!] No partitioned data found: run the partitioning first.")
+        return
+
+    # 参加者属性（参加者テーブルは参加者数に比例する大きさのため結合して集計する）
+    run_demographics(pd.concat(iter_partitions(store_dir, 'participants'), ignore_index=True), output_dir)
+
+    save_validation_outputs(paired_ttest_from_sums(merge_paired_sums(paired)), output_dir)
+    save_strength_outputs(strength_results_from_sums(merge_delta_sums(strength)), output_dir)
+
+    if grams is None:
+        print("[!] No data found for regression (check Category column).")
+    else:
+        results = regression_results_from_grams(grams)
+        if blocks:
+            k = len(EXPLANATORY_VARS) + 1
+            gram = np.concatenate(blocks)
+            results['bootstrap'] = cluster_bootstrap(gram[:, :k, :k], gram[:, :k, k:], n_boot, seed=seed, n_jobs=n_jobs)
+        save_regression_outputs(results, output_dir)
+        run_multicollinearity_check(None, output_dir, design=results)
+
+    if stats_path:
+        print(f"\n[i] Sufficient statistics saved: {stats_path}")
+        warn_dropped_participants(previous, stats_path)
+    if qual is not None:
+        save_qualitative_outputs(qual, output_dir)
+    wait_figures()
@@ -1,23 +1,43 @@
 import pandas as pd
 import os
 
-def clean_data_for_qualitative(input_file, output_dir):
+from program.store import has_frame, load_frame, save_frame
+from program.schema import apply_schema
+from program.profiling import profiled
+
+# 個人特定につながる属性情報のカラム
+SENSITIVE_COLS = [
+    'Age', 'age', 'Gender', 'gender', 'Sex', 'sex', 
+    'Time', 'time', 'expTime', 'Date'
+]
+
+@profiled
+def clean_data_for_qualitative(input_file, output_dir, store_dir=None, export_csv=True, responses=None):
     """
-    定性分析のために，個人特定につながる属性情報（年齢・性別・時間等）を削除する．
+    定性分析のために，個人特定につながる属性情報（年齢・性別・時間等）を除いたデータを作成する．
+    属性情報は参加者テーブルに分かれているため，回答テーブル（responses，または store_dir の中間データ）を
+    そのまま用いる．どちらもない場合は統合データの CSV（input_file）から属性情報の列を削除する．
+    読み込んだデータは schema.apply_schema の型に揃える
     """
-    try:
-        df = pd.read_csv(input_file)
-    except Exception:
-        return None
+    if responses is None and store_dir and has_frame(store_dir, 'responses'):
+        responses = load_frame(store_dir, 'responses')
+
+    if responses is not None:
+        df_clean = responses.drop(columns=[c for c in SENSITIVE_COLS if c in responses.columns])
+    else:
+        try:
+            df = pd.read_csv(input_file)
+        except Exception:
+            return None
 
-    sensitive_cols = [
-        'Age', 'age', 'Gender', 'gender', 'Sex', 'sex', 
-        'Time', 'time', 'expTime', 'Date'
-    ]
-    cols_to_drop = [c for c in sensitive_cols if c in df.columns]
+        cols_to_drop = [c for c in SENSITIVE_COLS if c in df.columns]
+        df_clean = df.drop(columns=cols_to_drop)
+    df_clean = apply_schema(df_clean)
 
-    df_clean = df.drop(columns=cols_to_drop)
-    output_path = os.path.join(output_dir, 'integrated_tidy_data_anon.csv')
-    df_clean.to_csv(output_path, index=False, encoding='utf-8-sig')
+    if store_dir:
+        save_frame(df_clean, store_dir, 'integrated_tidy_data_anon')
+    if export_csv:
+        output_path = os.path.join(output_dir, 'integrated_tidy_data_anon.csv')
+        df_clean.to_csv(output_path, index=False, encoding='utf-8-sig')
     
-    return df_clean
\ No newline at end of file
+    return df_clean
@@ -1,12 +1,16 @@
 import os
 
+from program.profiling import profiled
+
+@profiled
 def run_demographics(df, output_dir):
     """
     参加者の属性（年齢・性別・所要時間）を集計し，レポートを出力する．
+    df は参加者テーブル（1行 = 参加者．format_data の戻り値の 'participants'）
     """
     report_path = os.path.join(output_dir, 'demographics_report.txt')
     
-    # PIDごとのユニークな属性データを抽出
+    # 参加者テーブルの列を特定
     col_map = {c.lower(): c for c in df.columns}
     pid_col = col_map.get('pid')
     age_col = col_map.get('age')
@@ -16,9 +20,8 @@ def run_demographics(df, output_dir):
     if not (pid_col and age_col and sex_col and time_col):
         return
 
-    cols = [pid_col, age_col, sex_col, time_col]
-    
-    participants = df.groupby(pid_col)[cols].first()
+    # 参加者テーブルは PID ごとに1行のため集約は不要（PIDの順に並べる）
+    participants = df.set_index(pid_col)[[age_col, sex_col, time_col]].sort_index()
     
     with open(report_path, 'w') as f:
         f.write("=== Demographics Report ===\n\n")
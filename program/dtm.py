@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def build_dtm(tokens, meta):
+    """
+    トークン表から文書-単語行列（CSR形式の疎行列）を作成する．
+    tokens: row_id（文書 = metaの行位置）と token を持つ表（tokenize_frame の結果など）
+    meta  : 行メタデータ（Category, Level, PID 等）．行列の行は meta の行に対応する
+    語彙の順序はトークン表での初出順とする
+    """
+    codes, vocab = pd.factorize(tokens['token'], sort=False)
+    row_ids = tokens['row_id'].to_numpy(dtype=np.int64)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(codes), dtype=np.int64), (row_ids, codes)),
+        shape=(len(meta), len(vocab)),
+    )
+    matrix.sum_duplicates()
+    return {
+        'matrix': matrix,
+        'vocab': np.asarray(vocab, dtype=object),
+        'meta': meta.reset_index(drop=True),
+    }
+
+
+def group_matrix(dtm, by):
+    """
+    メタデータの列（複数可）で文書をまとめる指示行列 (グループ数 × 文書数) とグループのラベルを返す．
+    グループの順序は初出順（欠損値も1つのグループとして扱う）
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    keys = dtm['meta'][by]
+    if len(by) == 1:
+        codes, labels = pd.factorize(keys[by[0]], use_na_sentinel=False)
+        labels = pd.Index(labels, name=by[0])
+    else:
+        codes, labels = pd.factorize(pd.MultiIndex.from_frame(keys), use_na_sentinel=False)
+        labels = pd.MultiIndex.from_tuples(list(labels), names=by)
+    n_docs = len(codes)
+    indicator = sparse.csr_matrix(
+        (np.ones(n_docs, dtype=np.int64), (codes, np.arange(n_docs))),
+        shape=(len(labels), n_docs),
+    )
+    return indicator, labels
+
+
+def group_counts(dtm, by):
+    """
+    グループ × 全語彙の出現回数（疎行列）とグループのラベルを返す（参加者ごとの集計など）
+    """
+    indicator, labels = group_matrix(dtm, by)
+    return indicator @ dtm['matrix'], labels
+
+
+def top_words(dtm, n=None):
+    """
+    総出現回数の多い順に語彙のインデックスを返す（同数の場合は初出順）
+    """
+    totals = np.asarray(dtm['matrix'].sum(axis=0)).ravel()
+    order = np.argsort(-totals, kind='stable')
+    order = order[totals[order] > 0]
+    return order if n is None else order[:n]
+
+
+def crosstab(dtm, by, top_n=None, words=None):
+    """
+    グループ × 単語の出現回数表を疎行列の積で求め，選択した語の列のみをDataFrameとして返す．
+    words を指定しない場合は総出現回数の上位 top_n 語（top_n=None なら全語彙）
+    """
+    indicator, labels = group_matrix(dtm, by)
+    if words is None:
+        word_idx = top_words(dtm, top_n)
+    else:
+        position = {w: i for i, w in enumerate(dtm['vocab'])}
+        word_idx = np.array([position[w] for w in words if w in position], dtype=np.int64)
+
+    counts = indicator @ dtm['matrix'][:, word_idx]
+    return pd.DataFrame(counts.toarray(), index=labels, columns=dtm['vocab'][word_idx])
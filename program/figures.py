@@ -0,0 +1,213 @@
+import os
+import atexit
+import platform
+
+# グラフの出力先（output_dir 以下のディレクトリ名）
+FIGURE_DIR = 'figures'
+
+# 描画の設定: enabled=False でグラフを作成しない，n_jobs は描画用のワーカープロセス数（0でその場で描画する）
+_config = {'enabled': True, 'n_jobs': 1}
+
+# 描画用のプロセスプール（作成したプロセスのIDとともに保持し，fork 先では作り直す）
+_executor = None
+_executor_pid = None
+
+# 投入済みで未回収の描画 [(説明, 出力先, Future)]
+_pending = []
+
+
+def configure_figures(enabled=True, n_jobs=1):
+    """
+    グラフ描画の設定を変更する（enabled=False: 描画しない，n_jobs=0: バックグラウンドで描画せずその場で描画する）
+    """
+    _config['enabled'] = enabled
+    _config['n_jobs'] = n_jobs
+
+
+def figures_enabled():
+    return _config['enabled']
+
+
+def _use_agg():
+    # 画面表示を行わない Agg バックエンドで描画する（pyplot の読み込み前に指定する）
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _japanese_font():
+    """
+    OSごとの日本語フォント名（rcParams を書き換えないよう，描画時に rc_context で指定する）
+    """
+    system = platform.system()
+    if system == 'Darwin':  # macOS
+        return 'Hiragino Sans'
+    elif system == 'Windows':  # Windows
+        return 'MS Gothic'
+    else:
+        return 'IPAexGothic'
+
+
+def _strength_boxplot(plt, sns, data, path):
+    """
+    全レベルの変化量を1つの箱ひげ図にまとめる (hue='Level')．
+    カテゴリの並びは出現順とする（カテゴリ型のままでは値の一覧の順になるため通常の値に戻す）
+    """
+    data = data.assign(Category=data['Category'].astype(object), Level=data['Level'].astype(str))
+
+    plt.figure(figsize=(12, 7))
+    sns.boxplot(
+        x='Category',
+        y='Delta_Q1_std',
+        hue='Level',
+        data=data,
+        palette='viridis'
+    )
+    plt.title('Manipulation Strength Check: Comparison by Level')
+    plt.ylabel('Strength of Manipulation (Delta Z-Score of Q1)')
+    plt.xlabel('Manipulation Category')
+    plt.axhline(0, color='gray', linestyle='--', linewidth=0.8)
+    plt.legend(title='Stimulus Level', loc='upper right')
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+
+def _coefficient_barplot(plt, sns, data, path, title):
+    """
+    目的変数ごとの標準化偏回帰係数の棒グラフ
+    """
+    plt.figure(figsize=(10, 6))
+    sns.barplot(x='Factor', y='Coefficient', hue='Target', data=data, palette='viridis')
+    plt.axhline(0, color='black', linewidth=0.8)
+
+    plt.title(title)
+    plt.ylabel('Standardized Beta')
+    plt.xlabel('Explanatory Factors')
+    plt.legend(title='Target Variable')
+    plt.grid(axis='y', linestyle='--', alpha=0.5)
+
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+
+def _word_heatmap(plt, sns, data, path):
+    """
+    カテゴリ別の頻出語のヒートマップ（語は日本語のため日本語フォントを指定する）
+    """
+    # フォントの指定はこの図に限る（描画プロセスで続けて描く他のグラフに影響させない）
+    with plt.rc_context({'font.family': _japanese_font()}):
+        plt.figure(figsize=(12, 8))
+        sns.heatmap(data.astype(int), annot=True, fmt="d", cmap="YlGnBu")
+        plt.title('Word Frequency by Category')
+        plt.tight_layout()
+        plt.savefig(path)
+        plt.close()
+
+
+# グラフの種類と描画関数
+RENDERERS = {
+    'strength_boxplot': _strength_boxplot,
+    'coefficient_barplot': _coefficient_barplot,
+    'word_heatmap': _word_heatmap,
+}
+
+
+def render_figure(kind, data, path, options):
+    """
+    グラフの仕様（種類・データ・出力先・オプション）から PNG を作成する．
+    描画ライブラリはグラフを作成するときにのみ読み込む
+    """
+    _use_agg()
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    RENDERERS[kind](plt, sns, data, path, **options)
+    return path
+
+
+class _Done:
+    """
+    その場で描画した結果を Future と同じ形で保持する
+    """
+    def __init__(self, fn, *args):
+        self._error = None
+        try:
+            self._value = fn(*args)
+        except Exception as e:
+            self._error = e
+
+    def result(self):
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        from concurrent.futures import ProcessPoolExecutor
+        _executor = ProcessPoolExecutor(max_workers=_config['n_jobs'], initializer=_use_agg)
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def submit_figure(kind, data, path, label, **options):
+    """
+    グラフの仕様を描画キューに投入する（描画の完了は wait_figures で待つ）．
+    グラフを作成しない設定の場合は何もせず False を返す
+    label: 保存時のメッセージに用いる説明（例: 'regression figure'）
+    """
+    if not _config['enabled']:
+        return False
+    if kind not in RENDERERS:
+        raise ValueError(f"Unknown figure kind: {kind} ({', '.join(RENDERERS)})")
+
+    if _config['n_jobs'] and _config['n_jobs'] > 0:
+        future = _get_executor().submit(render_figure, kind, data, path, options)
+    else:
+        future = _Done(render_figure, kind, data, path, options)
+    _pending.append((label, path, future))
+    return True
+
+
+def take_pending():
+    """
+    投入済みで未回収の描画を取り出す（呼び出し元が wait_figures で完了を待つ）
+    """
+    jobs = list(_pending)
+    _pending.clear()
+    return jobs
+
+
+def wait_figures(jobs=None):
+    """
+    描画の完了を待ち，保存したグラフのパスのリストを返す．jobs を省略した場合は未回収の全ての描画を待つ
+    """
+    if jobs is None:
+        jobs = take_pending()
+    paths = []
+    for label, path, future in jobs:
+        try:
+            future.result()
+            paths.append(path)
+            print(f"\n[i] {label} saved: {path}")
+        except Exception as e:
+            print(f"[!] Failed to save {label}: {e}")
+    return paths
+
+
+def shutdown_figures():
+    """
+    未回収の描画を待ち，描画用のプロセスプールを終了する
+    """
+    global _executor
+    wait_figures()
+    if _executor is not None and _executor_pid == os.getpid():
+        _executor.shutdown()
+    _executor = None
+
+
+# pipeline を介さずに run_* を呼び出した場合も，終了前に描画を完了させる
+atexit.register(shutdown_figures)
@@ -1,16 +1,65 @@
 import pandas as pd
+import numpy as np
 import re
 import os
 import glob
+import json
+import hashlib
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from program.store import save_frame
+from program.schema import apply_schema, memory_mb
+from program.profiling import profiled, profiling_enabled, annotate
 
 # 実験条件のマッピング定義
 CATEGORY_MAP = {
     'position': 1, 'size': 2, 'lack': 3, 'repetition': 4, 'human': 5
 }
 
+# 参加者ごとの整形結果キャッシュの形式バージョン（整形処理を変更した場合は更新する）
+CACHE_VERSION = 4
+
+# 参加者属性のカラム（参加者テーブルに1行ずつ保持し，回答テーブルには PID のみを残す）
+ATTRIBUTE_COLS = ['PID', 'age', 'sex', 'expTime']
+
+# 記述回答のカラム
+QUAL_COLS = ['Q1_Answer', 'Q1_Reason', 'Q2_Answer', 'Q2_Reason']
+
+# 記述回答ファイルのパターン: ブロックの見出しと，ブロック内の Q1/Q2 の解答欄・理由
+# （理由の前の区切り文字は改行を含みうるため，グループ2として残す）
+SET_INDEX_PATTERN = re.compile(r"Set Index[:\s]+(\d+)")
+QUAL_PATTERNS = {
+    'Q1': re.compile(r"A\.Q1\s*解答欄[:\uff1a\s]*(.*?)\s*\n\s*理由([:\uff1a\s]*)(.*?)(?=\n\s*A\.Q2)", re.DOTALL),
+    'Q2': re.compile(r"A\.Q2\s*解答欄[:\uff1a\s]*(.*?)\s*\n\s*理由([:\uff1a\s]*)(.*?)(?=$|\n-{3,})", re.DOTALL),
+}
+SEPARATOR_PATTERN = re.compile(r"-{3,}")
+
+
+def _parse_block(block):
+    """
+    1ブロック（見出しの直後から次の見出しの直前まで）の Q1/Q2 の回答と理由を抽出する．
+    理由が空欄の Q2 は，次の行の区切り線（---）以降を理由としない
+    """
+    result = {}
+    for name, pattern in QUAL_PATTERNS.items():
+        match = pattern.search(block)
+        answer, reason = (match.group(1), match.group(3)) if match else ("", "")
+        if name == 'Q2' and match and "\n" in match.group(2) and SEPARATOR_PATTERN.match(reason):
+            reason = ""
+        result[f'{name}_Answer'] = answer.strip()
+        result[f'{name}_Reason'] = reason.strip()
+    return result
+
+
 def parse_text_file(file_path):
     """
-    記述回答用テキストファイルを解析し，質問ごとの回答と理由を抽出する
+    記述回答用テキストファイルを解析し，質問ごとの回答と理由を抽出する．
+    見出し（Set Index）の位置を1回の走査で求めてブロックに分割し，ブロックごとに抽出するため，
+    ファイル長に対して線形時間で動作する（ファイル全体に対する先読みを見出しの位置ごとに繰り返さない）．
+    結果はファイル全体への正規表現による従来の抽出と同じ（不正な形式のファイルを含む）．
+    ただし理由が空欄の Q2 は，続く区切り線を理由として取り込まず空欄とする
     """
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
@@ -20,98 +69,313 @@ def parse_text_file(file_path):
         return {}
 
     qual_data = {}
+    headers = list(SET_INDEX_PATTERN.finditer(content))
+    # 最後のブロックは末尾の改行1つを含まない（従来の抽出の $ の位置）
+    end = len(content) - 1 if content.endswith("\n") else len(content)
+    for header, following in zip(headers, headers[1:] + [None]):
+        block = content[header.end():following.start() if following is not None else end]
+        qual_data[int(header.group(1))] = _parse_block(block)
+    return qual_data
+
+
+def _file_signature(path, with_hash=False):
+    """
+    ファイルのサイズ・更新時刻（必要に応じて内容ハッシュ）を取得する．存在しない場合はNone
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    sig = {'size': st.st_size, 'mtime': st.st_mtime_ns}
+    if with_hash:
+        sig['sha1'] = _file_hash(path)
+    return sig
+
+
+def _file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _is_unchanged(recorded, path):
+    """
+    マニフェストの記録とファイルの現状を比較する．
+    サイズ・更新時刻が一致すれば未変更とみなし，更新時刻のみ異なる場合は内容ハッシュで判定する
+    """
+    current = _file_signature(path)
+    if recorded is None or current is None:
+        return recorded is None and current is None
+    if current['size'] != recorded['size']:
+        return False
+    if current['mtime'] == recorded['mtime']:
+        return True
+    if _file_hash(path) != recorded['sha1']:
+        return False
+    recorded['mtime'] = current['mtime']
+    return True
+
+
+def _load_manifest(cache_dir):
+    manifest_path = os.path.join(cache_dir, 'manifest.json')
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != CACHE_VERSION:
+        return {}
+    return manifest.get('files', {})
+
+
+def _save_manifest(cache_dir, entries):
+    manifest_path = os.path.join(cache_dir, 'manifest.json')
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': CACHE_VERSION, 'files': entries}, f, ensure_ascii=False, indent=1)
+
+
+def parse_participant(csv_file, qual_dir):
+    """
+    参加者1名分の定量的データ(CSV)と定性的データ(TXT)を読み込み，統合前の断片を返す．
+    断片は刺激ID・質問名・回答値（刺激×質問）・参加者属性・記述回答の辞書．
+    読み込めない場合は (None, None) を返す
+    """
+    try:
+        df_raw = pd.read_csv(csv_file)
+    except Exception:
+        return None, None
     
-    # 正規表現を用いてブロックごとに回答を抽出
-    pattern_block = r"Set Index[:\s]+(\d+)(.*?)(?=Set Index[:\s]+\d+|$)"
-    matches = re.findall(pattern_block, content, re.DOTALL)
+    # 不要なカラムの削除
+    if 'SetOrder' in df_raw.columns:
+        df_raw.drop(columns=['SetOrder'], inplace=True)
+
+    # 参加者属性(PID, 年齢, 性別等)の取得
+    attributes = {col: df_raw.iloc[0][col] for col in ATTRIBUTE_COLS if col in df_raw.columns}
     
-    for set_idx_str, text_block in matches:
-        set_idx = int(set_idx_str)
-        
-        # Q1(違和感)およびQ2(不気味さ)の回答・理由を抽出
-        match_q1 = re.search(
-            r"A\.Q1\s*解答欄[:\uff1a\s]*(.*?)\s*\n\s*理由[:\uff1a\s]*(.*?)(?=\n\s*A\.Q2)", 
-            text_block, re.DOTALL
-        )
-        match_q2 = re.search(
-            r"A\.Q2\s*解答欄[:\uff1a\s]*(.*?)\s*\n\s*理由[:\uff1a\s]*(.*?)(?=$|\n-{3,})", 
-            text_block, re.DOTALL
+    # PIDの正規化
+    if 'PID' not in attributes or pd.isna(attributes['PID']):
+        pid_match = re.search(r'^(\d+)_', os.path.basename(csv_file))
+        attributes['PID'] = str(int(pid_match.group(1))) if pid_match else "Unknown"
+    else:
+        attributes['PID'] = str(int(float(attributes['PID'])))
+
+    # 対応するテキストファイルの読み込み
+    txt_path = os.path.join(qual_dir, f"PID={attributes['PID']}.txt")
+    qual_map = parse_text_file(txt_path) if os.path.exists(txt_path) else {}
+
+    # 回答値は「刺激×質問」の配列として保持し，Tidy Data化は統合時に一括で行う
+    stimulus_cols = [c for c in df_raw.columns if c not in ATTRIBUTE_COLS + ['questions']]
+    fragment = {
+        'stimuli': stimulus_cols,
+        'questions': df_raw['questions'].tolist(),
+        'values': df_raw[stimulus_cols].to_numpy().T,
+        'attributes': attributes,
+        'qual': qual_map,
+    }
+    return fragment, txt_path
+
+
+def decode_stimulus_ids(stimulus_ids):
+    """
+    刺激IDからカテゴリとレベルを抽出する（'base' はレベル1）．
+    ユニークなIDのみを文字列演算で一括デコードし，各行へ展開する
+    """
+    codes, uniques = pd.factorize(stimulus_ids)
+    uniques = pd.Series(uniques, dtype=object)
+    decoded = uniques.str.extract(r'^([a-z]+)(\d+)')
+
+    is_base = (uniques == 'base').to_numpy()
+    category = decoded[0].where(decoded[0].notna(), uniques).to_numpy(dtype=object, copy=True)
+    category[is_base] = 'base'
+    level = pd.to_numeric(decoded[1].mask(is_base, '1'))
+
+    return pd.Series(category[codes]), pd.Series(level.to_numpy()[codes])
+
+
+def build_participant_table(fragments):
+    """
+    参加者ごとの断片から参加者テーブル（1行 = 参加者．列は PID と属性）を構築する．
+    同じ PID の断片が複数ある場合は最初の断片の属性を用いる
+    """
+    participants = pd.DataFrame([f['attributes'] for f in fragments])
+    participants = participants.drop_duplicates(subset='PID', keep='first').reset_index(drop=True)
+    return apply_schema(participants)
+
+
+def build_response_table(fragments):
+    """
+    参加者ごとの断片から回答テーブル（Tidy Data．1行 = 参加者×刺激）を一括で構築し，schema.apply_schema の型に揃える．
+    参加者属性は PID のみを持ち，その他の属性は参加者テーブルに分ける．
+    計測が有効な場合は型の変換前後のメモリ使用量を記録する
+    """
+    n_stimuli = np.array([len(f['stimuli']) for f in fragments])
+    participant_idx = np.repeat(np.arange(len(fragments)), n_stimuli)
+
+    # 回答値の結合: 質問構成が全参加者で同一なら配列のまま連結する
+    questions = fragments[0]['questions']
+    if all(f['questions'] == questions for f in fragments):
+        answers = pd.DataFrame(np.concatenate([f['values'] for f in fragments]), columns=questions)
+    else:
+        answers = pd.concat(
+            [pd.DataFrame(f['values'], columns=f['questions']) for f in fragments], ignore_index=True
         )
 
-        qual_data[set_idx] = {
-            'Q1_Answer': match_q1.group(1).strip() if match_q1 else "",
-            'Q1_Reason': match_q1.group(2).strip() if match_q1 else "",
-            'Q2_Answer': match_q2.group(1).strip() if match_q2 else "",
-            'Q2_Reason': match_q2.group(2).strip() if match_q2 else ""
-        }
-        
-    return qual_data
+    tidy = pd.DataFrame({'Stimulus_ID': np.concatenate([np.asarray(f['stimuli'], dtype=object) for f in fragments])})
+    tidy = pd.concat([tidy, answers], axis=1)
+
+    # 参加者テーブルとの対応付けのキー（参加者ごとの PID を行数分だけ展開）
+    pids = np.array([f['attributes']['PID'] for f in fragments], dtype=object)
+    tidy['PID'] = pids[participant_idx]
+
+    # 刺激IDからカテゴリとレベルを抽出
+    tidy['Category'], tidy['Level'] = decode_stimulus_ids(tidy['Stimulus_ID'])
+
+    # 定性データの結合: (PID, Set Index) をキーとして一度にマージする
+    qual = pd.DataFrame(
+        [
+            (f['attributes']['PID'], set_idx) + tuple(answers_map.get(key, "") for key in QUAL_COLS)
+            for f in fragments for set_idx, answers_map in f['qual'].items()
+        ],
+        columns=['PID', 'Set_Index'] + QUAL_COLS,
+    ).drop_duplicates(subset=['PID', 'Set_Index'])
+    qual = qual.astype({'PID': object, 'Set_Index': 'float64'})
+    keys = pd.DataFrame({
+        'PID': tidy['PID'].astype(object),
+        'Set_Index': tidy['Category'].map(CATEGORY_MAP).astype('float64'),
+    })
+    merged = keys.merge(qual, on=['PID', 'Set_Index'], how='left')
+    for key in QUAL_COLS:
+        tidy[key] = merged[key].fillna("").to_numpy(dtype=object)
 
-def format_data(base_dir, output_dir):
+    # 数値変換処理
+    for c in [col for col in tidy.columns if col.startswith('q') and len(col) == 2]:
+        tidy[c] = pd.to_numeric(tidy[c], errors='coerce')
+
+    # 列順は参加者ごとの列構成を出現順に統合したものとする
+    column_order = []
+    for layout in dict.fromkeys(
+        tuple(['Stimulus_ID'] + list(f['questions']) + list(f['attributes']) + ['Category', 'Level'] + QUAL_COLS)
+        for f in fragments
+    ):
+        column_order.extend(c for c in layout if c not in column_order and (c == 'PID' or c not in ATTRIBUTE_COLS))
+    tidy = tidy[column_order]
+
+    if not profiling_enabled():
+        return apply_schema(tidy)
+    memory_before = memory_mb(tidy)
+    tidy = apply_schema(tidy)
+    annotate(memory_before_mb=memory_before, memory_after_mb=memory_mb(tidy))
+    return tidy
+
+
+def join_participants(participants, responses):
+    """
+    回答テーブルの各行に参加者テーブルの属性を付与した統合データを返す（CSV出力用）．
+    属性の列は PID の直後に置く
     """
-    指定ディレクトリ内の定量的データ(CSV)と定性的データ(TXT)を統合する
+    attributes = participants.drop(columns='PID')
+    pos = pd.Index(participants['PID']).get_indexer(responses['PID'])
+    attributes = attributes.take(pos).reset_index(drop=True)
+    at = responses.columns.get_loc('PID') + 1
+    return pd.concat([responses.iloc[:, :at], attributes, responses.iloc[:, at:]], axis=1)
+
+
+def _parse_and_sign(csv_file, qual_dir):
+    """
+    並列実行用: 解析結果とマニフェスト用のファイル情報をまとめて返す
+    """
+    fragment, txt_path = parse_participant(csv_file, qual_dir)
+    if fragment is None:
+        return None, None
+    entry = {
+        'csv': _file_signature(csv_file, with_hash=True),
+        'txt_path': txt_path,
+        'txt': _file_signature(txt_path, with_hash=True),
+    }
+    return fragment, entry
+
+
+@profiled
+def format_data(base_dir, output_dir, n_jobs=1, use_cache=True, store_dir=None, export_csv=True, cache_dir=None):
+    """
+    指定ディレクトリ内の定量的データ(CSV)と定性的データ(TXT)を統合する．
+    n_jobs >= 2 の場合は参加者ファイルをプロセス並列で解析する．
+    use_cache=True の場合は参加者ごとの整形結果を cache_dir（既定: output_dir/.cache/format_data）に
+    キャッシュし，未変更のファイルは再解析しない．
+    store_dir を指定した場合は参加者テーブル・回答テーブルを中間データ（participants, responses）として保存する．
+    export_csv=True の場合は回答に参加者属性を付与した統合データを CSV に出力する．
+    戻り値: {'participants': 参加者テーブル, 'responses': 回答テーブル}（データがない場合は None）
     """
     quant_dir = os.path.join(base_dir, 'quant_data')
     qual_dir = os.path.join(base_dir, 'qual_data')
     output_file = os.path.join(output_dir, 'integrated_tidy_data.csv')
+    cache_dir = cache_dir or os.path.join(output_dir, '.cache', 'format_data')
 
-    csv_files = glob.glob(os.path.join(quant_dir, '*.csv'))
-    all_data = []
+    csv_files = [os.path.abspath(p) for p in glob.glob(os.path.join(quant_dir, '*.csv'))]
 
+    # キャッシュ済みで未変更の参加者を判定
+    manifest = _load_manifest(cache_dir) if use_cache else {}
+    fragments = {}
     for csv_file in csv_files:
+        entry = manifest.get(csv_file)
+        if entry is None:
+            continue
+        fragment_path = os.path.join(cache_dir, entry['fragment'])
+        if not (_is_unchanged(entry['csv'], csv_file) and _is_unchanged(entry['txt'], entry['txt_path'])):
+            continue
         try:
-            df_raw = pd.read_csv(csv_file)
+            with open(fragment_path, 'rb') as f:
+                fragments[csv_file] = pickle.load(f)
         except Exception:
             continue
-        
-        # 不要なカラムの削除
-        if 'SetOrder' in df_raw.columns:
-            df_raw.drop(columns=['SetOrder'], inplace=True)
-
-        # 参加者属性(PID, 年齢, 性別等)の取得
-        attributes = {col: df_raw.iloc[0][col] for col in ['PID', 'age', 'sex', 'expTime'] if col in df_raw.columns}
-        
-        # PIDの正規化
-        if 'PID' not in attributes or pd.isna(attributes['PID']):
-            pid_match = re.search(r'^(\d+)_', os.path.basename(csv_file))
-            attributes['PID'] = str(int(pid_match.group(1))) if pid_match else "Unknown"
-        else:
-            attributes['PID'] = str(int(float(attributes['PID'])))
-
-        # 対応するテキストファイルの読み込み
-        txt_path = os.path.join(qual_dir, f"PID={attributes['PID']}.txt")
-        qual_map = parse_text_file(txt_path) if os.path.exists(txt_path) else {}
-
-        # データの転置と整形 (Tidy Data化)
-        stimulus_cols = [c for c in df_raw.columns if c not in ['PID', 'age', 'sex', 'expTime', 'questions']]
-        df_t = df_raw[['questions'] + stimulus_cols].set_index('questions').T.reset_index()
-        df_t.rename(columns={'index': 'Stimulus_ID'}, inplace=True)
-        
-        # 属性情報の付与
-        for key, val in attributes.items():
-            df_t[key] = val
-
-        # 刺激IDからカテゴリとレベルを抽出
-        def parse_stimulus(s):
-            if s == 'base': return 'base', 1
-            match = re.match(r"([a-z]+)(\d+)", s)
-            return (match.group(1), int(match.group(2))) if match else (s, None)
-        
-        df_t[['Category', 'Level']] = df_t['Stimulus_ID'].apply(lambda x: pd.Series(parse_stimulus(x)))
-
-        # 定性データの結合
-        for key in ['Q1_Answer', 'Q1_Reason', 'Q2_Answer', 'Q2_Reason']:
-            df_t[key] = df_t.apply(lambda row: qual_map.get(CATEGORY_MAP.get(row['Category']), {}).get(key, ""), axis=1)
-
-        # 数値変換処理
-        for c in [col for col in df_t.columns if col.startswith('q') and len(col) == 2]:
-            df_t[c] = pd.to_numeric(df_t[c], errors='coerce')
-        
-        all_data.append(df_t)
+    n_cached = len(fragments)
+
+    # 新規・変更ありの参加者のみ解析
+    to_parse = [c for c in csv_files if c not in fragments]
+    if n_jobs and n_jobs > 1 and len(to_parse) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            chunksize = max(1, len(to_parse) // (n_jobs * 4))
+            parsed = list(executor.map(_parse_and_sign, to_parse, repeat(qual_dir), chunksize=chunksize))
+    else:
+        parsed = [_parse_and_sign(c, qual_dir) for c in to_parse]
+
+    new_manifest = {c: manifest[c] for c in fragments}
+    if use_cache:
+        os.makedirs(cache_dir, exist_ok=True)
+    for csv_file, (fragment, entry) in zip(to_parse, parsed):
+        if fragment is None:
+            continue
+        fragments[csv_file] = fragment
+        if use_cache:
+            entry['fragment'] = hashlib.sha1(csv_file.encode('utf-8')).hexdigest() + '.pkl'
+            with open(os.path.join(cache_dir, entry['fragment']), 'wb') as f:
+                pickle.dump(fragment, f, protocol=pickle.HIGHEST_PROTOCOL)
+            new_manifest[csv_file] = entry
+
+    if use_cache:
+        # 削除された参加者ファイルのキャッシュを破棄
+        for csv_file, entry in manifest.items():
+            if csv_file not in new_manifest:
+                try:
+                    os.remove(os.path.join(cache_dir, entry['fragment']))
+                except OSError:
+                    pass
+        _save_manifest(cache_dir, new_manifest)
+
+    all_data = [fragments[c] for c in csv_files if c in fragments]
 
     if all_data:
-        final_df = pd.concat(all_data, ignore_index=True)
-        os.makedirs(os.path.dirname(output_file), exist_ok=True)
-        final_df.to_csv(output_file, index=False, encoding='utf-8-sig')
-        return final_df
-    return None
\ No newline at end of file
+        print(f"\n[i] Participants loaded: {len(all_data)} ({n_cached} from cache)")
+        tables = {'participants': build_participant_table(all_data), 'responses': build_response_table(all_data)}
+        if store_dir:
+            for name, table in tables.items():
+                save_frame(table, store_dir, name)
+        if export_csv:
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            join_participants(tables['participants'], tables['responses']).to_csv(
+                output_file, index=False, encoding='utf-8-sig'
+            )
+        return tables
+    return None
@@ -0,0 +1,166 @@
+import os
+import json
+import sqlite3
+import hashlib
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+# 抽出対象の品詞（キャッシュにはこの品詞で絞り込んだトークンのみを保存する）
+TARGET_POS = ['名詞', '形容詞']
+
+
+def tokenizer_version():
+    """
+    トークン化結果を識別するバージョン文字列（janomeと同梱辞書のバージョン・抽出対象の品詞）
+    """
+    import janome
+    return f"janome-{janome.__version__}/{','.join(TARGET_POS)}"
+
+
+def _text_key(text, version):
+    return hashlib.sha1(f"{version}\0{text}".encode('utf-8')).hexdigest()
+
+
+def _open_cache(cache_path):
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    conn = sqlite3.connect(cache_path, timeout=60)
+    conn.execute("CREATE TABLE IF NOT EXISTS tokens (key TEXT PRIMARY KEY, tokens TEXT NOT NULL)")
+    return conn
+
+
+def _tokenize(tokenizer, text):
+    """
+    テキストを形態素解析し，対象品詞の (基本形, 品詞) のリストを返す
+    """
+    tokens = []
+    for token in tokenizer.tokenize(text):
+        pos = token.part_of_speech.split(',')[0]
+        if pos in TARGET_POS:
+            tokens.append((token.base_form, pos))
+    return tokens
+
+
+# ワーカープロセスごとに1つ保持するTokenizer
+_worker_tokenizer = None
+
+
+def _init_worker():
+    global _worker_tokenizer
+    from janome.tokenizer import Tokenizer
+    _worker_tokenizer = Tokenizer()
+
+
+def _tokenize_shard(texts):
+    return [_tokenize(_worker_tokenizer, text) for text in texts]
+
+
+def _tokenize_unseen(texts, n_jobs):
+    """
+    未解析のテキストを形態素解析する．n_jobs >= 2 の場合はテキストを分割してワーカープロセスに割り当てる
+    """
+    if n_jobs and n_jobs > 1 and len(texts) > 1:
+        n_shards = min(len(texts), n_jobs * 4)
+        shards = [texts[i::n_shards] for i in range(n_shards)]
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker) as executor:
+            results = list(executor.map(_tokenize_shard, shards))
+        tokenized = {}
+        for shard, tokens in zip(shards, results):
+            tokenized.update(zip(shard, tokens))
+        return tokenized
+
+    from janome.tokenizer import Tokenizer
+    tokenizer = Tokenizer()
+    return {text: _tokenize(tokenizer, text) for text in texts}
+
+
+def tokenize_texts(texts, cache_path=None, n_jobs=1):
+    """
+    テキストの一覧を形態素解析し，{テキスト: [(基本形, 品詞), ...]} を返す．
+    同一のテキストは1度だけ解析し，cache_path を指定した場合は解析結果をディスクにキャッシュして
+    未解析のテキストのみを解析する．n_jobs >= 2 の場合は未解析のテキストをプロセス並列で解析する．
+    文字列以外の値は無視する
+    """
+    unique_texts = list(dict.fromkeys(t for t in texts if isinstance(t, str)))
+    if not unique_texts:
+        return {}
+
+    version = tokenizer_version()
+    keys = {text: _text_key(text, version) for text in unique_texts}
+    tokenized = {}
+
+    conn = _open_cache(cache_path) if cache_path else None
+    try:
+        if conn is not None:
+            key_list = list(keys.values())
+            found = {}
+            # SQLiteのパラメータ数上限を超えないよう分割して検索
+            for i in range(0, len(key_list), 500):
+                chunk = key_list[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                for key, tokens in conn.execute(
+                    f"SELECT key, tokens FROM tokens WHERE key IN ({placeholders})", chunk
+                ):
+                    found[key] = [tuple(t) for t in json.loads(tokens)]
+            for text, key in keys.items():
+                if key in found:
+                    tokenized[text] = found[key]
+
+        unseen = [text for text in unique_texts if text not in tokenized]
+        if unseen:
+            new_tokens = _tokenize_unseen(unseen, n_jobs)
+            tokenized.update(new_tokens)
+            if conn is not None:
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO tokens (key, tokens) VALUES (?, ?)",
+                        ((keys[text], json.dumps(tokens, ensure_ascii=False)) for text, tokens in new_tokens.items())
+                    )
+    finally:
+        if conn is not None:
+            conn.close()
+
+    return tokenized
+
+
+def tokenize_frame(df, text_cols, cache_path=None, n_jobs=1):
+    """
+    複数のテキスト列を形態素解析し，1行 = 1トークンの表を返す．
+    列: row_id（df内の行位置）, column（テキスト列名）, position（テキスト内の順序）, token（基本形）, pos（品詞）
+    """
+    text_cols = [c for c in text_cols if c in df.columns]
+    tokenized = tokenize_texts(
+        (t for c in text_cols for t in df[c].to_numpy()), cache_path=cache_path, n_jobs=n_jobs
+    )
+
+    # ユニークなテキストのトークン列を連結し，各行からはオフセットで参照する
+    unique_texts = list(tokenized)
+    code_map = {text: i for i, text in enumerate(unique_texts)}
+    lengths = np.array([len(tokenized[t]) for t in unique_texts], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]]) if len(lengths) else lengths
+    flat_tokens = np.array([w for t in unique_texts for w, _ in tokenized[t]], dtype=object)
+    flat_pos = np.array([p for t in unique_texts for _, p in tokenized[t]], dtype=object)
+
+    frames = []
+    for col in text_cols:
+        codes = pd.Series(df[col].to_numpy(), dtype=object).map(code_map)
+        valid = codes.notna().to_numpy()
+        row_ids = np.flatnonzero(valid)
+        codes = codes.to_numpy()[valid].astype(np.int64)
+        counts = lengths[codes]
+        total = int(counts.sum())
+
+        # 各行のトークンの通し番号: オフセット + テキスト内の順序
+        position = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        index = np.repeat(offsets[codes], counts) + position
+        frames.append(pd.DataFrame({
+            'row_id': np.repeat(row_ids, counts),
+            'column': col,
+            'position': position,
+            'token': flat_tokens[index] if total else np.array([], dtype=object),
+            'pos': flat_pos[index] if total else np.array([], dtype=object),
+        }))
+
+    if not frames:
+        return pd.DataFrame(columns=['row_id', 'column', 'position', 'token', 'pos'])
+    return pd.concat(frames, ignore_index=True)
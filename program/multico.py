@@ -1,15 +1,19 @@
-import statsmodels.api as sm
-from statsmodels.stats.outliers_influence import variance_inflation_factor
+import numpy as np
 import os
 
-def run_multicollinearity_check(df, output_dir):
+from program.regression import EXPLANATORY_VARS, SUBSET_KEYS, design_grams, subset_indicator
+from program.profiling import profiled
+
+@profiled
+def run_multicollinearity_check(df, output_dir, design=None):
     """
-    VIF（分散拡大係数）を計算し，多重共線性の検証を行う
+    VIF（分散拡大係数）を計算し，多重共線性の検証を行う．
+    design に重回帰分析の結果（run_regression の戻り値）を渡した場合は，その積和行列を再利用する
     """
 
     # 計算パート
-    vif_results = calculate_vif(df)
-    
+    vif_results = calculate_vif(df, design)
+
     if not vif_results:
         print("[!] VIF calculation failed.")
         return
@@ -18,47 +22,76 @@ def run_multicollinearity_check(df, output_dir):
     save_vif_report(vif_results, output_dir)
 
 
-def calculate_vif(df):
+def vif_from_gram(xtx):
+    """
+    積和行列 X'X（モデル数 × k × k，先頭列は定数項）から，全モデルのVIFと条件指数をまとめて求める．
+    VIF は説明変数の相関行列の逆行列の対角（補助回帰と同値），
+    条件指数は列の長さを1に揃えた X'X（定数項を含む）の固有値 λ から sqrt(λmax / λ) として求める
+    """
+    n = xtx[:, 0, 0]
+    sums = xtx[:, 0, 1:]
+    cov = xtx[:, 1:, 1:] - sums[:, :, None] * sums[:, None, :] / n[:, None, None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = np.sqrt(np.diagonal(cov, axis1=1, axis2=2))
+        corr = cov / (scale[:, :, None] * scale[:, None, :])
+
+        # 定数の説明変数を含むモデルは計算不能（欠損値），完全な共線性があるモデルは無限大とする
+        vif = np.full(corr.shape[:2], np.nan)
+        valid = np.isfinite(corr).all(axis=(1, 2))
+        if valid.any():
+            full_rank = np.zeros_like(valid)
+            full_rank[valid] = np.linalg.matrix_rank(corr[valid]) == corr.shape[1]
+            vif[valid & ~full_rank] = np.inf
+            if full_rank.any():
+                vif[full_rank] = np.diagonal(np.linalg.inv(corr[full_rank]), axis1=1, axis2=2)
+
+        norm = np.sqrt(np.diagonal(xtx, axis1=1, axis2=2))
+        eig = np.linalg.eigvalsh(xtx / (norm[:, :, None] * norm[:, None, :]))
+        # 条件指数は降順（先頭が最大）
+        condition_indices = np.sqrt(eig[:, -1:] / np.maximum(eig, 0))
+
+    return vif, condition_indices
+
+
+@profiled
+def calculate_vif(df=None, design=None):
     """
     計算パート: 説明変数間VIFの算出
+    プールしたデータと Level 別・Category 別の部分集合についてまとめて計算する
     """
-    df_vif = df[df['Category'] != 'base'].copy()
-
-    if df_vif.empty:
-        return None
-
-    # 説明変数
-    explanatory_vars = ['q3', 'q4', 'q5', 'q6', 'q7']
-    
-    # 定数項の追加
-    X = df[explanatory_vars]
-    X = sm.add_constant(X)
-
-    # VIFの計算
-    vif_data = []
-    for i in range(X.shape[1]):
-        var_name = X.columns[i]
-        if var_name == 'const':
-            continue
-            
-        vif = variance_inflation_factor(X.values, i)
-        vif_data.append({
-            'Factor': var_name,
-            'VIF': vif
-        })
+    k = len(EXPLANATORY_VARS) + 1
+    if design is not None:
+        labels, gram, nobs = design['subsets'], design['gram'], design['nobs']
+    else:
+        if df is None:
+            return None
+        grams = design_grams(df, [], SUBSET_KEYS)
+        if grams is None:
+            return None
+        labels, indicator = subset_indicator(grams['cells'])
+        gram = np.einsum('sg,gij->sij', indicator, grams['gram'])
+        nobs = indicator @ grams['n']
+
+    vif, condition_indices = vif_from_gram(gram[:, :k, :k])
 
     return {
-        'n_samples': len(df),
-        'vif_data': vif_data
+        'n_samples': int(nobs[0]),
+        'explanatory_vars': EXPLANATORY_VARS,
+        'subsets': labels,
+        'nobs': nobs,
+        'vif': vif,
+        'condition_indices': condition_indices,
+        'vif_data': [{'Factor': var, 'VIF': vif[0, i]} for i, var in enumerate(EXPLANATORY_VARS)]
     }
 
 
+@profiled
 def save_vif_report(results, output_dir):
     """
     出力パート
     """
     report_path = os.path.join(output_dir, 'vif_report.txt')
-    
+
     lines = []
     lines.append("Multicollinearity Check Report (VIF)")
     lines.append("====================================")
@@ -75,24 +108,40 @@ def save_vif_report(results, output_dir):
     for item in results['vif_data']:
         vif = item['VIF']
         factor = item['Factor']
-        
+
         if vif < 5:
             check = "Safe"
         elif vif < 10:
             check = "Caution"
         else:
             check = "Danger"
-            
+
         lines.append(f"{factor:<10} {vif:10.4f} {check:>10}")
 
     lines.append("-" * 50)
+    lines.append(f"Max Condition Index: {results['condition_indices'][0, 0]:.2f}")
     lines.append("  VIF < 5.0  : Safe")
     lines.append("  VIF >= 10.0: Danger")
+    lines.append("  Condition Index >= 30: strong collinearity")
     lines.append("すべて 'Safe' であればマルチコは発生していない")
 
+    # 部分集合ごとのVIFと最大条件指数
+    if len(results['subsets']) > 1:
+        lines.append("\n[Subsets] VIF by Level / Category")
+        header = f"{'Subset':<22} {'N':>6}" + "".join(f" {var:>8}" for var in results['explanatory_vars'])
+        header += f" {'Max CI':>8}"
+        lines.append(header)
+        lines.append("-" * len(header))
+        for s, subset in enumerate(results['subsets'][1:], start=1):
+            row = f"{subset:<22} {int(results['nobs'][s]):6d}"
+            row += "".join(f" {v:8.3f}" for v in results['vif'][s])
+            row += f" {results['condition_indices'][s, 0]:8.2f}"
+            lines.append(row)
+        lines.append("-" * len(header))
+
     try:
         with open(report_path, 'w', encoding='utf-8') as f:
             f.write("\n".join(lines))
         print(f"\n[i] VIF report saved: {report_path}")
     except Exception as e:
-        print(f"[!] Failed to save VIF report: {e}")
\ No newline at end of file
+        print(f"[!] Failed to save VIF report: {e}")
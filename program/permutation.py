@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+# 1回の配列演算でまとめて処理する並べ替えの数の上限と，並べ替えた値の配列（並べ替えの数 × データ数）の
+# メモリ使用量の上限（バイト）．並べ替えの数はデータ数に応じてメモリ使用量がこの範囲に収まるよう決める
+CHUNK_SIZE = 1000
+CHUNK_BYTES = 32 * 2 ** 20
+
+
+def chunk_size(n_values):
+    """
+    1回の配列演算でまとめて処理する並べ替えの数（CHUNK_BYTES をデータ1行分のバイト数で割った数．1以上 CHUNK_SIZE 以下）
+    """
+    return int(max(1, min(CHUNK_SIZE, CHUNK_BYTES // (8 * max(1, n_values)))))
+
+
+def _statistics(sums, counts, total, total_sq):
+    """
+    群ごとの和（... × 群数）から F 値と全ての群の組の Tukey-Kramer 統計量 |平均差| / SE を求める．
+    並べ替えでは群ごとの件数・全体の和・平方和は変わらないため，群ごとの和のみから計算できる
+    """
+    n_total = counts.sum()
+    k = len(counts)
+    means = sums / counts
+    ss_between = (sums ** 2 / counts).sum(axis=-1) - total ** 2 / n_total
+    mse = (total_sq - total ** 2 / n_total - ss_between) / (n_total - k)
+    f_stat = ss_between / (k - 1) / mse
+
+    i, j = np.triu_indices(k, 1)
+    diff = means[..., j] - means[..., i]
+    # 標準誤差は post_hoc.tukey_kramer_table と同じ sqrt(MSE / 2 * (1/n_i + 1/n_j))（スチューデント化範囲の尺度）
+    q = np.abs(diff) / np.sqrt(mse[..., None] / 2 * (1 / counts[i] + 1 / counts[j]))
+    return f_stat, diff, q
+
+
+def _count_chunk(values, counts, observed, seed, size):
+    """
+    size 回の並べ替えについて，観測値以上の統計量が得られた回数を数える．
+    values は群の順に並べた値とし，並べ替えた値を群の件数ごとの区間に分けて和を求める
+    （ラベルを並べ替えるのと同値）．
+    戻り値: (F, 各組の統計量, 各組に対する全組の最大値) の回数
+    """
+    rng = np.random.default_rng(seed)
+    total, total_sq = values.sum(), (values ** 2).sum()
+
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+    permuted = rng.permuted(np.broadcast_to(values, (size, len(values))), axis=1)
+    sums = np.add.reduceat(permuted, starts, axis=1)
+
+    f_stat, _, q = _statistics(sums, counts, total, total_sq)
+    obs_f, obs_q = observed
+    # 浮動小数点の誤差で同値の並べ替えを取りこぼさないよう，わずかに緩めて比較する
+    tol = 1e-12
+    return (
+        int((f_stat >= obs_f * (1 - tol)).sum()),
+        (q >= obs_q * (1 - tol)).sum(axis=0),
+        (q.max(axis=1)[:, None] >= obs_q * (1 - tol)).sum(axis=0),
+    )
+
+
+# ワーカープロセスごとに1度だけ受け取るデータ
+_worker_data = None
+
+
+def _init_worker(values, counts, observed):
+    global _worker_data
+    _worker_data = (values, counts, observed)
+
+
+def _count_task(task):
+    seed, size = task
+    return _count_chunk(*_worker_data, seed, size)
+
+
+def permutation_test(values, labels, n_perm=10000, seed=0, n_jobs=1):
+    """
+    群のラベルを並べ替える並べ替え検定により，一元配置分散分析と全ての群の組の多重比較の p 値を求める．
+    並べ替えは chunk_size(データ数) 回ずつ配列演算でまとめて処理し（メモリ使用量はデータ数によらず CHUNK_BYTES 程度），
+    n_jobs >= 2 の場合はプロセス並列で処理する．
+    乱数は seed（整数または SeedSequence）からチャンクごとに分岐させるため，並列数によらず結果は同一．
+    p 値は (1 + 観測値以上の回数) / (1 + n_perm)．多重比較の調整済み p 値は全組の最大統計量（max-T）による
+    戻り値: groups, n, f, p（F検定）, pairs（列: group1, group2, meandiff, q, p_raw, p_adj, reject）, n_perm
+    """
+    codes, groups = pd.factorize(pd.Series(labels), sort=True)
+    values = np.asarray(values, dtype=np.float64)
+    counts = np.bincount(codes, minlength=len(groups)).astype(np.float64)
+
+    sums = np.bincount(codes, weights=values, minlength=len(groups))
+    obs_f, obs_diff, obs_q = _statistics(sums, counts, values.sum(), (values ** 2).sum())
+
+    size = chunk_size(len(values))
+    sizes = [size] * (n_perm // size)
+    if n_perm % size:
+        sizes.append(n_perm % size)
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    tasks = list(zip(seed.spawn(len(sizes)), sizes))
+    data = (values[np.argsort(codes, kind='stable')], counts, (obs_f, obs_q))
+
+    if n_jobs and n_jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=data) as executor:
+            results = list(executor.map(_count_task, tasks, chunksize=max(1, len(tasks) // (n_jobs * 4))))
+    else:
+        results = [_count_chunk(*data, s, size) for s, size in tasks]
+
+    count_f = sum(r[0] for r in results)
+    count_raw = sum(r[1] for r in results)
+    count_max = sum(r[2] for r in results)
+
+    i, j = np.triu_indices(len(groups), 1)
+    pairs = pd.DataFrame({
+        'group1': np.asarray(groups)[i],
+        'group2': np.asarray(groups)[j],
+        'meandiff': obs_diff,
+        'q': obs_q,
+        'p_raw': (1 + count_raw) / (1 + n_perm),
+        'p_adj': (1 + count_max) / (1 + n_perm),
+    })
+    pairs['reject'] = pairs['p_adj'] < 0.05
+
+    return {
+        'groups': list(groups),
+        'n': counts.astype(np.int64),
+        'f': obs_f,
+        'p': (1 + count_f) / (1 + n_perm),
+        'pairs': pairs,
+        'n_perm': n_perm,
+    }
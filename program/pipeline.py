@@ -0,0 +1,500 @@
+import io
+import os
+import ast
+import glob
+import json
+import pickle
+import shutil
+import fnmatch
+import inspect
+import hashlib
+import textwrap
+import contextlib
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+
+from program.store import save_frame, load_frame
+from program.figures import FIGURE_DIR, configure_figures, figures_enabled, take_pending, wait_figures
+from program.profiling import profile_step, take_records, add_records, configure_profiling, profiling_config
+
+# 各ステップのキャッシュを何世代保持するか
+CACHE_GENERATIONS = 3
+
+
+def resolve_order(steps, targets):
+    """
+    指定ターゲットとその依存ステップを，依存関係を満たす実行順に並べて返す
+    """
+    order = []
+
+    def visit(name, path):
+        if name in path:
+            raise ValueError(f"Cyclic dependency: {' -> '.join(path + [name])}")
+        if name in order:
+            return
+        if name not in steps:
+            raise KeyError(f"Unknown step: {name}")
+        for dep in steps[name].get('deps', []):
+            visit(dep, path + [name])
+        order.append(name)
+
+    for target in targets:
+        visit(target, [])
+    return order
+
+
+# コードのバージョンに含めるモジュールのパッケージ
+CODE_PACKAGE = 'program'
+
+
+def _imported_modules(source):
+    """
+    ソースコードが読み込む CODE_PACKAGE 以下のモジュール名（関数内での読み込みを含む）
+    """
+    modules = set()
+    for node in ast.walk(ast.parse(textwrap.dedent(source))):
+        if isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            if node.module == CODE_PACKAGE:
+                # from program import format_data の形式
+                modules.update(f"{CODE_PACKAGE}.{alias.name}" for alias in node.names)
+            elif node.module.startswith(CODE_PACKAGE + '.'):
+                modules.add(node.module)
+        elif isinstance(node, ast.Import):
+            modules.update(alias.name for alias in node.names if alias.name.startswith(CODE_PACKAGE + '.'))
+    return modules
+
+
+def _module_source(module):
+    """
+    モジュールのソースコード（見つからない場合は None）
+    """
+    spec = importlib.util.find_spec(module)
+    if spec is None or not spec.origin or not os.path.exists(spec.origin):
+        return None
+    with open(spec.origin, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def _step_functions(fn):
+    """
+    ステップの関数と，それが（入れ子の関数を含めて）呼び出す同じモジュールの関数
+    """
+    found = {}
+    stack = [fn]
+    while stack:
+        f = stack.pop()
+        if f.__qualname__ in found:
+            continue
+        found[f.__qualname__] = f
+        codes = [f.__code__]
+        while codes:
+            code = codes.pop()
+            codes.extend(c for c in code.co_consts if inspect.iscode(c))
+            for name in code.co_names:
+                obj = f.__globals__.get(name)
+                if inspect.isfunction(obj) and obj.__module__ == fn.__module__:
+                    stack.append(obj)
+    return [found[name] for name in sorted(found)]
+
+
+def code_version(modules=(), run=None):
+    """
+    ステップのコードのハッシュ値．
+    ステップの関数（run）とそれが呼び出す同じモジュールの関数のソースコード，
+    それらが読み込む CODE_PACKAGE 以下のモジュールと，そのモジュールが読み込むモジュール（推移的に）のソースコードを含める．
+    modules: 追加で含めるモジュール名（読み込みを静的に辿れない場合に指定する）
+    """
+    h = hashlib.sha1()
+    queue = list(modules)
+    if run is not None:
+        for fn in _step_functions(run):
+            try:
+                source = inspect.getsource(fn)
+            except (OSError, TypeError):
+                # ソースコードが得られない場合（対話環境で定義した関数等）はバイトコードで代用する
+                h.update(fn.__code__.co_code)
+                continue
+            h.update(source.encode('utf-8'))
+            queue.extend(_imported_modules(source))
+
+    # 読み込むモジュールを推移的に辿る（親パッケージの __init__.py も含める）
+    sources = {}
+    while queue:
+        module = queue.pop()
+        if module in sources:
+            continue
+        sources[module] = _module_source(module)
+        if '.' in module:
+            queue.append(module.rsplit('.', 1)[0])
+        if sources[module] is not None:
+            queue.extend(_imported_modules(sources[module]))
+
+    for module in sorted(sources):
+        h.update(module.encode('utf-8'))
+        if sources[module] is not None:
+            h.update(sources[module].encode('utf-8'))
+    return h.hexdigest()
+
+
+def _frames(result):
+    """
+    ステップの結果が DataFrame の辞書（複数の表を返すステップ）であればその辞書，それ以外は None
+    """
+    if isinstance(result, dict) and result and all(isinstance(v, pd.DataFrame) for v in result.values()):
+        return result
+    return None
+
+
+def _save_store(result, store_dir, store):
+    """
+    ステップの結果を中間データとして保存する（store が辞書の場合は {結果のキー: 中間データ名}）
+    """
+    if isinstance(store, dict):
+        for key, store_name in store.items():
+            save_frame(result[key], store_dir, store_name)
+    else:
+        save_frame(result, store_dir, store)
+
+
+def _load_store(store_dir, store):
+    """
+    中間データとして保存されたステップの結果を読み込む
+    """
+    if isinstance(store, dict):
+        return {key: load_frame(store_dir, store_name) for key, store_name in store.items()}
+    return load_frame(store_dir, store)
+
+
+def data_hash(obj):
+    """
+    ステップの結果（DataFrame等）の内容のハッシュ値
+    """
+    h = hashlib.sha1()
+    if obj is None:
+        h.update(b'none')
+    elif _frames(obj) is not None:
+        for key in sorted(obj):
+            h.update(key.encode('utf-8'))
+            h.update(data_hash(obj[key]).encode('ascii'))
+    elif isinstance(obj, pd.DataFrame):
+        h.update(json.dumps([[str(c), str(t)] for c, t in obj.dtypes.items()]).encode('utf-8'))
+        h.update(pd.util.hash_pandas_object(obj, index=False).to_numpy().tobytes())
+    else:
+        h.update(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+    return h.hexdigest()
+
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _fingerprint(name, step, input_hashes):
+    material = {
+        'step': name,
+        'code': code_version(step.get('modules', []), step['run']),
+        'params': step.get('params', {}),
+        'inputs': input_hashes,
+        'source': step['source']() if 'source' in step else None,
+    }
+    # グラフを出力するステップは，グラフを作成しない設定での結果と区別する
+    if any(p.startswith(FIGURE_DIR + '/') for p in step.get('outputs', [])):
+        material['figures'] = figures_enabled()
+    return hashlib.sha1(json.dumps(material, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _match_outputs(output_dir, patterns):
+    paths = set()
+    for pattern in patterns:
+        paths.update(glob.glob(os.path.join(output_dir, pattern)))
+    return sorted(os.path.relpath(p, output_dir) for p in paths if os.path.isfile(p))
+
+
+def _save_cache(entry_dir, result, output_dir, outputs, result_hash):
+    tmp_dir = entry_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(os.path.join(tmp_dir, 'files'))
+
+    meta = {}
+    if isinstance(result, pd.DataFrame):
+        save_frame(result, tmp_dir, 'result')
+        kind = 'frame'
+    elif _frames(result) is not None:
+        for key, frame in result.items():
+            save_frame(frame, tmp_dir, f'result.{key}')
+        kind = 'frames'
+        meta['frames'] = list(result)
+    elif result is not None:
+        with open(os.path.join(tmp_dir, 'result.pkl'), 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        kind = 'pickle'
+    else:
+        kind = 'none'
+
+    files = {}
+    for rel in outputs:
+        dest = os.path.join(tmp_dir, 'files', rel)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copy2(os.path.join(output_dir, rel), dest)
+        files[rel] = file_hash(dest)
+
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        meta.update({'result': kind, 'result_hash': result_hash, 'files': files})
+        json.dump(meta, f, ensure_ascii=False, indent=1)
+
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    os.replace(tmp_dir, entry_dir)
+
+
+def _load_meta(entry_dir):
+    try:
+        with open(os.path.join(entry_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _load_cached_result(entry_dir, meta):
+    if meta['result'] == 'frame':
+        return load_frame(entry_dir, 'result')
+    if meta['result'] == 'frames':
+        return {key: load_frame(entry_dir, f'result.{key}') for key in meta['frames']}
+    if meta['result'] == 'pickle':
+        with open(os.path.join(entry_dir, 'result.pkl'), 'rb') as f:
+            return pickle.load(f)
+    return None
+
+
+def _restore_outputs(entry_dir, meta, output_dir, patterns):
+    """
+    キャッシュされた出力ファイルを出力先へ復元する（内容が一致するファイルはそのまま）．
+    現在の出力ファイルのパターンに一致しないファイル（出力から外したファイル）は復元しない
+    """
+    for rel in _match_outputs(output_dir, patterns):
+        if rel not in meta['files']:
+            os.remove(os.path.join(output_dir, rel))
+    for rel, sha1 in meta['files'].items():
+        if not any(fnmatch.fnmatchcase(rel, p) for p in patterns):
+            continue
+        dest = os.path.join(output_dir, rel)
+        if os.path.exists(dest) and file_hash(dest) == sha1:
+            continue
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copy2(os.path.join(entry_dir, 'files', rel), dest)
+
+
+def _prune_cache(step_cache_dir):
+    entries = [
+        os.path.join(step_cache_dir, d) for d in os.listdir(step_cache_dir)
+        if os.path.isdir(os.path.join(step_cache_dir, d)) and not d.endswith('.tmp')
+    ]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for entry in entries[CACHE_GENERATIONS:]:
+        shutil.rmtree(entry, ignore_errors=True)
+
+
+def _execute_step(name, step, inputs, output_dir, entry_dir, use_cache, defer=False):
+    """
+    ステップを実行し，結果とそのハッシュ値を返す（キャッシュが有効なら保存する）．
+    ステップが投入したグラフの描画は，完了を待ってからキャッシュに保存する．
+    defer=True の場合は描画を待たずに，完了待ちと保存を行う関数を3つ目の戻り値として返す（不要な場合は None）
+    """
+    with profile_step(name, inputs) as frame:
+        result = step['run'](inputs)
+        frame['output'] = result
+    result_hash = data_hash(result)
+    figures = take_pending()
+
+    def finalize():
+        wait_figures(figures)
+        if use_cache:
+            patterns = step.get('outputs', [])
+            _save_cache(entry_dir, result, output_dir, _match_outputs(output_dir, patterns), result_hash)
+            _prune_cache(os.path.dirname(entry_dir))
+
+    if defer and figures:
+        return result, result_hash, finalize
+    finalize()
+    return result, result_hash, None
+
+
+def _step_worker(name, step, sources, store_dir, output_dir, entry_dir, use_cache, figures, profiling):
+    """
+    ワーカープロセスでステップを実行する．
+    入力のうち中間データとして保存されたものはワーカー側で（メモリマップで）読み込み，
+    標準出力・標準エラー出力と計測結果はステップごとに回収して返す．
+    グラフはワーカープロセス内で描画する（ワーカーからさらにプロセスを作成しない）．
+    figures: メインプロセスのグラフ描画の有無，profiling: メインプロセスの計測の設定（profiling_config の値）．
+    spawn で起動したワーカーには設定が引き継がれないため引数で渡す
+    """
+    configure_figures(enabled=figures, n_jobs=0)
+    configure_profiling(**profiling)
+    # fork 元のプロセスから引き継いだ計測結果は破棄する
+    take_records()
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        inputs = {}
+        for dep, (kind, value) in sources.items():
+            inputs[dep] = _load_store(store_dir, value) if kind == 'store' else value
+        result, result_hash, _ = _execute_step(name, step, inputs, output_dir, entry_dir, use_cache)
+    # 中間データとして保存される結果はプロセス間で受け渡さない
+    if step.get('store') and store_dir:
+        result = None
+    return result, result_hash, log.getvalue(), take_records()
+
+
+def run_pipeline(steps, targets, output_dir, store_dir=None, use_cache=True, force=False, n_jobs=1,
+                 initializer=None, initargs=()):
+    """
+    ステップグラフを依存関係の順に実行する．
+    各ステップは入力データのハッシュ・コードのバージョン・パラメータで識別し，
+    変更がなければキャッシュから結果と出力ファイルを復元して実行を省略する．
+    キャッシュから復元した結果は，依存するステップを実行するときに読み込み，中間データにも書き戻す．
+    メインプロセスで実行したステップのグラフはバックグラウンドで描画し，後続のステップと並行させる
+    （描画の完了を待ってからキャッシュに保存する）．
+    n_jobs >= 2 の場合は依存関係のないステップをプロセス並列で実行する．
+    その際，中間データ（store）に保存された入力はファイル経由で受け渡し，
+    各ステップのログはステップの順序どおりにまとめて出力する．
+    initializer, initargs: ワーカープロセスの初期化（ステップが参照する設定の受け渡し等．spawn で起動した場合も適用される）
+
+    steps: {ステップ名: {
+        'run': 依存ステップの結果の辞書を受け取り結果を返す関数,
+        'deps': 依存ステップ名のリスト,
+        'modules': コードのバージョンに追加で含めるモジュール名のリスト（任意．run のソースコードと，
+                   そこから推移的に読み込まれる program 以下のモジュールは自動的に含める）,
+        'params': 結果に影響するパラメータ,
+        'outputs': output_dir 以下の出力ファイルのパターン,
+        'store': ステップが結果を保存する中間データ名（任意．結果が DataFrame の辞書の場合は {キー: 中間データ名}）,
+        'source': 外部入力の識別情報を返す関数（任意）,
+        'persist': ステップが作成するが，パイプラインの外でも更新されるためキャッシュから復元しない
+                   output_dir 以下のファイルのリスト（任意．存在しない場合はステップを再実行する）,
+    }}
+    """
+    cache_root = os.path.join(output_dir, '.cache', 'steps')
+    order = resolve_order(steps, targets)
+
+    results = {}
+    hashes = {}
+    # キャッシュから復元したが，まだ結果を読み込んでいないステップ
+    pending = {}
+    # ワーカーで実行し，結果が中間データにのみ存在するステップ
+    stored = set()
+
+    def get_result(name):
+        if name in pending:
+            entry_dir, meta = pending.pop(name)
+            results[name] = _load_cached_result(entry_dir, meta)
+            store_name = steps[name].get('store')
+            if store_dir and store_name and results[name] is not None:
+                _save_store(results[name], store_dir, store_name)
+        elif name in stored:
+            stored.discard(name)
+            results[name] = _load_store(store_dir, steps[name]['store'])
+        return results[name]
+
+    def input_source(dep):
+        store_name = steps[dep].get('store')
+        if store_dir and store_name:
+            if dep in pending:
+                get_result(dep)
+            if dep in stored or results.get(dep) is not None:
+                return ('store', store_name)
+        return ('value', get_result(dep))
+
+    # ログをステップの順序どおりに出力する
+    logs = {}
+    printed = [0]
+
+    def flush_logs():
+        while printed[0] < len(order) and order[printed[0]] in logs:
+            text = logs.pop(order[printed[0]])
+            if text:
+                print(text, end='')
+            printed[0] += 1
+
+    # グラフの描画を待っているステップの完了処理
+    finalizers = []
+
+    remaining = list(order)
+    running = {}
+    executor = None
+    if n_jobs and n_jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=n_jobs, initializer=initializer, initargs=initargs)
+    try:
+        while remaining or running:
+            ready = [n for n in remaining if all(d in hashes for d in steps[n].get('deps', []))]
+            progressed = False
+
+            for name in ready:
+                step = steps[name]
+                fingerprint = _fingerprint(name, step, {dep: hashes[dep] for dep in step.get('deps', [])})
+                entry_dir = os.path.join(cache_root, name, fingerprint[:16])
+                patterns = step.get('outputs', [])
+
+                meta = _load_meta(entry_dir) if use_cache and not force else None
+                # キャッシュから復元しないファイルが失われている場合は作り直す
+                persist = step.get('persist', [])
+                if meta is not None and not all(os.path.exists(os.path.join(output_dir, p)) for p in persist):
+                    meta = None
+                if meta is not None:
+                    _restore_outputs(entry_dir, meta, output_dir, patterns)
+                    os.utime(entry_dir)
+                    pending[name] = (entry_dir, meta)
+                    hashes[name] = meta['result_hash']
+                    remaining.remove(name)
+                    logs[name] = f"\n[i] Step '{name}' is unchanged (restored from cache)\n"
+                    flush_logs()
+                    progressed = True
+                    continue
+
+                # 古い出力ファイルを削除してから実行
+                for rel in _match_outputs(output_dir, patterns):
+                    os.remove(os.path.join(output_dir, rel))
+
+                remaining.remove(name)
+                if executor is None or (not running and len(ready) == 1):
+                    # 他に実行できるステップがない場合はメインプロセスで実行する
+                    flush_logs()
+                    inputs = {dep: get_result(dep) for dep in step.get('deps', [])}
+                    results[name], hashes[name], finalize = _execute_step(
+                        name, step, inputs, output_dir, entry_dir, use_cache, defer=True
+                    )
+                    if finalize is not None:
+                        finalizers.append(finalize)
+                    logs[name] = ''
+                    flush_logs()
+                    progressed = True
+                    break
+
+                sources = {dep: input_source(dep) for dep in step.get('deps', [])}
+                future = executor.submit(
+                    _step_worker, name, step, sources, store_dir, output_dir, entry_dir, use_cache,
+                    figures_enabled(), profiling_config()
+                )
+                running[future] = name
+
+            if progressed or not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                result, hashes[name], logs[name], records = future.result()
+                add_records(records)
+                if steps[name].get('store') and store_dir:
+                    stored.add(name)
+                else:
+                    results[name] = result
+            flush_logs()
+
+        for finalize in finalizers:
+            finalize()
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    return order
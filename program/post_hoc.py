@@ -1,52 +1,93 @@
 import os
+from functools import lru_cache
+import numpy as np
 import pandas as pd
-from statsmodels.stats.multicomp import pairwise_tukeyhsd
+from scipy.stats import studentized_range
 
-def run_tukey_kramer(stim_df, output_dir, lvl):
+# 臨界値のキャッシュ（群の数・自由度・有意水準が同じ評価は再計算しない）
+@lru_cache(maxsize=None)
+def _q_critical(k, df, alpha):
+    return studentized_range.ppf(1 - alpha, k, df)
+
+
+def tukey_kramer_table(groups, alpha=0.05):
+    """
+    群ごとの件数・平均・標準偏差の表（列: Target, Level, Category, n, mean, std．check_strength.group_moments の戻り値）から，
+    全ての (Target, Level) の全ての群の組について Tukey-Kramer 法の多重比較をまとめて行う．
+    群の組はカテゴリ名の昇順（pairwise_tukeyhsd と同じ順序），meandiff は group2 - group1．
+    戻り値: 列 Target, Level, group1, group2, meandiff, se, q, p_adj, lower, upper, reject の表
     """
-    Tukey-Kramer法による多重比較検定を行い，結果をテキストファイルに出力する．
+    g = groups[groups['n'] > 0].sort_values(['Target', 'Level', 'Category'])
+    g = g.assign(m2=((g['n'] - 1) * g['std'] ** 2).where(g['n'] > 1, 0.0))
+
+    # 水準ごとの誤差分散（群内平方和 / 自由度）と群の数
+    keys = ['Target', 'Level']
+    totals = g.groupby(keys, sort=False).agg(k=('Category', 'size'), n_total=('n', 'sum'), ss_within=('m2', 'sum'))
+    totals['df'] = totals['n_total'] - totals['k']
+    totals['mse'] = totals['ss_within'] / totals['df']
+
+    # 同じ水準の群どうしを結合して全ての組を作る
+    cols = keys + ['Category', 'n', 'mean']
+    pairs = g[cols].merge(g[cols], on=keys, suffixes=('1', '2'))
+    pairs = pairs[pairs['Category1'] < pairs['Category2']].merge(totals.reset_index(), on=keys)
+    pairs = pairs[(pairs['k'] >= 2) & (pairs['df'] > 0)]
+
+    meandiff = pairs['mean2'] - pairs['mean1']
+    se = np.sqrt(pairs['mse'] / 2 * (1 / pairs['n1'] + 1 / pairs['n2']))
+    q = np.abs(meandiff) / se
+
+    # 分布の評価は (群の数, 自由度) ごとに1回の配列演算で行う
+    p_adj = pd.Series(np.nan, index=pairs.index)
+    q_crit = pd.Series(np.nan, index=pairs.index)
+    for (k, df), idx in pairs.groupby(['k', 'df']).groups.items():
+        p_adj[idx] = studentized_range.sf(q[idx].to_numpy(), int(k), float(df))
+        q_crit[idx] = _q_critical(int(k), float(df), alpha)
+
+    return pd.DataFrame({
+        'Target': pairs['Target'],
+        'Level': pairs['Level'],
+        'group1': pairs['Category1'],
+        'group2': pairs['Category2'],
+        'meandiff': meandiff,
+        'se': se,
+        'q': q,
+        'p_adj': p_adj,
+        'lower': meandiff - q_crit * se,
+        'upper': meandiff + q_crit * se,
+        'reject': q > q_crit,
+    }).sort_values(['Target', 'Level', 'group1', 'group2']).reset_index(drop=True)
+
+
+def save_posthoc_report(pairs, output_dir, lvl, method="Tukey-Kramer Method"):
     """
-    
+    多重比較の結果の表（tukey_kramer_table の1水準分）をテキストファイルに出力する．
+    """
+
     # テキスト出力用のバッファ
     lines = []
     lines.append("="*60)
-    lines.append("  Post-hoc Test Results (Tukey-Kramer Method)")
+    lines.append(f"  Post-hoc Test Results ({method})")
     lines.append("="*60)
     lines.append("-" * 70)
 
-    try:
-        # Tukey-Kramer検定の実行
-        # endog: 従属変数（変化量）, groups: グループ（カテゴリ）
-        tukey = pairwise_tukeyhsd(
-            endog=stim_df['Delta_Q1_std'], 
-            groups=stim_df['Category'], 
-            alpha=0.05
-        )
+    # 読みやすい形式でバッファに追加
+    lines.append(f"{'Group 1':<12} | {'Group 2':<12} | {'Mean Diff':>10} | {'p-adj':>8} | {'Significant'}")
+    lines.append("-" * 70)
 
-        # 結果をデータフレーム化して整形
-        tukey_df = pd.DataFrame(data=tukey.summary().data[1:], columns=tukey.summary().data[0])
-        
-        # 読みやすい形式でバッファに追加
-        lines.append(f"{'Group 1':<12} | {'Group 2':<12} | {'Mean Diff':>10} | {'p-adj':>8} | {'Significant'}")
-        lines.append("-" * 70)
-        
-        for _, row in tukey_df.iterrows():
-            # 有意差がある行にはマークをつける
-            sig_mark = "*" if row['reject'] else ""
-            res_bool = "Yes" if row['reject'] else "No"
-            
-            lines.append(
-                f"{str(row['group1']):<12} | {str(row['group2']):<12} | "
-                f"{row['meandiff']:10.4f} | {row['p-adj']:8.4f} | {res_bool:<5} {sig_mark}"
-            )
-        
-        lines.append("-" * 70)
-        lines.append("* : p < 0.05")
-        lines.append("- 'Yes' のペアは，操作強度に統計的に明確な差がある")
-        lines.append("- Mean Diffが正の値ならGroup 2の方が強く，負ならGroup 1の方が強い")
+    for row in pairs.itertuples(index=False):
+        # 有意差がある行にはマークをつける
+        sig_mark = "*" if row.reject else ""
+        res_bool = "Yes" if row.reject else "No"
 
-    except Exception as e:
-        lines.append(f"\n[!] Tukey-Kramer test failed: {e}")
+        lines.append(
+            f"{str(row.group1):<12} | {str(row.group2):<12} | "
+            f"{row.meandiff:10.4f} | {row.p_adj:8.4f} | {res_bool:<5} {sig_mark}"
+        )
+
+    lines.append("-" * 70)
+    lines.append("* : p < 0.05")
+    lines.append("- 'Yes' のペアは，操作強度に統計的に明確な差がある")
+    lines.append("- Mean Diffが正の値ならGroup 2の方が強く，負ならGroup 1の方が強い")
 
     # ファイル保存
     output_path = os.path.join(output_dir, f'post-hoc_level{lvl}.txt')
@@ -55,4 +96,4 @@ def run_tukey_kramer(stim_df, output_dir, lvl):
             f.write("\n".join(lines))
         print(f'\n[i] post-hoc test report saved: {output_path}')
     except Exception as e:
-        pass
\ No newline at end of file
+        pass
@@ -0,0 +1,275 @@
+import os
+import sys
+import json
+import time
+import platform
+import datetime
+import functools
+import contextlib
+import tracemalloc
+
+# 計測の設定: enabled で計測する，memory で tracemalloc によるメモリ使用量のピークも計測する（処理は遅くなる），
+# dump_dir を指定するとステップごとの cProfile の結果（<ステップ名>.prof）を保存する
+_config = {'enabled': False, 'memory': False, 'dump_dir': None}
+
+# 計測結果と，計測中の区間（入れ子の親子関係・メモリのピークの受け渡しに使用）
+_records = []
+_stack = []
+_origin = time.perf_counter()
+
+
+def configure_profiling(enabled=False, memory=False, dump_dir=None, origin=None):
+    """
+    計測の設定を変更する（memory または dump_dir を指定した場合は計測も有効にする）．
+    origin: 開始時刻の基準（perf_counter の値．省略時は現在時刻．ワーカープロセスでメインプロセスと揃える場合に指定する）
+    """
+    global _origin
+    _config['enabled'] = enabled or memory or bool(dump_dir)
+    _config['memory'] = memory
+    _config['dump_dir'] = dump_dir
+    _origin = time.perf_counter() if origin is None else origin
+
+
+def profiling_enabled():
+    return _config['enabled']
+
+
+def profiling_config():
+    """
+    現在の計測の設定（configure_profiling の引数．ワーカープロセスへの受け渡し用）
+    """
+    return dict(_config, origin=_origin)
+
+
+def _rows(obj):
+    """
+    DataFrame の行数（辞書の場合は値の DataFrame の行数の合計．DataFrame でなければ None）
+    """
+    if hasattr(obj, 'shape') and hasattr(obj, 'columns'):
+        return int(obj.shape[0])
+    if isinstance(obj, dict):
+        rows = [_rows(v) for v in obj.values() if hasattr(v, 'columns')]
+        return sum(rows) if rows else None
+    return None
+
+
+def _written_bytes():
+    """
+    このプロセスがストレージに書き込んだバイト数（Linux の /proc/self/io の write_bytes．
+    標準出力・パイプへの書き込みは含まない．取得できない場合は None）
+    """
+    try:
+        with open('/proc/self/io', 'r') as f:
+            for line in f:
+                if line.startswith('write_bytes:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _status_mb(field):
+    """
+    /proc/self/status の項目（VmRSS: 物理メモリ使用量，VmHWM: そのピーク）の値（MB．Linux 以外は None）
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 2 ** 10
+    except OSError:
+        pass
+    return None
+
+
+def _rss_peak_mb():
+    """
+    このプロセスの物理メモリ使用量のピーク（MB．取得できない場合は None）
+    """
+    peak = _status_mb('VmHWM')
+    if peak is not None:
+        return peak
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB，macOS はバイト単位
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def _reset_rss_peak():
+    """
+    物理メモリ使用量のピークを現在の使用量にリセットする（Linux の /proc/self/clear_refs．成否を返す）
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+@contextlib.contextmanager
+def measure(name, inputs=None):
+    """
+    区間の実行時間・CPU時間・メモリ使用量のピーク・書き込んだバイト数を計測して記録する．
+    物理メモリ使用量のピーク（peak_rss_mb）は区間の開始時にリセットして区間内のピークとし，
+    開始時の使用量からの増加量（peak_rss_delta_mb）も記録する
+    （リセットできない環境ではプロセスの開始からのピークとなり，peak_rss_scope が 'process'，増加量は None となる）．
+    yield した辞書の 'output' に結果を設定すると出力の行数も記録する
+    """
+    frame = {'output': None, 'traced_peak': 0, 'rss_peak': 0.0}
+    record = {
+        'name': name,
+        'parent': _stack[-1]['record']['name'] if _stack else None,
+        'start_s': round(time.perf_counter() - _origin, 6),
+        'rows_in': _rows(inputs),
+    }
+    frame['record'] = record
+
+    if _config['memory']:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # 外側の区間のピークを確定してから，この区間のピークを計測する
+        peak = tracemalloc.get_traced_memory()[1]
+        for outer in _stack:
+            outer['traced_peak'] = max(outer['traced_peak'], peak)
+        tracemalloc.reset_peak()
+        frame['traced_base'] = tracemalloc.get_traced_memory()[0]
+
+    # 外側の区間の物理メモリのピークを確定してから，この区間のピークを計測する
+    rss_peak = _rss_peak_mb()
+    if rss_peak is not None:
+        for outer in _stack:
+            outer['rss_peak'] = max(outer['rss_peak'], rss_peak)
+    frame['rss_reset'] = _reset_rss_peak()
+    frame['rss_start'] = _status_mb('VmRSS')
+
+    _stack.append(frame)
+    written = _written_bytes()
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    try:
+        yield frame
+    finally:
+        record['wall_s'] = round(time.perf_counter() - wall, 6)
+        record['cpu_s'] = round(time.process_time() - cpu, 6)
+        end_written = _written_bytes()
+        record['bytes_written'] = end_written - written if written is not None and end_written is not None else None
+        rss_peak = _rss_peak_mb()
+        if rss_peak is not None and frame['rss_reset']:
+            rss_peak = max(frame['rss_peak'], rss_peak)
+        record['peak_rss_mb'] = round(rss_peak, 3) if rss_peak is not None else None
+        record['peak_rss_scope'] = 'step' if frame['rss_reset'] else 'process'
+        record['peak_rss_delta_mb'] = (
+            round(rss_peak - frame['rss_start'], 3) if frame['rss_reset'] and frame['rss_start'] is not None else None
+        )
+        record['rows_out'] = _rows(frame['output'])
+        _stack.pop()
+        if rss_peak is not None and _stack:
+            _stack[-1]['rss_peak'] = max(_stack[-1]['rss_peak'], rss_peak)
+
+        if _config['memory']:
+            peak = max(frame['traced_peak'], tracemalloc.get_traced_memory()[1])
+            record['traced_peak_mb'] = round((peak - frame['traced_base']) / 2 ** 20, 3)
+            if _stack:
+                _stack[-1]['traced_peak'] = max(_stack[-1]['traced_peak'], peak)
+            else:
+                tracemalloc.stop()
+        _records.append(record)
+
+
+def profiled(fn):
+    """
+    関数の呼び出しを計測するデコレータ（計測の名前は '<モジュール名>.<関数名>'）．
+    計測が無効の場合はそのまま呼び出す．入力の行数は最初の DataFrame の引数から求める
+    """
+    name = f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not _config['enabled']:
+            return fn(*args, **kwargs)
+        inputs = next((a for a in list(args) + list(kwargs.values()) if _rows(a) is not None), None)
+        with measure(name, inputs) as frame:
+            frame['output'] = fn(*args, **kwargs)
+        return frame['output']
+
+    return wrapper
+
+
+def annotate(**fields):
+    """
+    計測中の区間の記録に項目を追加する（計測が無効，または計測中の区間がない場合は何もしない）
+    """
+    if _config['enabled'] and _stack:
+        _stack[-1]['record'].update(fields)
+
+
+@contextlib.contextmanager
+def profile_step(name, inputs=None):
+    """
+    パイプラインのステップを計測する（計測が無効の場合は何もしない）．
+    dump_dir を指定した場合は cProfile の結果を <dump_dir>/<ステップ名>.prof に保存する
+    """
+    if not _config['enabled']:
+        yield {}
+        return
+
+    profiler = None
+    if _config['dump_dir']:
+        import cProfile
+        profiler = cProfile.Profile()
+    try:
+        with measure(f"step.{name}", inputs) as frame:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                yield frame
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+    finally:
+        # 書き込んだバイト数に含めないよう，計測の区間の外で保存する
+        if profiler is not None:
+            os.makedirs(_config['dump_dir'], exist_ok=True)
+            profiler.dump_stats(os.path.join(_config['dump_dir'], f"{name}.prof"))
+
+
+def take_records():
+    """
+    記録した計測結果を取り出す（ワーカープロセスからメインプロセスへの受け渡し用）
+    """
+    records = list(_records)
+    _records.clear()
+    return records
+
+
+def add_records(records):
+    _records.extend(records)
+
+
+def save_run_profile(output_dir, filename='run_profile.json'):
+    """
+    計測結果を JSON ファイルに出力する（記録がない場合は何もしない）
+    """
+    if not _records:
+        return None
+    profile = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'memory': _config['memory'],
+        'records': sorted(_records, key=lambda r: r['start_s']),
+    }
+    output_path = os.path.join(output_dir, filename)
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(profile, f, ensure_ascii=False, indent=1)
+        print(f"\n[i] Run profile saved: {output_path}")
+    except Exception as e:
+        print(f"[!] Failed to save run profile: {e}")
+    return output_path
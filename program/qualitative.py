@@ -1,73 +1,137 @@
+import numpy as np
 import pandas as pd
 import os
-import matplotlib.pyplot as plt
-import seaborn as sns
-from collections import Counter
-from janome.tokenizer import Tokenizer
-import platform
 
-def run_qualitative_analysis(df, output_dir):
+from program.figures import FIGURE_DIR, submit_figure
+from program.morph import tokenize_frame
+from program.dtm import build_dtm, crosstab
+from program.profiling import profiled
+
+# 形態素解析の対象とするテキストカラム
+TEXT_COLS = ['Q1_Answer', 'Q1_Reason', 'Q2_Answer', 'Q2_Reason']
+
+@profiled
+def run_qualitative_analysis(df, output_dir, token_cache=True, n_jobs=1):
     """
-    匿名化データを用いて頻出語分析およびクロス集計を行う
+    匿名化データを用いて頻出語分析およびクロス集計を行う．
+    token_cache=True の場合は形態素解析の結果をディスクにキャッシュし，未解析のテキストのみを解析する．
+    n_jobs >= 2 の場合は形態素解析をプロセス並列で行う
     """
 
-    system = platform.system()
-    if system == 'Darwin':  # macOS
-        plt.rcParams['font.family'] = 'Hiragino Sans'
-    elif system == 'Windows':  # Windows
-        plt.rcParams['font.family'] = 'MS Gothic'
-    else:
-        plt.rcParams['font.family'] = 'IPAexGothic'
-
-    try:
-        t = Tokenizer()
-    except Exception:
+    # 1. 計算パート
+    counts = calculate_qualitative_counts(df, output_dir, token_cache=token_cache, n_jobs=n_jobs)
+    if counts is None:
         return
 
+    # 2. 出力パート
+    save_qualitative_outputs(counts, output_dir)
+
+
+@profiled
+def calculate_qualitative_counts(df, output_dir, token_cache=True, n_jobs=1):
+    """
+    計算パート
+    形態素解析を行い，テキストカラムごとの語の出現回数と (Category, Level) × 語の出現回数を求める．
+    行を分割して求めた結果は merge_qualitative_counts で足し合わせられる．
+    戻り値: {'word_counts': 列 Column, Word, POS, Count の表,
+            'level_counts': (Category, Level) × 全語彙の出現回数の表（語がない場合は None）}．
+    テキストカラムがない場合・janome がない場合は None
+    """
+
     # テキストカラムの特定
     text_col = next((c for c in df.columns if 'Q2_Reason' in c or 'reason' in c), None)
-    if not text_col: return
+    if not text_col: return None
+
+    # 形態素解析: 全テキストカラムを1行 = 1トークンの表として取得する
+    # （同一テキストは1度だけ解析し，解析済みのテキストはキャッシュから取得）
+    cache_path = os.path.join(output_dir, '.cache', 'tokens.sqlite') if token_cache else None
+    text_cols = [c for c in TEXT_COLS if c in df.columns]
+    if text_col not in text_cols:
+        text_cols.append(text_col)
+    # janome がない環境では頻出語分析を省略する（それ以外のエラーは呼び出し元に伝える）
+    try:
+        tokens = tokenize_frame(df, text_cols, cache_path=cache_path, n_jobs=n_jobs)
+    except ImportError as e:
+        print(f"[!] Qualitative analysis skipped: {e}")
+        return None
 
     stop_words = ['こと', 'よう', 'そう', 'もの', 'それ', 'これ', 'ん', 'の', 'ため', '感じ']
-    
-    def extract_words(text):
-        if not isinstance(text, str): return []
-        words = []
-        for token in t.tokenize(text):
-            if token.part_of_speech.split(',')[0] in ['名詞', '形容詞']:
-                word = token.base_form
-                if word not in stop_words and len(word) > 1:
-                    words.append(word)
-        return words
-
-    # カテゴリごとの単語集計
-    all_words = []
-    category_words = {}
-
-    for cat in df['Category'].unique():
-        words_in_cat = []
-        for text in df[df['Category'] == cat][text_col]:
-            words_in_cat.extend(extract_words(text))
-        category_words[cat] = words_in_cat
-        all_words.extend(words_in_cat)
-
-    if not all_words: return
-
-    # クロス集計とヒートマップの作成
-    top_n_words = [w for w, c in Counter(all_words).most_common(30)]
-    cross_tab = pd.DataFrame(0, index=df['Category'].unique(), columns=top_n_words)
-
-    for cat, words in category_words.items():
-        counts = Counter(words)
-        for word in top_n_words:
-            cross_tab.loc[cat, word] = counts[word]
-
-    plt.figure(figsize=(12, 8))
-    sns.heatmap(cross_tab.astype(int), annot=True, fmt="d", cmap="YlGnBu")
-    plt.title('Word Frequency by Category')
-    plt.tight_layout()
-    output_path = os.path.join(output_dir, 'figures', 'qualitative_heatmap.png')
-    plt.savefig(output_path)
-    plt.close()
-
-    print(f"\n[i] qualiative heatmap saved: {output_path}")
\ No newline at end of file
+    tokens = tokens[~tokens['token'].isin(stop_words) & (tokens['token'].str.len() > 1)]
+
+    # テキストカラムごとの出現回数（初出順）
+    word_counts = (
+        tokens.groupby(['column', 'token', 'pos'], sort=False).size()
+        .reset_index(name='Count')
+        .rename(columns={'column': 'Column', 'token': 'Word', 'pos': 'POS'})
+    )
+
+    # 文書-単語行列（疎行列）の作成（出力する語の順は save_qualitative_outputs で決める）
+    words = tokens[tokens['column'] == text_col]
+
+    level_counts = None
+    if not words.empty:
+        meta_cols = [c for c in ['Category', 'Level', 'PID'] if c in df.columns]
+        dtm = build_dtm(words, df[meta_cols])
+        # カテゴリ×レベル別（Level 列がない場合はカテゴリ別）の全語彙の出現回数
+        level_counts = crosstab(dtm, ['Category', 'Level'] if 'Level' in meta_cols else ['Category'])
+
+    return {'word_counts': word_counts, 'level_counts': level_counts}
+
+
+def _add_tables(a, b):
+    """
+    行・列のラベルを初出順に揃えて2つの出現回数の表を足し合わせる（語の列の順は出力時に並べ替える）
+    """
+    if a is None or b is None:
+        return b if a is None else a
+    index = a.index.append(b.index).unique()
+    columns = a.columns.append(b.columns).unique()
+    return a.reindex(index=index, columns=columns, fill_value=0) + b.reindex(index=index, columns=columns, fill_value=0)
+
+
+def merge_qualitative_counts(a, b):
+    """
+    calculate_qualitative_counts の結果を足し合わせる（一方が None の場合はもう一方を返す）
+    """
+    if a is None or b is None:
+        return b if a is None else a
+    word_counts = (
+        pd.concat([a['word_counts'], b['word_counts']], ignore_index=True)
+        .groupby(['Column', 'Word', 'POS'], sort=False)['Count'].sum()
+        .reset_index()
+    )
+    return {'word_counts': word_counts, 'level_counts': _add_tables(a['level_counts'], b['level_counts'])}
+
+
+@profiled
+def save_qualitative_outputs(counts, output_dir):
+    """
+    出力パート
+    """
+    # 語の順は出現回数の多い順，同数の場合は語の順とする（分割して集計した場合も同じ順になる）
+    word_counts = counts['word_counts']
+    if not word_counts.empty:
+        word_counts = word_counts.sort_values(
+            ['Column', 'Count', 'Word', 'POS'], ascending=[True, False, True, True], kind='stable'
+        )
+        counts_path = os.path.join(output_dir, 'qualitative_word_counts.csv')
+        word_counts.to_csv(counts_path, index=False, encoding='utf-8-sig')
+        print(f"\n[i] qualitative word counts saved: {counts_path}")
+
+    level_counts = counts['level_counts']
+    if level_counts is None: return
+
+    # クロス集計（カテゴリ別・カテゴリ×レベル別）: 総出現回数の上位30語（同数の場合は語の順）
+    totals = level_counts.sum(axis=0).to_numpy()
+    order = np.lexsort((level_counts.columns.to_numpy(dtype=str), -totals))
+    top = level_counts.columns[order[totals[order] > 0][:30]]
+    if level_counts.index.nlevels > 1:
+        cross_tab = level_counts[top].groupby(level='Category', sort=False).sum()
+        level_counts[top].to_csv(os.path.join(output_dir, 'qualitative_crosstab_level.csv'), encoding='utf-8-sig')
+    else:
+        cross_tab = level_counts[top]
+    cross_tab.to_csv(os.path.join(output_dir, 'qualitative_crosstab.csv'), encoding='utf-8-sig')
+
+    # ヒートマップの作成（行・列の名前は軸ラベルとして描画されるため外す）
+    output_path = os.path.join(output_dir, FIGURE_DIR, 'qualitative_heatmap.png')
+    submit_figure('word_heatmap', cross_tab.rename_axis(index=None, columns=None), output_path, 'qualiative heatmap')
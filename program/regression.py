@@ -1,119 +1,328 @@
+import numpy as np
 import pandas as pd
-import statsmodels.api as sm
-import matplotlib.pyplot as plt
-import seaborn as sns
 import os
+from scipy import stats
 
-def run_regression(df, output_dir):
+from program.bootstrap import cluster_bootstrap
+from program.figures import FIGURE_DIR, submit_figure
+from program.profiling import profiled
+
+# 説明変数と目的変数
+EXPLANATORY_VARS = ['q3', 'q4', 'q5', 'q6', 'q7']
+TARGETS = ['q1', 'q2']
+TARGET_LABELS = {'q1': "Q1 (Strangeness)", 'q2': "Q2 (Creepiness)"}
+
+# 部分集合モデルの単位（プールしたモデルに加え，各列の値ごとにモデルを推定する）
+SUBSET_KEYS = ['Level', 'Category']
+
+# 特異とみなす X'X の相対的なピボットの大きさ（他の説明変数で説明されない割合 1 - R^2 がこれ以下の列がある場合）
+SINGULAR_TOL = 1e-12
+
+@profiled
+def run_regression(df, output_dir, targets=TARGETS, subset_keys=SUBSET_KEYS, n_boot=0, seed=0, n_jobs=1):
     """
     重回帰分析
-    Level 2（弱刺激）と Level 3（強刺激）の両方をプールして分析を行う（同一モデルとしての分析）
+    Level 2（弱刺激）と Level 3（強刺激）の両方をプールして分析を行う（同一モデルとしての分析）．
+    あわせて Level 別・Category 別の部分集合モデルも推定する．
+    n_boot >= 1 の場合はプールしたモデルの係数について参加者単位のブートストラップ信頼区間を求める
     """
 
     # 計算パート
-    results = calculate_regression(df)
-    
+    results = calculate_regression(df, targets, subset_keys)
+
     if not results:
         print("[!] Regression analysis failed due to data issues.")
         return
 
+    if n_boot:
+        results['bootstrap'] = calculate_bootstrap(df, targets, n_boot, seed=seed, n_jobs=n_jobs)
+
     # 出力パート
     save_regression_outputs(results, output_dir)
+    return results
+
+
+def design_grams(df, targets=TARGETS, subset_keys=SUBSET_KEYS):
+    """
+    刺激条件の行から [定数項, 説明変数 | 目的変数] の行列を1回だけ作り，
+    subset_keys のセル（既定: Level × Category）ごとに積和行列を求める．欠損値を含む行は除く．
+    戻り値: cells（セルのラベル）, gram（セル数 × p × p）, n（セルごとの行数）, level_counts
+    """
+    df_reg = df[df['Category'] != 'base'].dropna(subset=EXPLANATORY_VARS + list(targets) + list(subset_keys))
+    if df_reg.empty:
+        return None
+
+    z = np.column_stack([
+        np.ones(len(df_reg)), df_reg[EXPLANATORY_VARS + list(targets)].to_numpy(dtype=np.float64)
+    ])
+    grouped = df_reg.groupby(list(subset_keys), sort=True, observed=True)
+    cells = grouped.size()
+    codes = grouped.ngroup().to_numpy()
+
+    # セルごとに行を並べ替え，連続した区間の積和を求める
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(cells) + 1))
+    gram = np.empty((len(cells), z.shape[1], z.shape[1]))
+    for g in range(len(cells)):
+        zg = z[order[bounds[g]:bounds[g + 1]]]
+        gram[g] = zg.T @ zg
+
+    return {
+        'cells': cells.index.to_frame(index=False),
+        'gram': gram,
+        'n': cells.to_numpy(dtype=np.float64),
+        'level_counts': df_reg['Level'].value_counts().to_dict(),
+    }
+
+
+def merge_grams(a, b):
+    """
+    design_grams の結果（セルごとの積和行列）を足し合わせる（データを分割して求めた結果の統合用）．
+    セルはラベルの昇順に並べ直す．一方が None の場合はもう一方を返す
+    """
+    if a is None or b is None:
+        return b if a is None else a
+    cells = pd.concat([a['cells'], b['cells']], ignore_index=True).astype(object)
+    merged = cells.drop_duplicates().sort_values(list(cells.columns)).reset_index(drop=True)
+    pos = pd.MultiIndex.from_frame(merged).get_indexer(pd.MultiIndex.from_frame(cells))
+
+    gram = np.zeros((len(merged),) + a['gram'].shape[1:])
+    np.add.at(gram, pos, np.concatenate([a['gram'], b['gram']]))
+    level_counts = dict(a['level_counts'])
+    for lvl, count in b['level_counts'].items():
+        level_counts[lvl] = level_counts.get(lvl, 0) + count
+    return {
+        'cells': merged,
+        'gram': gram,
+        'n': np.bincount(pos, weights=np.concatenate([a['n'], b['n']]), minlength=len(merged)),
+        'level_counts': level_counts,
+    }
+
+
+def subset_indicator(cells):
+    """
+    プールしたモデルと，セルのラベルの各列の値ごとの部分集合モデルに含めるセルの指示行列（モデル数 × セル数）
+    """
+    labels = ['Pooled']
+    masks = [np.ones(len(cells), dtype=bool)]
+    for col in cells.columns:
+        for value in sorted(cells[col].unique()):
+            labels.append(f"{col} {value}")
+            masks.append((cells[col] == value).to_numpy())
+    return labels, np.array(masks, dtype=np.float64)
+
+
+def gram_inverse(xtx):
+    """
+    X'X（... × k × k）の逆行列をコレスキー分解から求める．
+    一括での分解に失敗した場合は行列ごとに分解し直し，特異な行列のみ擬似逆行列とする．
+    丸め誤差により分解できた特異な行列（ピボットが列の平方和の SINGULAR_TOL 倍以下）も擬似逆行列とする
+    """
+    try:
+        chol = np.linalg.cholesky(xtx)
+    except np.linalg.LinAlgError:
+        if xtx.ndim == 2:
+            return np.linalg.pinv(xtx)
+        return np.stack([gram_inverse(g) for g in xtx])
+
+    chol_inv = np.linalg.inv(chol)
+    inverse = np.swapaxes(chol_inv, -1, -2) @ chol_inv
+    pivots = np.diagonal(chol, axis1=-2, axis2=-1) ** 2
+    singular = (pivots <= SINGULAR_TOL * np.diagonal(xtx, axis1=-2, axis2=-1)).any(axis=-1)
+    if xtx.ndim == 2:
+        return np.linalg.pinv(xtx) if singular else inverse
+    if singular.any():
+        inverse[singular] = np.linalg.pinv(xtx[singular])
+    return inverse
 
 
-def calculate_regression(df):
+def fit_ols(xtx, xty, yty, n):
+    """
+    積和行列（X'X, X'Y, Y'Y の対角）から，全モデル・全目的変数の最小二乗推定をまとめて行う．
+    xtx: (モデル数, k, k), xty: (モデル数, k, 目的変数数), yty: (モデル数, 目的変数数), n: (モデル数,)
+    X の先頭列は定数項とする．X'X はモデルごとに1回だけ分解（コレスキー分解，特異なモデルのみ擬似逆行列）し，
+    全目的変数で共有する．
+    戻り値: params, bse, tvalues, pvalues (モデル数 × k × 目的変数数) と
+    rsquared, rsquared_adj, fvalue, f_pvalue (モデル数 × 目的変数数), nobs, df_resid (モデル数) の配列
+    """
+    k = xtx.shape[1]
+    xtx_inv = gram_inverse(xtx)
+    beta = xtx_inv @ xty
+
+    n = np.asarray(n, dtype=np.float64)
+    df_resid = n - k
+    df_model = k - 1
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ssr = yty - np.einsum('skm,skm->sm', beta, xty)
+        scale = ssr / df_resid[:, None]
+        bse = np.sqrt(np.diagonal(xtx_inv, axis1=1, axis2=2)[:, :, None] * scale[:, None, :])
+        tvalues = beta / bse
+
+        # 決定係数とF検定（平均まわりの全平方和を用いる）
+        centered_tss = yty - xty[:, 0, :] ** 2 / n[:, None]
+        rsquared = 1 - ssr / centered_tss
+        rsquared_adj = 1 - ((n - 1) / df_resid)[:, None] * (1 - rsquared)
+        fvalue = (centered_tss - ssr) / df_model / scale
+
+    return {
+        'params': beta,
+        'bse': bse,
+        'tvalues': tvalues,
+        'pvalues': 2 * stats.t.sf(np.abs(tvalues), df_resid[:, None, None]),
+        'rsquared': rsquared,
+        'rsquared_adj': rsquared_adj,
+        'fvalue': fvalue,
+        'f_pvalue': stats.f.sf(fvalue, df_model, df_resid[:, None]),
+        'nobs': n,
+        'df_resid': df_resid,
+    }
+
+
+@profiled
+def calculate_regression(df, targets=TARGETS, subset_keys=SUBSET_KEYS):
     """
     計算パート
+    セルごとの積和行列を1回だけ求め，プールしたモデルと部分集合モデルの積和行列はその和として作る
     """
-    df_reg = df[df['Category'] != 'base'].copy()
+    grams = design_grams(df, targets, subset_keys)
 
-    if df_reg.empty:
+    if grams is None:
         print("[!] No data found for regression (check Category column).")
         return None
+    return regression_results_from_grams(grams, targets)
+
+
+def regression_results_from_grams(grams, targets=TARGETS):
+    """
+    セルごとの積和行列（design_grams / merge_grams の結果）から，プールしたモデルと部分集合モデルを推定する
+    """
+    labels, indicator = subset_indicator(grams['cells'])
+    gram = np.einsum('sg,gij->sij', indicator, grams['gram'])
+    k = len(EXPLANATORY_VARS) + 1
+    fit = fit_ols(
+        gram[:, :k, :k], gram[:, :k, k:], np.diagonal(gram[:, k:, k:], axis1=1, axis2=2), indicator @ grams['n']
+    )
 
-    # レベルごとのデータ数を確認（ログ用）
-    level_counts = df_reg['Level'].value_counts().to_dict()
-
-    explanatory_vars = ['q3', 'q4', 'q5', 'q6', 'q7']
-    targets = ['q1', 'q2']
-    
-    # 定数項の追加
-    X = df_reg[explanatory_vars]
-    X = sm.add_constant(X)
-
-    models = {}
-    summary_data = []
-
-    for target in targets:
-        y = df_reg[target]
-        model = sm.OLS(y, X).fit()
-        
-        models[target] = model
-        
-        # グラフ用データの蓄積
-        for var in explanatory_vars:
-            summary_data.append({
-                'Target': target.upper(),
-                'Factor': var,
-                'Coefficient': model.params[var],
-                'P_value': model.pvalues[var]
-            })
-            
     return {
-        'n_samples': len(df_reg),
-        'level_counts': level_counts,
-        'explanatory_vars': explanatory_vars,
-        'models': models,
-        'summary_data': summary_data
+        'n_samples': int(grams['n'].sum()),
+        # レベルごとのデータ数を確認（ログ用）
+        'level_counts': grams['level_counts'],
+        'explanatory_vars': EXPLANATORY_VARS,
+        'targets': list(targets),
+        'subsets': labels,
+        # モデルごとの積和行列（VIF等の再利用のため保持）
+        'gram': gram,
+        **fit
     }
 
 
+@profiled
+def calculate_bootstrap(df, targets=TARGETS, n_boot=10000, seed=0, n_jobs=1):
+    """
+    計算パート（ブートストラップ）
+    同一参加者の行は相関するため，参加者単位で復元抽出する．参加者ごとの積和行列を1回だけ求めて再標本に用いる
+    """
+    blocks = design_grams(df, targets, ['PID'])
+    if blocks is None:
+        return None
+    k = len(EXPLANATORY_VARS) + 1
+    return cluster_bootstrap(
+        blocks['gram'][:, :k, :k], blocks['gram'][:, :k, k:], n_boot, seed=seed, n_jobs=n_jobs
+    )
+
+
+def _sig_mark(p_val):
+    return "**" if p_val < 0.01 else "*" if p_val < 0.05 else ""
+
+
+@profiled
 def save_regression_outputs(results, output_dir):
     """
     出力パート
+    係数等の配列からプールしたモデルのレポート・部分集合モデルの一覧・係数の比較グラフを作成する
     """
-    fig_dir = os.path.join(output_dir, 'figures')
-    os.makedirs(fig_dir, exist_ok=True)
+    fig_dir = os.path.join(output_dir, FIGURE_DIR)
     report_path = os.path.join(output_dir, 'regression_report.txt')
 
-    models = results['models']
     explanatory_vars = results['explanatory_vars']
-    
+    targets = results['targets']
+
     lines = []
     lines.append("Regression Analysis Report")
     lines.append("==========================")
     lines.append(f"Total Data Points: {results['n_samples']}")
-    
+
     # 内訳の表示
     lines.append("Data breakdown by Level:")
     for lvl, count in sorted(results['level_counts'].items()):
         lines.append(f"  - Level {lvl}: {count} samples")
     lines.append("(Both levels are pooled in the regression model)")
-    
+
     lines.append(f"\nExplanatory Variables: {', '.join(explanatory_vars)}")
     lines.append("-" * 60)
 
-    for target, model in models.items():
-        target_label = "Q1 (Strangeness)" if target == 'q1' else "Q2 (Creepiness)"
+    # プールしたモデル（部分集合モデルの先頭）
+    for j, target in enumerate(targets):
+        target_label = TARGET_LABELS.get(target, target.upper())
         lines.append(f"\n[Target Variable: {target_label}]")
-        lines.append(f"R-squared: {model.rsquared:.4f}")
-        lines.append(f"Adj. R-squared: {model.rsquared_adj:.4f}")
-        lines.append(f"F-statistic: {model.fvalue:.4f} (p={model.f_pvalue:.4e})")
+        lines.append(f"R-squared: {results['rsquared'][0, j]:.4f}")
+        lines.append(f"Adj. R-squared: {results['rsquared_adj'][0, j]:.4f}")
+        lines.append(f"F-statistic: {results['fvalue'][0, j]:.4f} (p={results['f_pvalue'][0, j]:.4e})")
         lines.append("\nCoefficients:")
         lines.append(f"{'Factor':<10} {'Coef (Beta)':>12} {'Std.Err':>10} {'t':>8} {'P>|t|':>8} {'Sig':>4}")
         lines.append("-" * 75)
-        
-        for var in explanatory_vars:
-            coef = model.params[var]
-            std_err = model.bse[var]
-            t_val = model.tvalues[var]
-            p_val = model.pvalues[var]
-            sig = "**" if p_val < 0.01 else "*" if p_val < 0.05 else ""
-            
+
+        for i, var in enumerate(explanatory_vars, start=1):
+            coef = results['params'][0, i, j]
+            std_err = results['bse'][0, i, j]
+            t_val = results['tvalues'][0, i, j]
+            p_val = results['pvalues'][0, i, j]
+            sig = _sig_mark(p_val)
+
             lines.append(f"{var:<10} {coef:12.4f} {std_err:10.4f} {t_val:8.3f} {p_val:8.4f} {sig:>4}")
-        
+
         lines.append("-" * 75)
 
+    # 参加者単位のブートストラップ信頼区間
+    boot = results.get('bootstrap')
+    if boot:
+        level = int(round((1 - boot['alpha']) * 100))
+        lines.append(
+            f"\n[Cluster Bootstrap] {boot['n_boot']} resamples of {boot['n_clusters']} participants (seed={boot['seed']})"
+        )
+        for j, target in enumerate(targets):
+            lines.append(f"\n{TARGET_LABELS.get(target, target.upper())}")
+            lines.append(
+                f"{'Factor':<10} {'Coef (Beta)':>12} {'Boot SE':>10} "
+                f"{f'{level}% Percentile CI':>22} {f'{level}% BCa CI':>22}"
+            )
+            lines.append("-" * 80)
+            for i, var in enumerate(explanatory_vars, start=1):
+                pct = boot['percentile'][:, i, j]
+                bca = boot['bca'][:, i, j]
+                lines.append(
+                    f"{var:<10} {boot['estimate'][i, j]:12.4f} {boot['se'][i, j]:10.4f} "
+                    f"{f'[{pct[0]:.4f}, {pct[1]:.4f}]':>22} {f'[{bca[0]:.4f}, {bca[1]:.4f}]':>22}"
+                )
+            lines.append("-" * 80)
+
+    # 部分集合モデルの一覧（係数と有意性）
+    if len(results['subsets']) > 1:
+        lines.append("\n[Subset Models] Coefficients (Beta) by Level / Category")
+        header = f"{'Subset':<22} {'Target':>6} {'N':>6} {'R2':>7}"
+        header += "".join(f" {var:>8}  " for var in explanatory_vars)
+        lines.append(header)
+        lines.append("-" * len(header))
+        for s, subset in enumerate(results['subsets'][1:], start=1):
+            for j, target in enumerate(targets):
+                row = f"{subset:<22} {target.upper():>6} {int(results['nobs'][s]):6d} {results['rsquared'][s, j]:7.4f}"
+                for i in range(1, len(explanatory_vars) + 1):
+                    coef = results['params'][s, i, j]
+                    row += f" {coef:8.4f}{_sig_mark(results['pvalues'][s, i, j]):<2}"
+                lines.append(row)
+        lines.append("-" * len(header))
+        lines.append("** p < 0.01, * p < 0.05")
+
     try:
         with open(report_path, 'w', encoding='utf-8') as f:
             f.write("\n".join(lines))
@@ -121,23 +330,20 @@ def save_regression_outputs(results, output_dir):
     except Exception as e:
         print(f"[!] Failed to save report: {e}")
 
-    # グラフ描画
-    if results['summary_data']:
-        res_df = pd.DataFrame(results['summary_data'])
-        
-        plt.figure(figsize=(10, 6))
-        sns.barplot(x='Factor', y='Coefficient', hue='Target', data=res_df, palette='viridis')
-        plt.axhline(0, color='black', linewidth=0.8)
-        
-        plt.title('Comparison of Standardized Coefficients (Beta)\nQ1 vs Q2 (Pooled Level 2 & 3)')
-        plt.ylabel('Standardized Beta')
-        plt.xlabel('Explanatory Factors')
-        plt.legend(title='Target Variable')
-        plt.grid(axis='y', linestyle='--', alpha=0.5)
-        
+    # グラフ描画（プールしたモデルの係数）
+    summary_data = [
+        {
+            'Target': target.upper(),
+            'Factor': var,
+            'Coefficient': results['params'][0, i, j],
+            'P_value': results['pvalues'][0, i, j]
+        }
+        for j, target in enumerate(targets) for i, var in enumerate(explanatory_vars, start=1)
+    ]
+    if summary_data:
+        res_df = pd.DataFrame(summary_data)
+        title = (
+            f"Comparison of Standardized Coefficients (Beta)\n{' vs '.join(t.upper() for t in targets)} (Pooled Level 2 & 3)"
+        )
         img_path = os.path.join(fig_dir, 'reg_comparison.png')
-        plt.tight_layout()
-        plt.savefig(img_path)
-        plt.close()
-
-        print(f"\n[i] regression figure saved: {img_path}")
\ No newline at end of file
+        submit_figure('coefficient_barplot', res_df, img_path, 'regression figure', title=title)
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+# Tidy Data（1行 = 参加者×刺激）の列の型
+#   カテゴリ型: 値の種類が少ないキー列（整数コード + 値の一覧で保持し，groupby も整数コードで行う）
+#   回答値・レベル: 1〜7 程度の整数のため int8（欠損値を含む場合は float32）
+#   記述回答: pyarrow があれば Arrow 形式の文字列（なければそのまま）
+CATEGORY_COLS = ['PID', 'Stimulus_ID', 'Category']
+LIKERT_COLS = ['q1', 'q2', 'q3', 'q4', 'q5', 'q6', 'q7']
+LEVEL_COLS = ['Level']
+TEXT_COLS = ['Q1_Answer', 'Q1_Reason', 'Q2_Answer', 'Q2_Reason']
+
+
+def text_dtype():
+    """
+    記述回答の列の型（pyarrow があれば 'string[pyarrow]'，なければ None = 変換しない）．
+    pyarrow は任意の依存ライブラリで，ない環境でも結果は同じ（記述回答のメモリ使用量のみが異なる）
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return None
+    return 'string[pyarrow]'
+
+
+def _small_number(series):
+    """
+    整数値のみで int8 の範囲に収まれば int8，それ以外（欠損値・小数を含む）は float32 に変換する
+    """
+    values = pd.to_numeric(series, errors='coerce')
+    if values.dtype.kind in 'iu' and (values.empty or (values.min() >= -128 and values.max() <= 127)):
+        return values.astype(np.int8)
+    return values.astype(np.float32)
+
+
+def _category(series):
+    """
+    カテゴリ型に変換する（CSV から読み込んだ PID 等の数値は文字列に揃えてから変換する）
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series
+    if series.dtype.kind in 'iuf':
+        series = series.map(lambda v: v if pd.isna(v) else str(int(v)))
+    return series.astype('category')
+
+
+def apply_schema(df, numbers=True):
+    """
+    Tidy Data の列の型を揃える（整形直後と，CSV・中間データからの再読み込み時に適用する）．
+    存在しない列は無視し，既に型が揃っている列は変換しない．元の DataFrame は変更しない．
+    numbers=False の場合は回答値・レベルの列を変換しない（中間データの数値列は型を保って保存されるため，
+    標準化後の値等を int8 / float32 に戻さない）
+    """
+    converted = {}
+    for col in CATEGORY_COLS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            converted[col] = _category(df[col])
+    for col in (LIKERT_COLS + LEVEL_COLS) if numbers else []:
+        if col in df.columns and df[col].dtype not in (np.int8, np.float32):
+            converted[col] = _small_number(df[col])
+    dtype = text_dtype()
+    if dtype is not None:
+        for col in TEXT_COLS:
+            if col in df.columns and df[col].dtype != dtype:
+                converted[col] = df[col].astype(dtype)
+    if not converted:
+        return df
+    return df.assign(**converted)
+
+
+def memory_mb(df):
+    """
+    DataFrame のメモリ使用量（MB．文字列の中身も含む）
+    """
+    return round(df.memory_usage(deep=True).sum() / 2 ** 20, 3)
@@ -0,0 +1,165 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+from program.schema import apply_schema
+
+# 中間データの保存形式
+#   parquet: 列指向のバイナリ形式（pyarrowが必要）
+#   npy    : 列ごとの .npy / .pkl ファイル（数値列はメモリマップで読み込む）
+STORE_FORMATS = ('parquet', 'npy')
+
+
+def default_format():
+    """
+    利用可能な保存形式を返す（pyarrowがあればparquet，なければnpy）
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return 'npy'
+    return 'parquet'
+
+
+def _frame_path(store_dir, name, fmt):
+    return os.path.join(store_dir, f'{name}.parquet' if fmt == 'parquet' else name)
+
+
+def _find_frame(store_dir, name):
+    """
+    保存済みデータの形式とパスを返す．存在しない場合は (None, None)
+    """
+    for fmt in STORE_FORMATS:
+        path = _frame_path(store_dir, name, fmt)
+        if os.path.exists(path):
+            return fmt, path
+    return None, None
+
+
+def has_frame(store_dir, name):
+    return _find_frame(store_dir, name)[0] is not None
+
+
+def save_frame(df, store_dir, name, fmt=None):
+    """
+    DataFrameを中間データとして保存する．同名の既存データは置き換える
+    """
+    fmt = fmt or default_format()
+    if fmt not in STORE_FORMATS:
+        raise ValueError(f"Unknown store format: {fmt}")
+
+    os.makedirs(store_dir, exist_ok=True)
+    delete_frame(store_dir, name)
+    path = _frame_path(store_dir, name, fmt)
+
+    if fmt == 'parquet':
+        df.to_parquet(path, index=False)
+        return path
+
+    # 列ごとに保存: 数値・真偽値列は .npy，それ以外（文字列・カテゴリ等）は .pkl
+    os.makedirs(path)
+    columns = []
+    for i, col in enumerate(df.columns):
+        series = df[col]
+        if series.dtype.kind in 'biuf':
+            file_name = f'{i}.npy'
+            np.save(os.path.join(path, file_name), series.to_numpy())
+        else:
+            file_name = f'{i}.pkl'
+            series.reset_index(drop=True).to_pickle(os.path.join(path, file_name))
+        columns.append({'name': col, 'file': file_name})
+
+    with open(os.path.join(path, 'schema.json'), 'w', encoding='utf-8') as f:
+        json.dump({'n_rows': len(df), 'columns': columns}, f, ensure_ascii=False, indent=1)
+    return path
+
+
+def frame_columns(store_dir, name):
+    """
+    保存済みデータの列名一覧を返す（データ本体は読み込まない）
+    """
+    fmt, path = _find_frame(store_dir, name)
+    if fmt is None:
+        raise FileNotFoundError(f"Intermediate data not found: {name}")
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        return list(pq.read_schema(path).names)
+    with open(os.path.join(path, 'schema.json'), 'r', encoding='utf-8') as f:
+        return [c['name'] for c in json.load(f)['columns']]
+
+
+def load_frame(store_dir, name, columns=None, mmap=True):
+    """
+    中間データを読み込む．columnsを指定した場合はその列のみを読み込む．
+    npy形式の数値列は mmap=True のとき読み取り専用のメモリマップとして開く．
+    Tidy Data のキー列・記述回答の列は schema.apply_schema の型に揃える
+    （保存時と異なる環境・形式で読み込んだ場合も同じ型になる．数値列は保存した型のまま）
+    """
+    fmt, path = _find_frame(store_dir, name)
+    if fmt is None:
+        raise FileNotFoundError(f"Intermediate data not found: {name}")
+
+    if fmt == 'parquet':
+        return apply_schema(pd.read_parquet(path, columns=columns), numbers=False)
+
+    with open(os.path.join(path, 'schema.json'), 'r', encoding='utf-8') as f:
+        schema = json.load(f)
+    files = {c['name']: c['file'] for c in schema['columns']}
+    if columns is None:
+        columns = list(files)
+
+    data = {}
+    for col in columns:
+        file_path = os.path.join(path, files[col])
+        if file_path.endswith('.npy'):
+            data[col] = np.load(file_path, mmap_mode='r' if mmap else None)
+        else:
+            data[col] = pd.read_pickle(file_path)
+    return apply_schema(pd.DataFrame(data, columns=columns, copy=False), numbers=False)
+
+
+def delete_frame(store_dir, name):
+    fmt, path = _find_frame(store_dir, name)
+    if fmt == 'parquet':
+        os.remove(path)
+    elif fmt == 'npy':
+        shutil.rmtree(path)
+
+
+# PID で分割した中間データ（<name>.parts/part-NNNNN）．チャンクごとに読み書きし，全体をメモリに載せない
+def _partition_dir(store_dir, name):
+    return os.path.join(store_dir, f'{name}.parts')
+
+
+def save_partition(df, store_dir, name, index, fmt=None):
+    """
+    分割した中間データの index 番目のチャンクを保存する
+    """
+    return save_frame(df, _partition_dir(store_dir, name), f'part-{index:05d}', fmt)
+
+
+def partition_names(store_dir, name):
+    """
+    保存済みのチャンク名の一覧（番号順）
+    """
+    part_dir = _partition_dir(store_dir, name)
+    if not os.path.isdir(part_dir):
+        return []
+    names = {entry[:-len('.parquet')] if entry.endswith('.parquet') else entry
+             for entry in os.listdir(part_dir) if entry.startswith('part-')}
+    return sorted(names)
+
+
+def iter_partitions(store_dir, name, columns=None):
+    """
+    分割した中間データをチャンクごとに読み込む（同時に読み込むのは1チャンクのみ）
+    """
+    part_dir = _partition_dir(store_dir, name)
+    for part in partition_names(store_dir, name):
+        yield load_frame(part_dir, part, columns=columns)
+
+
+def delete_partitions(store_dir, name):
+    shutil.rmtree(_partition_dir(store_dir, name), ignore_errors=True)
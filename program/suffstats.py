@@ -0,0 +1,228 @@
+import os
+import json
+import sqlite3
+import numpy as np
+import pandas as pd
+
+from program.standardize import TARGET_COLS, standardize_within
+from program.validation import PAIRED_SUM_COLS, paired_ttest_sums, merge_paired_sums, paired_ttest_from_sums, save_validation_outputs
+from program.regression import SUBSET_KEYS, design_grams, merge_grams, regression_results_from_grams, save_regression_outputs
+from program.check_strength import compute_deltas, delta_sums, strength_results_from_sums, save_strength_outputs
+from program.multico import run_multicollinearity_check
+from program.figures import wait_figures
+from program.profiling import profiled
+
+# 十分統計量の形式のバージョン（集計方法を変更した場合は上げる．異なる場合は再構築が必要）
+STATS_VERSION = 2
+
+# 集計表（テーブル名: (キーの列, 加算する値の列)）．値は同じキーの行どうしで足し合わせる
+SUM_TABLES = {
+    'validation': (['Category', 'Level', 'Target_Q'], PAIRED_SUM_COLS),
+    'strength': (['Target', 'Level', 'Category'], ['n', 'sum', 'sumsq']),
+}
+
+
+def _open_stats(stats_path):
+    os.makedirs(os.path.dirname(os.path.abspath(stats_path)), exist_ok=True)
+    conn = sqlite3.connect(stats_path, timeout=60)
+    conn.execute("CREATE TABLE IF NOT EXISTS participants (pid TEXT PRIMARY KEY)")
+    conn.execute("CREATE TABLE IF NOT EXISTS design (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    for table, (keys, values) in SUM_TABLES.items():
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            f"{', '.join(keys + values)}, PRIMARY KEY ({', '.join(keys)}))"
+        )
+    return conn
+
+
+def _load_design(conn):
+    """
+    回帰の積和行列（セルごと．design_grams と同じ形式）．未登録の場合は grams が None
+    """
+    row = conn.execute("SELECT value FROM design WHERE key = 'regression'").fetchone()
+    if row is None:
+        return {'version': STATS_VERSION, 'grams': None}
+    design = json.loads(row[0])
+    if design.get('grams') is not None:
+        g = design['grams']
+        design['grams'] = {
+            'cells': pd.DataFrame(dict(zip(SUBSET_KEYS, g['cells']))),
+            'gram': np.asarray(g['gram'], dtype=np.float64),
+            'n': np.asarray(g['n'], dtype=np.float64),
+            'level_counts': {int(k): v for k, v in g['level_counts'].items()},
+        }
+    return design
+
+
+def _dump_design(grams):
+    return json.dumps({
+        'version': STATS_VERSION,
+        'grams': {
+            'cells': [grams['cells'][c].tolist() for c in SUBSET_KEYS],
+            'gram': grams['gram'].tolist(),
+            'n': grams['n'].tolist(),
+            'level_counts': {str(int(k)): int(v) for k, v in grams['level_counts'].items()},
+        },
+    })
+
+
+def _known_pids(conn, pids):
+    known = set()
+    # SQLiteのパラメータ数上限を超えないよう分割して検索
+    for i in range(0, len(pids), 500):
+        chunk = pids[i:i + 500]
+        placeholders = ','.join('?' * len(chunk))
+        known.update(r[0] for r in conn.execute(
+            f"SELECT pid FROM participants WHERE pid IN ({placeholders})", chunk
+        ))
+    return known
+
+
+def _add_sums(conn, table, frame):
+    """
+    集計表に行を加算する（同じキーの行があれば値を足し合わせる）
+    """
+    keys, values = SUM_TABLES[table]
+    cols = keys + values
+    conn.executemany(
+        f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({','.join('?' * len(cols))}) "
+        f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {', '.join(f'{c} = {c} + excluded.{c}' for c in values)}",
+        frame[cols].itertuples(index=False, name=None)
+    )
+
+
+def _load_sums(conn, table):
+    keys, values = SUM_TABLES[table]
+    # 登録順（最初に追加された順）に並べる
+    return pd.read_sql_query(f"SELECT {', '.join(keys + values)} FROM {table} ORDER BY rowid", conn)
+
+
+@profiled
+def update_suffstats(df_new, stats_path):
+    """
+    新しい参加者の行（匿名化・欠損値処理済みのTidy Data）で十分統計量を更新し，追加した参加者数を返す．
+    計算量は追加する参加者の行数に比例し，既存の参加者のデータは読み込まない．
+    十分統計量は全て参加者の間で足し合わせられる量とする
+    （操作チェックの条件ごとの件数・和・平方和，標準化後の変化量の群ごとの件数・和・平方和，回帰のセルごとの積和行列）．
+    被験者内標準化は参加者内で完結するため，参加者ごとの平均・標準偏差は追加時に求めて保持しない．
+    登録済みの参加者（PID で識別）は標準化の基準が変わるため追加しない
+    """
+    conn = _open_stats(stats_path)
+    try:
+        design = _load_design(conn)
+        if design.get('version') != STATS_VERSION:
+            raise ValueError(f"Sufficient statistics version mismatch: rebuild {stats_path}")
+
+        df_new = df_new[df_new['PID'].notna()]
+        pid_keys = df_new['PID'].astype(str)
+        known = _known_pids(conn, list(pid_keys.unique()))
+        if known:
+            print(f"[!] Participants already registered (skipped): {', '.join(sorted(known))}")
+            df_new = df_new[~pid_keys.isin(known)]
+        if df_new.empty:
+            return 0
+        df_new = df_new.reset_index(drop=True)
+        pids = [(pid,) for pid in df_new['PID'].astype(str).unique()]
+
+        # 1. 操作チェックの件数・和・平方和（標準化前の値）
+        paired = paired_ttest_sums(df_new)
+
+        # 2. 被験者内標準化（参加者内で完結するため新しい参加者のみで計算できる）
+        df_std = df_new.copy(deep=False)
+        values = standardize_within(df_new, TARGET_COLS)
+        for i, col in enumerate(TARGET_COLS):
+            df_std[col] = values[:, i]
+
+        # 3. 分散分析の群ごとの件数・和・平方和（全質問）と回帰のセルごとの積和行列
+        strength = delta_sums(compute_deltas(df_std))
+        grams = merge_grams(design['grams'], design_grams(df_std))
+
+        with conn:
+            conn.executemany("INSERT INTO participants (pid) VALUES (?)", pids)
+            _add_sums(conn, 'validation', paired)
+            _add_sums(conn, 'strength', strength)
+            if grams is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO design (key, value) VALUES ('regression', ?)", (_dump_design(grams),)
+                )
+        return len(pids)
+    finally:
+        conn.close()
+
+
+@profiled
+def registered_pids(stats_path):
+    """
+    十分統計量に登録済みの参加者の PID（ファイルがない場合は空）
+    """
+    if not os.path.exists(stats_path):
+        return set()
+    conn = _open_stats(stats_path)
+    try:
+        return {row[0] for row in conn.execute("SELECT pid FROM participants")}
+    finally:
+        conn.close()
+
+
+def warn_dropped_participants(previous, stats_path):
+    """
+    作り直す前に登録されていたが，作り直した十分統計量にない参加者（--append で追加し，
+    quant_data にファイルを置いていない参加者）を表示して返す
+    """
+    dropped = previous - registered_pids(stats_path)
+    if dropped:
+        print(f"[!] Appended participants not found in quant_data (dropped): {', '.join(sorted(dropped))}")
+    return dropped
+
+
+def build_suffstats(df_anon, stats_path):
+    """
+    全参加者のデータから十分統計量を作り直す
+    """
+    previous = registered_pids(stats_path)
+    if os.path.exists(stats_path):
+        os.remove(stats_path)
+    n_added = update_suffstats(df_anon, stats_path)
+    print(f"\n[i] Sufficient statistics saved: {stats_path} ({n_added} participants)")
+    warn_dropped_participants(previous, stats_path)
+    return n_added
+
+
+def load_suffstats(stats_path):
+    """
+    十分統計量を読み込む: {'n_participants': 登録済みの参加者数, 'validation': 操作チェックの条件ごとの和,
+    'strength': 群ごとの和, 'grams': 回帰のセルごとの積和行列（データがない場合は None）}
+    """
+    conn = _open_stats(stats_path)
+    try:
+        n_participants = conn.execute("SELECT COUNT(*) FROM participants").fetchone()[0]
+        design = _load_design(conn)
+        validation = _load_sums(conn, 'validation')
+        strength = _load_sums(conn, 'strength')
+    finally:
+        conn.close()
+    if design.get('version') != STATS_VERSION:
+        raise ValueError(f"Sufficient statistics version mismatch: rebuild {stats_path}")
+    return {'n_participants': n_participants, 'validation': validation, 'strength': strength, 'grams': design['grams']}
+
+
+@profiled
+def save_suffstats_reports(stats_path, output_dir):
+    """
+    十分統計量から操作チェック・操作強度の検定・重回帰分析・多重共線性のレポートを作成する（計算量は参加者数によらない）．
+    個々の行を持たないため，標準化データ・操作強度のグラフ・ブートストラップ信頼区間は作成しない．
+    パイプラインの出力を上書きしないよう，output_dir にはパイプラインと別の出力先を指定する
+    """
+    stats = load_suffstats(stats_path)
+    if stats['grams'] is None or stats['strength'].empty:
+        print("[!] No data found in the sufficient statistics.")
+        return
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"\n[i] Reports from the sufficient statistics ({stats['n_participants']} participants): {output_dir}")
+
+    save_validation_outputs(paired_ttest_from_sums(merge_paired_sums([stats['validation']])), output_dir)
+    save_strength_outputs(strength_results_from_sums(stats['strength']), output_dir)
+    results = regression_results_from_grams(stats['grams'])
+    save_regression_outputs(results, output_dir)
+    run_multicollinearity_check(None, output_dir, design=results)
+    wait_figures()
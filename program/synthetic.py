@@ -0,0 +1,128 @@
+import os
+import numpy as np
+
+from program.format_data import CATEGORY_MAP
+
+# 質問（q1: 違和感, q2: 不気味さ, q3〜q7: 説明変数）
+QUESTIONS = ['q1', 'q2', 'q3', 'q4', 'q5', 'q6', 'q7']
+
+# 各カテゴリの操作が主に影響する説明変数
+CATEGORY_FACTORS = {'position': 'q3', 'size': 'q4', 'lack': 'q5', 'repetition': 'q6', 'human': 'q7'}
+
+# 説明変数から q1, q2 への効果（q3〜q7 の順）
+TARGET_WEIGHTS = {'q1': [0.35, 0.25, 0.30, 0.15, 0.20], 'q2': [0.15, 0.10, 0.35, 0.30, 0.40]}
+
+# 記述回答の文の材料
+NOUNS = ['顔', '目', '口', '鼻', '手', '指', '形', '位置', '大きさ', '輪郭', '表情', '人間', '配置', '全体', '部分', '影']
+ADJECTIVES = ['不気味', '不自然', '気持ち悪い', '怖い', '変', '奇妙', '自然', '小さい', '大きい', '多い', '足りない']
+PARTICLES = ['が', 'の', 'は', 'に', 'を']
+ENDINGS = ['と感じた。', 'ように見えた。', 'と思った。', 'から。', 'ため。']
+
+
+def stimulus_ids(categories, levels):
+    """
+    実験データの刺激の列名（'base' とカテゴリ×レベル）
+    """
+    return ['base'] + [f"{category}{level}" for category in categories for level in levels]
+
+
+def _likert(rng, n_participants, categories, levels, effect, missing_q7):
+    """
+    参加者 × 質問 × 刺激 の回答値（1〜7の整数．q7 の欠損は -1）．
+    参加者ごとの回答傾向，操作による説明変数の上昇，説明変数から q1, q2 への効果を含む
+    """
+    stimuli = stimulus_ids(categories, levels)
+    n_stimuli = len(stimuli)
+
+    # 刺激ごとの操作の強さ（base は0，レベル1つごとに effect ずつ上昇）
+    strength = np.zeros((len(QUESTIONS), n_stimuli))
+    for c, category in enumerate(categories):
+        for l, level in enumerate(levels):
+            strength[QUESTIONS.index(CATEGORY_FACTORS[category]), 1 + c * len(levels) + l] = effect * (level - 1)
+
+    bias = rng.normal(0, 0.8, size=(n_participants, 1, 1))
+    latent = 3.0 + bias + strength + rng.normal(0, 1.0, size=(n_participants, len(QUESTIONS), n_stimuli))
+    explanatory = latent[:, 2:, :]
+    for q, target in enumerate(['q1', 'q2']):
+        weights = np.asarray(TARGET_WEIGHTS[target])[None, :, None]
+        latent[:, q, :] = 2.5 + bias[:, 0] + (weights * (explanatory - 3.0)).sum(axis=1) \
+            + rng.normal(0, 0.8, size=(n_participants, n_stimuli))
+
+    values = np.clip(np.rint(latent), 1, 7).astype(np.int64)
+    values[:, QUESTIONS.index('q7'), :][rng.random((n_participants, n_stimuli)) < missing_q7] = -1
+    return values
+
+
+def _sentence(rng, n_words):
+    """
+    名詞・助詞・形容詞を並べた日本語の文（n_words 語程度）
+    """
+    parts = []
+    for _ in range(max(1, n_words // 2)):
+        parts.append(NOUNS[rng.integers(len(NOUNS))] + PARTICLES[rng.integers(len(PARTICLES))])
+    parts.append(ADJECTIVES[rng.integers(len(ADJECTIVES))])
+    return ''.join(parts) + ENDINGS[rng.integers(len(ENDINGS))]
+
+
+def _qual_text(rng, categories, text_length):
+    """
+    参加者1名分の記述回答ファイルの内容（カテゴリごとに Set Index のブロック）
+    """
+    lines = []
+    for category in categories:
+        lines.append(f"Set Index: {CATEGORY_MAP[category]}")
+        for question in ['Q1', 'Q2']:
+            lines.append(f"A.{question} 解答欄：{'はい' if rng.random() < 0.6 else 'いいえ'}")
+            lines.append(f"理由：{_sentence(rng, rng.integers(text_length[0], text_length[1] + 1))}")
+        lines.append("-" * 10)
+    return "\n".join(lines) + "\n"
+
+
+def generate_study(base_dir, n_participants=100, categories=None, levels=(2, 3),
+                   text_length=(4, 12), effect=0.8, missing_q7=0.05, seed=0):
+    """
+    実験データ（quant_data/NNN_log.csv）と記述回答（qual_data/PID=N.txt）の形式の合成データを作成する．
+    categories: 刺激のカテゴリ（既定: CATEGORY_MAP の全カテゴリ），levels: 操作のレベル，
+    text_length: 理由欄の語数の範囲，effect: レベル1つあたりの操作の効果，missing_q7: q7 が欠損（-1）となる割合．
+    乱数は seed から1000名ごとに分岐させる（同じ引数からは同じデータを作成する）．
+    戻り値: 作成した参加者数
+    """
+    categories = list(categories or CATEGORY_MAP)
+    unknown = [c for c in categories if c not in CATEGORY_MAP]
+    if unknown:
+        raise ValueError(f"Unknown category: {', '.join(unknown)} ({', '.join(CATEGORY_MAP)})")
+
+    quant_dir = os.path.join(base_dir, 'quant_data')
+    qual_dir = os.path.join(base_dir, 'qual_data')
+    os.makedirs(quant_dir, exist_ok=True)
+    os.makedirs(qual_dir, exist_ok=True)
+
+    stimuli = stimulus_ids(categories, levels)
+    header = ",".join(['SetOrder', 'PID', 'age', 'sex', 'expTime', 'questions'] + stimuli)
+    width = max(3, len(str(n_participants)))
+
+    # 1000名ずつ作成する
+    block = 1000
+    seeds = np.random.SeedSequence(seed).spawn((n_participants + block - 1) // block)
+    for b, block_seed in enumerate(seeds):
+        rng = np.random.default_rng(block_seed)
+        start = b * block
+        size = min(block, n_participants - start)
+        values = _likert(rng, size, categories, levels, effect, missing_q7)
+        ages = rng.integers(18, 30, size=size)
+        sexes = rng.choice(['M', 'F'], size=size)
+        times = np.round(rng.uniform(300, 900, size=size), 1)
+
+        for i in range(size):
+            pid = start + i + 1
+            prefix = f"1,{pid},{ages[i]},{sexes[i]},{times[i]}"
+            rows = [header] + [
+                f"{prefix},{question}," + ",".join(map(str, values[i, q]))
+                for q, question in enumerate(QUESTIONS)
+            ]
+            with open(os.path.join(quant_dir, f"{pid:0{width}d}_log.csv"), 'w', encoding='utf-8') as f:
+                f.write("\n".join(rows) + "\n")
+            with open(os.path.join(qual_dir, f"PID={pid}.txt"), 'w', encoding='utf-8') as f:
+                f.write(_qual_text(rng, categories, text_length))
+
+    return n_participants
@@ -3,6 +3,8 @@ from scipy import stats
 import numpy as np
 import os
 
+from program.profiling import profiled
+
 # 検証対象のマッピング（カテゴリ: ターゲット質問）
 TARGET_MAP = {
     'position': 'q3',    # 変位 -> Q3
@@ -12,10 +14,186 @@ TARGET_MAP = {
     'human': 'q7'        # 社会的存在 -> Q7
 }
 
-def run_validation(df, output_dir):
+def _paired_scores(df, questions):
+    """
+    参加者 × (Category, Level) × 質問 の刺激条件の平均値と Base 条件の平均値，
+    Base と刺激の両方に回答がある参加者の指示配列を返す（同じ条件に複数の行がある参加者は平均値を用いる）
+    """
+    # 参加者 × (質問, Category, Level) の刺激条件の平均値と，参加者 × (Category, Level) の回答の有無
+    stim = df[df['Category'] != 'base'].groupby(['PID', 'Category', 'Level'], observed=True)
+    present = stim.size().unstack(['Category', 'Level'])
+    conditions = list(present.columns)
+    columns = pd.MultiIndex.from_tuples([(q, c, l) for c, l in conditions for q in questions])
+    stim_means = stim[questions].mean().unstack(['Category', 'Level']).reindex(columns=columns)
+
+    base = df[df['Category'] == 'base'].groupby('PID', observed=True)[questions].mean()
+    pids = present.index
+
+    n_pids, n_cond, n_q = len(pids), len(conditions), len(questions)
+    scores_stim = stim_means.to_numpy(dtype=np.float64).reshape(n_pids, n_cond, n_q)
+    scores_base = base.reindex(pids).to_numpy(dtype=np.float64)[:, None, :]
+
+    # Base と刺激の両方に回答がある参加者のみを対応させる
+    paired = present.notna().to_numpy() & pids.isin(base.index)[:, None]
+    paired = np.broadcast_to(paired[:, :, None], scores_stim.shape)
+    return conditions, scores_stim, scores_base, paired
+
+
+def _grid_frame(conditions, questions, columns):
+    """
+    (Category, Level) × 質問 の配列を縦長の表にする
+    """
+    n_cond, n_q = len(conditions), len(questions)
+    frame = pd.DataFrame({
+        'Category': np.repeat([c for c, _ in conditions], n_q),
+        'Level': np.repeat([l for _, l in conditions], n_q),
+        'Target_Q': np.tile(questions, n_cond),
+    })
+    for name, values in columns.items():
+        frame[name] = values.ravel()
+    return frame
+
+
+def paired_ttest_grid(df, questions=None):
+    """
+    Base条件と各刺激条件 (Category, Level) の対応のあるt検定（片側検定: 刺激 > Base）を，
+    全カテゴリ × 全質問について配列演算でまとめて行う．
+    参加者 × (Category, Level, 質問) の表に1回だけ変形し，Base と刺激の両方に回答がある参加者の差分から
+    平均・標準誤差・t値・p値を求める（同じ条件に複数の行がある参加者は平均値を用いる）．
+    戻り値: 列 Category, Level, Target_Q, N, Mean_Base, Mean_Stim, Diff, SE, t_stat, p_val, Significance の表
+    """
+    if questions is None:
+        questions = [c for c in df.columns if c.startswith('q') and len(c) == 2]
+    conditions, scores_stim, scores_base, paired = _paired_scores(df, questions)
+    n = paired.sum(axis=0)
+
+    def paired_mean(values):
+        valid = paired & ~np.isnan(values)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(valid, values, 0).sum(axis=0) / valid.sum(axis=0)
+
+    diff = scores_stim - scores_base
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_diff = np.where(paired, diff, 0).sum(axis=0) / n
+        var_diff = (np.where(paired, diff - mean_diff, 0) ** 2).sum(axis=0) / (n - 1)
+        se = np.sqrt(var_diff / n)
+        t_stat = mean_diff / se
+    # 欠損値を含む組は stats.ttest_rel と同様に検定結果を欠損値とする
+    t_stat[(paired & np.isnan(diff)).any(axis=0)] = np.nan
+    p_val = stats.t.sf(t_stat, n - 1)
+
+    mean_base = paired_mean(np.broadcast_to(scores_base, scores_stim.shape))
+    mean_stim = paired_mean(scores_stim)
+
+    grid = _grid_frame(conditions, questions, {
+        'N': n,
+        'Mean_Base': mean_base,
+        'Mean_Stim': mean_stim,
+        'Diff': mean_stim - mean_base,
+        'SE': se,
+        't_stat': t_stat,
+        'p_val': p_val,
+    })
+    grid['Significance'] = _significance(grid['p_val'])
+    return grid[grid['N'] > 0].reset_index(drop=True)
+
+
+def _significance(p_val):
+    return np.where(p_val < 0.01, "**", np.where(p_val < 0.05, "*", "n.s."))
+
+
+# 対応のあるt検定の十分統計量の列（参加者を分割して求めた表は足し合わせられる）
+PAIRED_SUM_COLS = ['N', 'N_nan', 'N_base', 'Sum_base', 'N_stim', 'Sum_stim', 'Sum_diff', 'Sumsq_diff']
+
+
+def paired_ttest_sums(df, questions=None):
+    """
+    paired_ttest_grid の検定に必要な (Category, Level, 質問) ごとの件数・和・平方和を求める．
+    参加者の集合が重ならない表どうしの結果は merge_paired_sums で足し合わせられる（PID で分割した処理用）．
+    戻り値: 列 Category, Level, Target_Q と PAIRED_SUM_COLS の表
+    """
+    if questions is None:
+        questions = [c for c in df.columns if c.startswith('q') and len(c) == 2]
+    conditions, scores_stim, scores_base, paired = _paired_scores(df, questions)
+    scores_base = np.broadcast_to(scores_base, scores_stim.shape)
+    diff = scores_stim - scores_base
+
+    valid_base = paired & ~np.isnan(scores_base)
+    valid_stim = paired & ~np.isnan(scores_stim)
+    valid_diff = paired & ~np.isnan(diff)
+    sums = _grid_frame(conditions, questions, {
+        'N': paired.sum(axis=0),
+        'N_nan': (paired & np.isnan(diff)).sum(axis=0),
+        'N_base': valid_base.sum(axis=0),
+        'Sum_base': np.where(valid_base, scores_base, 0).sum(axis=0),
+        'N_stim': valid_stim.sum(axis=0),
+        'Sum_stim': np.where(valid_stim, scores_stim, 0).sum(axis=0),
+        'Sum_diff': np.where(valid_diff, diff, 0).sum(axis=0),
+        'Sumsq_diff': np.where(valid_diff, diff ** 2, 0).sum(axis=0),
+    })
+    return sums[sums['N'] > 0].reset_index(drop=True)
+
+
+def merge_paired_sums(sums_list):
+    """
+    paired_ttest_sums の結果を (Category, Level, 質問) ごとに足し合わせる（表の並びは条件の昇順・質問の出現順）
+    """
+    sums = pd.concat([s for s in sums_list if s is not None], ignore_index=True)
+    sums['Category'] = sums['Category'].astype(object)
+    merged = sums.groupby(['Category', 'Level', 'Target_Q'], sort=False)[PAIRED_SUM_COLS].sum().reset_index()
+    return merged.sort_values(['Category', 'Level'], kind='stable').reset_index(drop=True)
+
+
+def paired_ttest_from_sums(sums):
+    """
+    十分統計量の表（paired_ttest_sums / merge_paired_sums の結果）から paired_ttest_grid と同じ形式の表を作る．
+    差分の分散は平方和から求める
+    """
+    n = sums['N'].to_numpy(dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_diff = sums['Sum_diff'].to_numpy() / n
+        var_diff = (sums['Sumsq_diff'].to_numpy() - sums['Sum_diff'].to_numpy() * mean_diff) / (n - 1)
+        se = np.sqrt(np.maximum(var_diff, 0) / n)
+        t_stat = mean_diff / se
+        mean_base = sums['Sum_base'].to_numpy() / sums['N_base'].to_numpy()
+        mean_stim = sums['Sum_stim'].to_numpy() / sums['N_stim'].to_numpy()
+    # 欠損値を含む組は paired_ttest_grid と同様に検定結果を欠損値とする
+    has_nan = sums['N_nan'].to_numpy() > 0
+    se[has_nan] = np.nan
+    t_stat[has_nan] = np.nan
+    p_val = stats.t.sf(t_stat, n - 1)
+
+    grid = pd.DataFrame({
+        'Category': sums['Category'].to_numpy(),
+        'Level': sums['Level'].to_numpy(),
+        'Target_Q': sums['Target_Q'].to_numpy(),
+        'N': sums['N'].to_numpy(),
+        'Mean_Base': mean_base,
+        'Mean_Stim': mean_stim,
+        'Diff': mean_stim - mean_base,
+        'SE': se,
+        't_stat': t_stat,
+        'p_val': p_val,
+    })
+    grid['Significance'] = _significance(grid['p_val'])
+    return grid[grid['N'] > 0].reset_index(drop=True)
+
+
+@profiled
+def run_validation(df, output_dir, export_grid=True):
     """
     各操作変数の妥当性を検証する．
     Base条件と刺激条件（Level 1, Level 2 それぞれ）の間で対応のあるt検定を行う．
+    検定は全カテゴリ × 全質問についてまとめて行い，レポートには TARGET_MAP の組のみを記載する．
+    export_grid=True の場合は全組の結果を manipulation_check_grid.csv に保存する
+    """
+    save_validation_outputs(paired_ttest_grid(df), output_dir, export_grid)
+
+
+@profiled
+def save_validation_outputs(grid, output_dir, export_grid=True):
+    """
+    出力パート（grid: paired_ttest_grid / paired_ttest_from_sums の結果）
     """
     # 出力バッファ
     lines = []
@@ -26,54 +204,16 @@ def run_validation(df, output_dir):
     lines.append("Test: Paired t-test (One-sided: Stimulus > Base)")
     lines.append("-" * 80)
 
+    # レポート対象: カテゴリごとの操作対象の質問（TARGET_MAP の順，レベルの昇順）
     results = []
-
-    base_data = df[df['Category'] == 'base'].copy()
-
     for category, target_q in TARGET_MAP.items():
-        # Categoryが一致する行からLevelのユニーク値を抽出してソート
-        levels = sorted(df[df['Category'] == category]['Level'].unique())
+        selected = grid[(grid['Category'] == category) & (grid['Target_Q'] == target_q)]
+        results.extend(selected.sort_values('Level').to_dict('records'))
 
-        if not levels:
-            continue
-
-        # Baseの該当変数をPIDインデックス化
-        base_series = base_data.set_index('PID')[target_q]
-
-        for level in levels:
-            stim_series = df[
-                (df['Category'] == category) & 
-                (df['Level'] == level)
-            ][['PID', target_q]].groupby('PID').mean()[target_q]
-
-            # 内部結合 (BaseとStimの両方に回答があるPIDのみ残す)
-            merged = pd.concat([base_series, stim_series], axis=1, join='inner')
-            merged.columns = ['Base', 'Stim']
-            
-            if merged.empty:
-                continue
-
-            scores_base = merged['Base']
-            scores_stim = merged['Stim']
-            
-            # 対応のあるt検定 (片側検定: 刺激 > Base)
-            try:
-                t_stat, p_val = stats.ttest_rel(scores_stim, scores_base, alternative='greater')
-                significance = "**" if p_val < 0.01 else "*" if p_val < 0.05 else "n.s."
-            except Exception:
-                t_stat, p_val, significance = np.nan, np.nan, "-"
-
-            results.append({
-                'Category': category,
-                'Level': level,
-                'Target_Q': target_q,
-                'Mean_Base': scores_base.mean(),
-                'Mean_Stim': scores_stim.mean(),
-                'Diff': scores_stim.mean() - scores_base.mean(),
-                't_stat': t_stat,
-                'p_val': p_val,
-                'Significance': significance
-            })
+    if export_grid and not grid.empty:
+        grid_path = os.path.join(output_dir, 'manipulation_check_grid.csv')
+        grid.to_csv(grid_path, index=False, encoding='utf-8-sig')
+        print(f"\n[i] Manipulation check grid saved: {grid_path}")
 
     # 結果の表示と保存
     if results:
@@ -0,0 +1,108 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# リポジトリ直下（analyze.py・program パッケージ）を読み込めるようにする
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+# テストに用いる合成データの参加者数と乱数のシード
+N_PARTICIPANTS = 60
+SEED = 3
+
+
+@pytest.fixture(scope='session')
+def study_tables(tmp_path_factory):
+    """
+    program/synthetic.py で作成した合成データを整形した参加者テーブル・回答テーブル
+    """
+    from program.synthetic import generate_study
+    from program.format_data import format_data
+
+    base_dir = tmp_path_factory.mktemp('study')
+    generate_study(str(base_dir), n_participants=N_PARTICIPANTS, seed=SEED)
+    return format_data(str(base_dir), str(base_dir / 'generated'), use_cache=False, export_csv=False)
+
+
+@pytest.fixture
+def df_anon(study_tables):
+    """
+    パイプラインの匿名化ステップと同じ前処理（q7 の欠損値の置換）を行った回答テーブル
+    """
+    from analyze import fill_missing_q7
+    return fill_missing_q7(study_tables['responses'].copy())
+
+
+@pytest.fixture
+def df_std(df_anon, tmp_path):
+    from program.standardize import run_standardize
+    return run_standardize(df_anon, str(tmp_path), export_csv=False)
+
+
+# --- 分割して求めた結果と直接求めた結果の比較 ---
+
+GRID_KEYS = ['Category', 'Level', 'Target_Q']
+GRID_COLS = ['N', 'Mean_Base', 'Mean_Stim', 'Diff', 'SE', 't_stat', 'p_val']
+FIT_KEYS = ['params', 'bse', 'pvalues', 'rsquared', 'rsquared_adj', 'fvalue', 'f_pvalue', 'nobs']
+
+
+def split_by_pid(df, n_parts=2):
+    """
+    参加者単位で n_parts 個に分割した行
+    """
+    pids = df['PID'].astype(str)
+    parts = np.array_split(pids.unique(), n_parts)
+    return [df[pids.isin(part)] for part in parts]
+
+
+def _by_keys(table, keys):
+    table = table.assign(Category=table['Category'].astype(str))
+    return table.set_index(keys).sort_index()
+
+
+def assert_grid_equal(grid, expected):
+    grid, expected = _by_keys(grid, GRID_KEYS), _by_keys(expected, GRID_KEYS)
+    assert list(grid.index) == list(expected.index)
+    np.testing.assert_allclose(grid[GRID_COLS].to_numpy(), expected[GRID_COLS].to_numpy(), rtol=1e-9, atol=1e-12)
+    np.testing.assert_array_equal(grid['Significance'], expected['Significance'])
+
+
+def assert_strength_equal(results, expected):
+    groups, expected_groups = (_by_keys(r['groups'], ['Target', 'Level', 'Category']) for r in (results, expected))
+    assert list(groups.index) == list(expected_groups.index)
+    np.testing.assert_array_equal(groups['n'], expected_groups['n'])
+    np.testing.assert_allclose(groups[['mean', 'std']], expected_groups[['mean', 'std']], rtol=1e-9, atol=1e-12)
+
+    anova, expected_anova = (r['anova'].set_index(['Target', 'Level']).sort_index() for r in (results, expected))
+    np.testing.assert_allclose(anova[['f', 'p']], expected_anova[['f', 'p']], rtol=1e-8, atol=1e-14)
+
+    keys = ['Target', 'Level', 'group1', 'group2']
+    posthoc, expected_posthoc = (r['posthoc'].set_index(keys).sort_index() for r in (results, expected))
+    assert list(posthoc.index) == list(expected_posthoc.index)
+    np.testing.assert_allclose(
+        posthoc[['meandiff', 'q', 'p_adj']], expected_posthoc[['meandiff', 'q', 'p_adj']], rtol=1e-8, atol=1e-12
+    )
+    np.testing.assert_array_equal(posthoc['reject'], expected_posthoc['reject'])
+
+
+def assert_regression_equal(results, expected):
+    assert results['subsets'] == expected['subsets']
+    assert results['n_samples'] == expected['n_samples']
+    assert results['level_counts'] == expected['level_counts']
+    for key in FIT_KEYS:
+        np.testing.assert_allclose(results[key], expected[key], rtol=1e-8, atol=1e-12)
+
+
+def ols_subsets(df_std):
+    """
+    重回帰分析の部分集合（元の実装と同じ順序: プール，Level 別，Category 別）
+    """
+    df_reg = df_std[df_std['Category'] != 'base']
+    subsets = {'Pooled': df_reg}
+    for col in ['Level', 'Category']:
+        for value in sorted(df_reg[col].astype(object).unique()):
+            subsets[f"{col} {value}"] = df_reg[df_reg[col] == value]
+    return subsets
@@ -0,0 +1,88 @@
+"""
+参加者単位のブートストラップ（bootstrap）: 既知のモデルでの信頼区間の被覆率と，特異な再標本の扱い
+"""
+import numpy as np
+import pytest
+
+from program.bootstrap import cluster_bootstrap, _solve
+
+SLOPE = 2.0
+
+
+def _clustered_blocks(rng, n_clusters, n_obs=5, singular_cluster=False):
+    """
+    y = 1 + 2x + u（参加者の効果）+ e から作った参加者ごとの X'X と X'y．
+    singular_cluster=True の場合は最初の参加者のみが値を持つ説明変数を加える（その参加者を含まない再標本は特異）
+    """
+    x = rng.normal(size=(n_clusters, n_obs))
+    y = 1 + SLOPE * x + rng.normal(size=(n_clusters, 1)) + rng.normal(size=(n_clusters, n_obs))
+    columns = [np.ones_like(x), x]
+    if singular_cluster:
+        indicator = np.zeros_like(x)
+        indicator[0] = rng.normal(size=n_obs)
+        columns.append(indicator)
+    design = np.stack(columns, axis=2)
+    return np.einsum('cni,cnj->cij', design, design), np.einsum('cni,cn->ci', design, y)[:, :, None]
+
+
+def test_percentile_interval_coverage():
+    # 参加者の効果がある（観測が独立でない）データで，傾きの 95% 区間が真値を含む割合
+    rng = np.random.default_rng(0)
+    n_sim = 200
+    covered = 0
+    for i in range(n_sim):
+        xtx, xty = _clustered_blocks(rng, n_clusters=40)
+        result = cluster_bootstrap(xtx, xty, n_boot=499, seed=i)
+        lower, upper = result['percentile'][:, 1, 0]
+        covered += lower <= SLOPE <= upper
+    assert 0.90 <= covered / n_sim <= 0.99
+
+
+def test_se_matches_cluster_robust_se():
+    # 参加者数が多い場合，ブートストラップ標準誤差はクラスターロバスト標準誤差（サンドイッチ推定量）に近い
+    rng = np.random.default_rng(1)
+    n_clusters, n_obs = 400, 5
+    x = rng.normal(size=(n_clusters, n_obs))
+    y = 1 + SLOPE * x + rng.normal(size=(n_clusters, 1)) + rng.normal(size=(n_clusters, n_obs))
+    design = np.stack([np.ones_like(x), x], axis=2)
+    xtx = np.einsum('cni,cnj->cij', design, design)
+    xty = np.einsum('cni,cn->ci', design, y)[:, :, None]
+
+    beta = np.linalg.solve(xtx.sum(axis=0), xty.sum(axis=0))[:, 0]
+    scores = np.einsum('cni,cn->ci', design, y - design @ beta)
+    bread = np.linalg.inv(xtx.sum(axis=0))
+    robust_se = np.sqrt(np.diag(bread @ (scores.T @ scores) @ bread))
+
+    result = cluster_bootstrap(xtx, xty, n_boot=2000, seed=0)
+    np.testing.assert_allclose(result['estimate'][:, 0], beta, rtol=1e-10)
+    np.testing.assert_allclose(result['se'][:, 0], robust_se, rtol=0.1)
+
+
+def test_seed_and_jobs_reproducible(monkeypatch):
+    # 複数のチャンクに分けて並列の経路を通す
+    monkeypatch.setattr('program.bootstrap.CHUNK_SIZE', 100)
+    xtx, xty = _clustered_blocks(np.random.default_rng(2), n_clusters=20)
+    serial = cluster_bootstrap(xtx, xty, n_boot=450, seed=5)
+    parallel = cluster_bootstrap(xtx, xty, n_boot=450, seed=5, n_jobs=2)
+    for key in ['se', 'percentile', 'bca']:
+        np.testing.assert_array_equal(parallel[key], serial[key])
+    assert not np.array_equal(cluster_bootstrap(xtx, xty, n_boot=450, seed=6)['se'], serial['se'])
+
+
+def test_singular_batch_falls_back_per_resample():
+    xtx, xty = _clustered_blocks(np.random.default_rng(3), n_clusters=2, singular_cluster=True)
+    # 最初の参加者を含む再標本（正則）と含まない再標本（特異）
+    batch_xtx = np.stack([xtx.sum(axis=0), 2 * xtx[1]])
+    batch_xty = np.stack([xty.sum(axis=0), 2 * xty[1]])
+    with pytest.raises(np.linalg.LinAlgError):
+        np.linalg.solve(batch_xtx, batch_xty)
+
+    solved = _solve(batch_xtx, batch_xty)
+    np.testing.assert_allclose(solved[0], np.linalg.solve(batch_xtx[0], batch_xty[0]), rtol=1e-12)
+    np.testing.assert_allclose(solved[1], np.linalg.pinv(batch_xtx[1]) @ batch_xty[1], rtol=1e-10, atol=1e-12)
+
+    # 再標本の一部が特異でも，全再標本の結果が得られる
+    xtx, xty = _clustered_blocks(np.random.default_rng(4), n_clusters=10, singular_cluster=True)
+    result = cluster_bootstrap(xtx, xty, n_boot=300, seed=0)
+    assert np.isfinite(result['percentile']).all()
+    assert np.isfinite(result['se']).all()
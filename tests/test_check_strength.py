@@ -0,0 +1,58 @@
+"""
+操作強度（check_strength）: 変化量・群ごとの要約統計量・分散分析を，行ごと・水準ごとの従来の計算と比較する
+"""
+import numpy as np
+import pytest
+from scipy import stats
+
+from program.check_strength import (
+    STRENGTH_TARGETS, delta_col, compute_deltas, group_moments, anova_by_level, calculate_strength_stats
+)
+
+
+def _deltas_reference(df_std, target):
+    data = df_std[['PID', 'Category', 'Level', target]].copy()
+    base_map = data[data['Category'] == 'base'].set_index('PID')[target].to_dict()
+    stim = data[data['Category'] != 'base'].copy()
+    stim['delta'] = stim.apply(
+        lambda row: row[target] - base_map.get(row['PID']) if row['PID'] in base_map else None, axis=1
+    )
+    return stim.dropna(subset=['delta'])
+
+
+def test_compute_deltas_matches_rowwise(df_std):
+    deltas = compute_deltas(df_std)
+    for target in STRENGTH_TARGETS:
+        reference = _deltas_reference(df_std, target)
+        np.testing.assert_allclose(deltas.loc[reference.index, delta_col(target)], reference['delta'], atol=1e-12)
+
+
+def test_group_moments_and_anova_match_per_level(df_std):
+    deltas = compute_deltas(df_std)
+    groups = group_moments(deltas)
+    anova = anova_by_level(groups).set_index(['Target', 'Level'])
+
+    for target in STRENGTH_TARGETS:
+        reference = _deltas_reference(df_std, target).assign(Category=lambda d: d['Category'].astype(str))
+        for lvl in sorted(reference['Level'].unique()):
+            stim = reference[reference['Level'] == lvl]
+            desc = stim.groupby('Category')['delta'].agg(['count', 'mean', 'std'])
+            g = groups[(groups['Target'] == target) & (groups['Level'] == lvl)].set_index('Category').loc[desc.index]
+            np.testing.assert_array_equal(g['n'], desc['count'])
+            np.testing.assert_allclose(g['mean'], desc['mean'], atol=1e-12)
+            np.testing.assert_allclose(g['std'], desc['std'], atol=1e-12)
+
+            f_stat, p_val = stats.f_oneway(*[v['delta'].to_numpy() for _, v in stim.groupby('Category')])
+            row = anova.loc[(target, lvl)]
+            assert row['valid']
+            assert row['f'] == pytest.approx(f_stat, rel=1e-9)
+            assert row['p'] == pytest.approx(p_val, rel=1e-6, abs=1e-12)
+
+
+def test_calculate_strength_stats_keeps_all_levels(df_std):
+    results = calculate_strength_stats(df_std)
+    deltas = results['deltas']
+    levels = sorted(deltas['Level'].unique())
+    n_categories = deltas['Category'].astype(str).nunique()
+    # 多重比較の表は分散分析の結果によらず全ての水準・全ての質問の組を含む
+    assert len(results['posthoc']) == len(STRENGTH_TARGETS) * len(levels) * n_categories * (n_categories - 1) // 2
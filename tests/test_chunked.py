@@ -0,0 +1,80 @@
+"""
+分割実行（--chunked）: 参加者を分割して求めた十分統計量・語の出現回数を足し合わせた結果を，全参加者から直接求めた結果と比較する
+"""
+import os
+import sys
+import shutil
+import subprocess
+
+import pytest
+
+from conftest import REPO_DIR, SEED, split_by_pid, assert_grid_equal, assert_strength_equal, assert_regression_equal
+from program.validation import paired_ttest_grid, paired_ttest_sums, merge_paired_sums, paired_ttest_from_sums
+from program.check_strength import compute_deltas, delta_sums, merge_delta_sums, calculate_strength_stats, strength_results_from_sums
+from program.regression import design_grams, merge_grams, calculate_regression, regression_results_from_grams
+from program.qualitative import calculate_qualitative_counts, merge_qualitative_counts, save_qualitative_outputs
+from program.synthetic import generate_study
+import program.figures as figures_module
+
+QUALITATIVE_OUTPUTS = ['qualitative_word_counts.csv', 'qualitative_crosstab.csv', 'qualitative_crosstab_level.csv']
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('n_parts', [1, 3])
+def test_paired_sums_match_grid(df_anon, n_parts):
+    sums = merge_paired_sums([paired_ttest_sums(part) for part in split_by_pid(df_anon, n_parts)])
+    assert_grid_equal(paired_ttest_from_sums(sums), paired_ttest_grid(df_anon))
+
+
+@pytest.mark.parametrize('n_parts', [1, 3])
+def test_delta_sums_match_strength_stats(df_std, n_parts):
+    sums = merge_delta_sums([delta_sums(compute_deltas(part)) for part in split_by_pid(df_std, n_parts)])
+    assert_strength_equal(strength_results_from_sums(sums), calculate_strength_stats(df_std))
+
+
+@pytest.mark.parametrize('n_parts', [1, 3])
+def test_merged_grams_match_regression(df_std, n_parts):
+    grams = None
+    for part in split_by_pid(df_std, n_parts):
+        grams = merge_grams(grams, design_grams(part))
+    assert_regression_equal(regression_results_from_grams(grams), calculate_regression(df_std))
+
+
+def test_merged_qualitative_counts_match_full(df_anon, tmp_path, monkeypatch):
+    pytest.importorskip('janome')
+    monkeypatch.setitem(figures_module._config, 'enabled', False)
+    full_dir, chunked_dir = tmp_path / 'full', tmp_path / 'chunked'
+    os.makedirs(full_dir)
+    os.makedirs(chunked_dir)
+
+    save_qualitative_outputs(calculate_qualitative_counts(df_anon, str(full_dir), token_cache=False), str(full_dir))
+    # 語の初出順が全参加者の場合と異なるよう，後の参加者から足し合わせる
+    merged = None
+    for part in reversed(split_by_pid(df_anon, 3)):
+        counts = calculate_qualitative_counts(part.reset_index(drop=True), str(chunked_dir), token_cache=False)
+        merged = merge_qualitative_counts(merged, counts)
+    save_qualitative_outputs(merged, str(chunked_dir))
+
+    # 同数の語の順も含めて同じ出力となる
+    for name in QUALITATIVE_OUTPUTS:
+        assert _read(full_dir / name) == _read(chunked_dir / name), name
+
+
+def test_chunked_run_matches_full_run(tmp_path):
+    pytest.importorskip('janome')
+    study = tmp_path / 'study'
+    generate_study(str(study), n_participants=60, seed=SEED)
+    chunked = tmp_path / 'chunked'
+    shutil.copytree(study, chunked)
+
+    for cwd, args in [(study, []), (chunked, ['--chunked', '25'])]:
+        subprocess.run(
+            [sys.executable, os.path.join(REPO_DIR, 'analyze.py'), '--no-figures', '--no-cache', *args],
+            cwd=cwd, capture_output=True, text=True, check=True
+        )
+    for name in QUALITATIVE_OUTPUTS + ['integrated_tidy_data.csv']:
+        assert _read(study / 'generated' / name) == _read(chunked / 'generated' / name), name
@@ -0,0 +1,56 @@
+"""
+CLI の起動時間: --help と軽いステップは分析用の重いライブラリを読み込まずに起動する
+"""
+import os
+import sys
+import time
+import subprocess
+
+from conftest import REPO_DIR
+
+# 起動時に読み込まないライブラリ（分析・描画・形態素解析）
+HEAVY_MODULES = ['scipy', 'statsmodels', 'matplotlib', 'seaborn', 'janome']
+
+# --help の起動時間の上限（重いライブラリの読み込み時間に対する割合）
+IMPORT_BUDGET = 0.25
+
+
+def _run(code):
+    result = subprocess.run(
+        [sys.executable, '-c', code], cwd=REPO_DIR, capture_output=True, text=True, check=True
+    )
+    return result.stdout
+
+
+def _loaded(code):
+    """
+    code を実行した後に読み込まれているトップレベルのパッケージ
+    """
+    out = _run(code + "\nimport sys\nprint(' '.join(sorted({m.split('.')[0] for m in sys.modules})))")
+    return set(out.splitlines()[-1].split())
+
+
+def _elapsed(args, repeat=3):
+    # 最小値を用いて他のプロセスの影響を抑える
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=REPO_DIR, capture_output=True, check=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def test_help_does_not_import_heavy_modules():
+    loaded = _loaded("import analyze\ntry:\n    analyze.main(['--help'])\nexcept SystemExit:\n    pass")
+    assert not loaded & set(HEAVY_MODULES + ['numpy', 'pandas'])
+
+
+def test_light_step_modules_do_not_import_heavy_modules():
+    loaded = _loaded("import analyze, program.pipeline, program.format_data, program.demographics")
+    assert not loaded & set(HEAVY_MODULES)
+
+
+def test_help_within_import_budget():
+    help_time = _elapsed([os.path.join(REPO_DIR, 'analyze.py'), '--help'])
+    heavy_time = _elapsed(['-c', 'import pandas, scipy.stats, statsmodels.api, matplotlib.pyplot'])
+    assert help_time < IMPORT_BUDGET * heavy_time, f"--help: {help_time:.3f}s, heavy imports: {heavy_time:.3f}s"
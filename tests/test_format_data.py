@@ -0,0 +1,141 @@
+"""
+データ整形（format_data）: 参加者ごとのキャッシュと記述回答ファイルの解析
+"""
+import os
+import re
+import glob
+import random
+
+import pytest
+
+import program.format_data as format_data_module
+from program.format_data import format_data, parse_text_file
+from program.synthetic import generate_study
+
+TRANSCRIPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'transcripts')
+
+
+def _count_parses(monkeypatch):
+    # 解析した参加者ファイル名を記録する（n_jobs=1 ではプロセス内で呼ばれる）
+    parsed = []
+    parse = format_data_module._parse_and_sign
+
+    def counting(csv_file, qual_dir):
+        parsed.append(os.path.basename(csv_file))
+        return parse(csv_file, qual_dir)
+
+    monkeypatch.setattr(format_data_module, '_parse_and_sign', counting)
+    return parsed
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_cache_reparses_only_changed_participants(tmp_path, monkeypatch):
+    base_dir = str(tmp_path / 'study')
+    generate_study(base_dir, n_participants=6, seed=1)
+    output_dir, cache_dir = str(tmp_path / 'generated'), str(tmp_path / 'cache')
+    parsed = _count_parses(monkeypatch)
+
+    format_data(base_dir, output_dir, cache_dir=cache_dir)
+    assert len(parsed) == 6
+    parsed.clear()
+    format_data(base_dir, output_dir, cache_dir=cache_dir)
+    assert parsed == []
+
+    # 回答値を1つ書き換えた CSV（サイズは同じ）と，理由を書き換えたテキスト
+    csv_path = os.path.join(base_dir, 'quant_data', '003_log.csv')
+    with open(csv_path, encoding='utf-8') as f:
+        lines = f.read().split("\n")
+    last = lines[1][-1]
+    lines[1] = lines[1][:-1] + ('1' if last != '1' else '2')
+    with open(csv_path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines))
+    txt_path = os.path.join(base_dir, 'qual_data', 'PID=5.txt')
+    with open(txt_path, encoding='utf-8') as f:
+        text = f.read()
+    with open(txt_path, 'w', encoding='utf-8') as f:
+        f.write(text.replace("理由：", "理由：書き換えた理由。", 1))
+
+    format_data(base_dir, output_dir, cache_dir=cache_dir)
+    assert sorted(parsed) == ['003_log.csv', '005_log.csv']
+
+    # キャッシュを使わずに整形した結果と同じ統合データになる
+    fresh_dir = str(tmp_path / 'fresh')
+    format_data(base_dir, fresh_dir, use_cache=False)
+    tidy = 'integrated_tidy_data.csv'
+    assert _read(os.path.join(output_dir, tidy)) == _read(os.path.join(fresh_dir, tidy))
+
+
+def _parse_text_reference(content):
+    """
+    従来の実装（ファイル全体への正規表現による抽出）
+    """
+    qual_data = {}
+    pattern_block = r"Set Index[:\s]+(\d+)(.*?)(?=Set Index[:\s]+\d+|$)"
+    for set_idx_str, text_block in re.findall(pattern_block, content, re.DOTALL):
+        match_q1 = re.search(
+            r"A\.Q1\s*解答欄[:\uff1a\s]*(.*?)\s*\n\s*理由[:\uff1a\s]*(.*?)(?=\n\s*A\.Q2)", text_block, re.DOTALL
+        )
+        match_q2 = re.search(
+            r"A\.Q2\s*解答欄[:\uff1a\s]*(.*?)\s*\n\s*理由[:\uff1a\s]*(.*?)(?=$|\n-{3,})", text_block, re.DOTALL
+        )
+        qual_data[int(set_idx_str)] = {
+            'Q1_Answer': match_q1.group(1).strip() if match_q1 else "",
+            'Q1_Reason': match_q1.group(2).strip() if match_q1 else "",
+            'Q2_Answer': match_q2.group(1).strip() if match_q2 else "",
+            'Q2_Reason': match_q2.group(2).strip() if match_q2 else ""
+        }
+    return qual_data
+
+
+def _assert_matches_reference(parsed, content):
+    """
+    従来の実装と比較する．異なってよいのは，理由が空欄の Q2 で従来の実装が区切り線以降を理由とした場合のみ
+    """
+    reference = _parse_text_reference(content)
+    assert list(parsed) == list(reference)
+    for set_idx, fields in reference.items():
+        if fields['Q2_Reason'].startswith('---'):
+            fields = dict(fields, Q2_Reason="")
+        assert parsed[set_idx] == fields
+
+
+@pytest.mark.parametrize('name', sorted(os.path.basename(p) for p in glob.glob(os.path.join(TRANSCRIPT_DIR, '*.txt'))))
+def test_parse_text_file_matches_regex_parser(name):
+    path = os.path.join(TRANSCRIPT_DIR, name)
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    _assert_matches_reference(parse_text_file(path), content)
+
+
+def test_parse_text_file_blank_q2_reason():
+    parsed = parse_text_file(os.path.join(TRANSCRIPT_DIR, 'blank_q2_reason.txt'))
+    assert [fields['Q2_Reason'] for fields in parsed.values()] == ["", ""]
+    assert parsed[2]['Q1_Reason'] == "自然。"
+
+
+def test_parse_text_file_random_malformed(tmp_path):
+    # 正しい形式のブロックに，見出し・解答欄・理由・区切り線の断片を挿入・削除したファイル
+    pieces = [
+        "Set Index: {i}", "Set Index:\n{i}", "Set Index {i} 続き", "Set Index: x", "A.Q1 解答欄：はい", "A.Q1 解答欄：",
+        "A.Q1解答欄:いいえ", "A.Q2 解答欄：はい", "A.Q2 解答欄：", "A.Q2", "理由：顔が変", "理由：", "理由: ",
+        "  理由：目", "----------", "---", "--", "", "  ", "自由記述の行",
+    ]
+    block = ["A.Q1 解答欄：はい", "理由：顔が変", "A.Q2 解答欄：いいえ", "理由：目が怖い", "----------"]
+    rng = random.Random(0)
+    path = str(tmp_path / 'PID=1.txt')
+    for _ in range(500):
+        lines = []
+        for i in range(rng.randint(1, 4)):
+            lines += [f"Set Index: {i + 1}"] + block
+            for _ in range(rng.randint(0, 3)):
+                if lines and rng.random() < 0.3:
+                    del lines[rng.randrange(len(lines))]
+                lines.insert(rng.randint(0, len(lines)), rng.choice(pieces).format(i=rng.randint(1, 5)))
+        content = "\n".join(lines) + ("\n" if rng.random() < 0.7 else "")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        _assert_matches_reference(parse_text_file(path), content)
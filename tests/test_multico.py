@@ -0,0 +1,40 @@
+"""
+多重共線性（multico）: 積和行列から求めた VIF・条件指数を，補助回帰・特異値分解による計算と比較する
+"""
+import numpy as np
+
+from conftest import ols_subsets
+from program.regression import EXPLANATORY_VARS, calculate_regression
+from program.multico import calculate_vif
+
+
+def _vif_reference(x):
+    """
+    説明変数ごとに他の説明変数（定数項を含む）へ回帰した補助回帰の 1 / (1 - R^2)
+    """
+    vif = []
+    for i in range(x.shape[1]):
+        others = np.column_stack([np.ones(len(x)), np.delete(x, i, axis=1)])
+        resid = x[:, i] - others @ np.linalg.lstsq(others, x[:, i], rcond=None)[0]
+        r2 = 1 - resid @ resid / ((x[:, i] - x[:, i].mean()) ** 2).sum()
+        vif.append(1 / (1 - r2))
+    return np.array(vif)
+
+
+def test_vif_matches_auxiliary_regressions(df_std):
+    results = calculate_vif(df_std)
+    for s, data in enumerate(ols_subsets(df_std).values()):
+        x = data[EXPLANATORY_VARS].to_numpy(dtype=np.float64)
+        np.testing.assert_allclose(results['vif'][s], _vif_reference(x), rtol=1e-8)
+
+        # 条件指数は列の長さを揃えた計画行列の特異値の比
+        design = np.column_stack([np.ones(len(x)), x])
+        sv = np.linalg.svd(design / np.linalg.norm(design, axis=0), compute_uv=False)
+        np.testing.assert_allclose(np.sort(results['condition_indices'][s]), np.sort(sv[0] / sv), rtol=1e-6)
+
+
+def test_vif_reuses_regression_design(df_std):
+    direct = calculate_vif(df_std)
+    reused = calculate_vif(None, design=calculate_regression(df_std))
+    assert reused['subsets'] == direct['subsets']
+    np.testing.assert_allclose(reused['vif'], direct['vif'], rtol=1e-10)
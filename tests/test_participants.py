@@ -0,0 +1,42 @@
+"""
+参加者テーブル（format_data.join_participants）: 参加者テーブルと回答テーブルを結合すると，
+テーブルを分ける前の統合データ（参加者属性を各行に持つ Tidy Data）と同じになる
+"""
+import os
+
+import pandas as pd
+
+from conftest import REPO_DIR, SEED
+from program.format_data import format_data, join_participants
+from program.schema import apply_schema
+from program.synthetic import generate_study
+
+# テーブルを分ける前の format_data で，generate_study(n_participants=6, seed=SEED) を整形した統合データ
+BEFORE_SPLIT = os.path.join(REPO_DIR, 'tests', 'fixtures', 'tidy_before_split.csv')
+
+# テーブルを分ける前の format_data の戻り値の列の型
+BEFORE_SPLIT_DTYPES = {
+    'Stimulus_ID': 'category', 'q1': 'int8', 'q2': 'int8', 'q3': 'int8', 'q4': 'int8', 'q5': 'int8',
+    'q6': 'int8', 'q7': 'int8', 'PID': 'category', 'age': 'int64', 'sex': 'str', 'expTime': 'float64',
+    'Category': 'category', 'Level': 'int8', 'Q1_Answer': 'str', 'Q1_Reason': 'str', 'Q2_Answer': 'str',
+    'Q2_Reason': 'str',
+}
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_join_reproduces_tidy_frame(tmp_path):
+    study = str(tmp_path / 'study')
+    generate_study(study, n_participants=6, seed=SEED)
+    tables = format_data(study, str(tmp_path / 'generated'), use_cache=False)
+
+    joined = join_participants(tables['participants'], tables['responses'])
+    assert {col: str(dtype) for col, dtype in joined.dtypes.items()} == BEFORE_SPLIT_DTYPES
+    expected = apply_schema(pd.read_csv(BEFORE_SPLIT, encoding='utf-8-sig', keep_default_na=False))
+    assert list(joined.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(joined.astype(str), expected.astype(str), check_dtype=False)
+    # CSV に出力する統合データも同じ
+    assert _read(str(tmp_path / 'generated' / 'integrated_tidy_data.csv')) == _read(BEFORE_SPLIT)
@@ -0,0 +1,47 @@
+"""
+並べ替え検定（permutation）: 観測値の統計量をパラメトリックな計算と比較し，並列数によらず同じ結果となることを確認する
+"""
+import pandas as pd
+import pytest
+from scipy import stats
+
+from program.check_strength import delta_col, compute_deltas, group_moments
+from program.post_hoc import tukey_kramer_table
+from program.permutation import permutation_test
+
+
+def _first_level(df_std):
+    deltas = compute_deltas(df_std)
+    deltas = deltas[deltas['Category'] != 'base'].assign(Category=lambda d: d['Category'].astype(str))
+    return deltas, deltas[deltas['Level'] == deltas['Level'].min()]
+
+
+def test_permutation_test_statistics_and_jobs(df_std, monkeypatch):
+    # 複数のチャンクに分けて並列の経路を通す
+    monkeypatch.setattr('program.permutation.CHUNK_SIZE', 100)
+    _, level_rows = _first_level(df_std)
+    values, labels = level_rows[delta_col('q1')], level_rows['Category']
+
+    serial = permutation_test(values, labels, n_perm=999, seed=7, n_jobs=1)
+    f_stat, _ = stats.f_oneway(*[v.to_numpy() for _, v in values.groupby(labels)])
+    assert serial['f'] == pytest.approx(f_stat, rel=1e-9)
+    assert 0 < serial['p'] <= 1
+
+    # チャンクごとに乱数を分岐させるため，並列数によらず同じ結果となる
+    parallel = permutation_test(values, labels, n_perm=999, seed=7, n_jobs=2)
+    assert parallel['p'] == serial['p']
+    pd.testing.assert_frame_equal(parallel['pairs'], serial['pairs'])
+
+
+def test_permutation_q_matches_tukey_kramer(df_std):
+    # 並べ替え検定の表の q は，Tukey-Kramer 法の表の q（スチューデント化範囲）と同じ尺度
+    deltas, level_rows = _first_level(df_std)
+    level = level_rows['Level'].iloc[0]
+    pairs = permutation_test(level_rows[delta_col('q1')], level_rows['Category'], n_perm=99, seed=0)['pairs']
+
+    table = tukey_kramer_table(group_moments(deltas))
+    table = table[(table['Target'] == 'q1') & (table['Level'] == level)]
+    merged = pairs.merge(table, on=['group1', 'group2'], suffixes=('', '_tukey'))
+    assert len(merged) == len(pairs) == len(table)
+    assert merged['meandiff'].to_numpy() == pytest.approx(merged['meandiff_tukey'].to_numpy(), rel=1e-9)
+    assert merged['q'].to_numpy() == pytest.approx(merged['q_tukey'].to_numpy(), rel=1e-9)
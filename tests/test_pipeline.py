@@ -0,0 +1,203 @@
+"""
+ステップグラフの実行（run_pipeline）: コード・入力を変更したステップと依存するステップのみを再実行し，
+それ以外はキャッシュから結果と出力ファイルを復元する
+"""
+import os
+import sys
+import importlib.util
+
+import pytest
+
+from program import pipeline
+from program.pipeline import run_pipeline
+
+# テスト用のステップの定義（{expr} を書き換えてコードの変更とする）
+STEP_MODULE = '''
+import os
+
+RAN = []
+OUTPUT_DIR = None
+DATA_PATH = None
+
+
+def _write(name, value):
+    with open(os.path.join(OUTPUT_DIR, name), 'w', encoding='utf-8') as f:
+        f.write(str(value))
+
+
+def step_load(inputs):
+    RAN.append('load')
+    with open(DATA_PATH, encoding='utf-8') as f:
+        value = int(f.read())
+    _write('load.txt', value)
+    return value
+
+
+def step_double(inputs):
+    from fpkg.ops import scale
+    RAN.append('double')
+    value = scale(inputs['load']) {expr}
+    _write('double.txt', value)
+    return value
+
+
+def step_report(inputs):
+    RAN.append('report')
+    _write('report.txt', inputs['double'])
+
+
+def step_other(inputs):
+    RAN.append('other')
+    _write('other.txt', 'other')
+    return 'other'
+'''
+
+OPS_MODULE = '''
+def scale(value):
+    return value * {factor}
+'''
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """
+    ステップのモジュール（書き換えるたびに別名で読み込む）と，ステップが読み込むパッケージ（fpkg）の作業場所
+    """
+    monkeypatch.setattr(sys, 'dont_write_bytecode', True)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    # ステップが読み込むモジュールとして fpkg 以下をコードのバージョンに含める
+    monkeypatch.setattr(pipeline, 'CODE_PACKAGE', 'fpkg')
+    # 前のテストで読み込んだ fpkg（別の作業場所）を使わない
+    for name in ['fpkg', 'fpkg.ops']:
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    os.makedirs(tmp_path / 'fpkg')
+    (tmp_path / 'fpkg' / '__init__.py').write_text('')
+    (tmp_path / 'data.txt').write_text('2')
+    os.makedirs(tmp_path / 'out')
+
+    state = {'version': 0}
+
+    def write_ops(factor):
+        (tmp_path / 'fpkg' / 'ops.py').write_text(OPS_MODULE.format(factor=factor))
+        sys.modules.pop('fpkg.ops', None)
+
+    def load_steps(expr='+ 0'):
+        state['version'] += 1
+        name = f"steps_v{state['version']}"
+        path = tmp_path / f"{name}.py"
+        path.write_text(STEP_MODULE.format(expr=expr))
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        monkeypatch.setitem(sys.modules, name, module)
+        spec.loader.exec_module(module)
+        module.OUTPUT_DIR = str(tmp_path / 'out')
+        module.DATA_PATH = str(tmp_path / 'data.txt')
+        return module, {
+            'load': {
+                'run': module.step_load, 'deps': [], 'outputs': ['load.txt'],
+                'source': lambda: (tmp_path / 'data.txt').read_text(),
+            },
+            'double': {'run': module.step_double, 'deps': ['load'], 'outputs': ['double.txt']},
+            'report': {'run': module.step_report, 'deps': ['double'], 'outputs': ['report.txt']},
+            'other': {'run': module.step_other, 'deps': [], 'outputs': ['other.txt']},
+        }
+
+    def run(module, steps, targets=None):
+        del module.RAN[:]
+        run_pipeline(steps, targets or list(steps), str(tmp_path / 'out'))
+        return sorted(module.RAN)
+
+    write_ops(1)
+    return tmp_path, write_ops, load_steps, run
+
+
+def test_unchanged_steps_are_restored(workspace):
+    tmp_path, _, load_steps, run = workspace
+    module, steps = load_steps()
+    assert run(module, steps) == ['double', 'load', 'other', 'report']
+
+    # 出力ファイルを削除・書き換えてもキャッシュから復元する
+    (tmp_path / 'out' / 'report.txt').unlink()
+    (tmp_path / 'out' / 'double.txt').write_text('edited')
+    assert run(module, steps) == []
+    assert (tmp_path / 'out' / 'report.txt').read_text() == '2'
+    assert (tmp_path / 'out' / 'double.txt').read_text() == '2'
+
+
+def test_step_code_change_reruns_step_and_dependents(workspace):
+    tmp_path, _, load_steps, run = workspace
+    run(*load_steps('+ 0'))
+
+    module, steps = load_steps('+ 1')
+    assert run(module, steps) == ['double', 'report']
+    assert (tmp_path / 'out' / 'report.txt').read_text() == '3'
+    # 結果が変わらない場合も，コードを変更したステップは再実行し，依存するステップは復元する
+    module, steps = load_steps('- 0 + 1')
+    assert run(module, steps) == ['double']
+    assert (tmp_path / 'out' / 'report.txt').read_text() == '3'
+
+
+def test_imported_module_change_reruns_importing_steps(workspace):
+    tmp_path, write_ops, load_steps, run = workspace
+    module, steps = load_steps()
+    run(module, steps)
+
+    write_ops(3)
+    module, steps = load_steps()
+    assert run(module, steps) == ['double', 'report']
+    assert (tmp_path / 'out' / 'report.txt').read_text() == '6'
+
+
+def test_input_change_reruns_dependents(workspace):
+    tmp_path, _, load_steps, run = workspace
+    module, steps = load_steps()
+    run(module, steps)
+
+    (tmp_path / 'data.txt').write_text('5')
+    assert run(module, steps) == ['double', 'load', 'report']
+
+    # 外部入力が変わっても結果が同じであれば，依存するステップは復元する
+    (tmp_path / 'data.txt').write_text(' 5')
+    assert run(module, steps) == ['load']
+    assert (tmp_path / 'out' / 'report.txt').read_text() == '5'
+
+
+def test_restore_removes_stale_outputs(workspace):
+    tmp_path, _, load_steps, run = workspace
+    module, steps = load_steps()
+    out = tmp_path / 'out'
+    steps['other']['outputs'] = ['other*.txt']
+    run(module, steps, ['other'])
+
+    # パターンに一致するがキャッシュにないファイルは，復元時に削除する
+    (out / 'other_stale.txt').write_text('stale')
+    (out / 'unrelated.txt').write_text('keep')
+    assert run(module, steps, ['other']) == []
+    assert not (out / 'other_stale.txt').exists()
+    assert (out / 'unrelated.txt').read_text() == 'keep'
+    assert (out / 'other.txt').read_text() == 'other'
+
+    # 再実行する場合も，実行前に古い出力ファイルを削除する
+    (out / 'other_stale.txt').write_text('stale')
+    steps['other']['params'] = {'changed': True}
+    assert run(module, steps, ['other']) == ['other']
+    assert not (out / 'other_stale.txt').exists()
+
+
+def test_persisted_files_are_not_restored(workspace):
+    tmp_path, _, load_steps, run = workspace
+    module, steps = load_steps()
+    out = tmp_path / 'out'
+    # other.txt をパイプラインの外でも更新するファイルとし，キャッシュから復元しない
+    steps['other']['outputs'] = []
+    steps['other']['persist'] = ['other.txt']
+    run(module, steps, ['other'])
+
+    (out / 'other.txt').write_text('updated')
+    assert run(module, steps, ['other']) == []
+    assert (out / 'other.txt').read_text() == 'updated'
+
+    # ファイルがない場合はステップを再実行する
+    (out / 'other.txt').unlink()
+    assert run(module, steps, ['other']) == ['other']
+    assert (out / 'other.txt').read_text() == 'other'
@@ -0,0 +1,29 @@
+"""
+多重比較（post_hoc）: 全水準をまとめて求めた Tukey-Kramer 法の表を，水準ごとの pairwise_tukeyhsd と比較する
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from program.check_strength import delta_col, compute_deltas, group_moments
+from program.post_hoc import tukey_kramer_table
+
+
+def test_tukey_kramer_matches_pairwise_tukeyhsd(df_std):
+    multicomp = pytest.importorskip('statsmodels.stats.multicomp')
+    deltas = compute_deltas(df_std)
+    table = tukey_kramer_table(group_moments(deltas)).set_index(['Target', 'Level', 'group1', 'group2'])
+
+    stim = deltas[deltas['Category'] != 'base'].assign(Category=lambda d: d['Category'].astype(str))
+    for target in ['q1', 'q2']:
+        for lvl in sorted(stim['Level'].unique()):
+            level_rows = stim[stim['Level'] == lvl]
+            tukey = multicomp.pairwise_tukeyhsd(endog=level_rows[delta_col(target)], groups=level_rows['Category'])
+            summary = tukey.summary().data
+            reference = pd.DataFrame(summary[1:], columns=summary[0])
+            result = table.loc[[(target, lvl, g1, g2) for g1, g2 in zip(reference['group1'], reference['group2'])]]
+            np.testing.assert_allclose(result['meandiff'], tukey.meandiffs, atol=1e-12)
+            np.testing.assert_allclose(result['p_adj'], tukey.pvalues, atol=1e-3)
+            np.testing.assert_allclose(result['lower'], tukey.confint[:, 0], atol=1e-6)
+            np.testing.assert_allclose(result['upper'], tukey.confint[:, 1], atol=1e-6)
+            np.testing.assert_array_equal(result['reject'], tukey.reject)
@@ -0,0 +1,68 @@
+"""
+計測（profiling）: 物理メモリ使用量のピークと書き込んだバイト数を区間ごとに求める
+"""
+import os
+
+import numpy as np
+import pytest
+
+from program.profiling import configure_profiling, measure, take_records
+
+MB = 2 ** 20
+
+
+@pytest.fixture
+def records():
+    configure_profiling(enabled=True)
+    take_records()
+    collected = {}
+    yield collected
+    configure_profiling(enabled=False)
+    take_records()
+
+
+def _collect(collected):
+    collected.update({r['name']: r for r in take_records()})
+    return collected
+
+
+def _allocate(size_mb):
+    # 確保した領域に書き込んで物理メモリを使用する
+    return np.ones(size_mb * MB // 8).sum()
+
+
+def test_peak_rss_is_per_section(records):
+    with measure('large'):
+        _allocate(200)
+    with measure('outer'):
+        with measure('inner'):
+            _allocate(40)
+    _collect(records)
+    if records['inner']['peak_rss_scope'] != 'step':
+        pytest.skip('the RSS peak cannot be reset on this platform')
+
+    # 前の区間のピークを引き継がない
+    assert records['large']['peak_rss_mb'] - records['inner']['peak_rss_mb'] > 100
+    assert records['large']['peak_rss_delta_mb'] >= 180
+    assert 30 <= records['inner']['peak_rss_delta_mb'] < 100
+    # 外側の区間のピークは内側の区間のピークを含む
+    assert records['outer']['peak_rss_mb'] >= records['inner']['peak_rss_mb']
+
+
+def test_bytes_written_counts_storage_only(records, tmp_path):
+    if not os.path.exists('/proc/self/io'):
+        pytest.skip('/proc/self/io is not available')
+    read_fd, write_fd = os.pipe()
+    try:
+        with measure('pipe'):
+            os.write(write_fd, b'x' * 32768)
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+    with measure('file'):
+        with open(tmp_path / 'out.bin', 'wb') as f:
+            f.write(b'x' * 4 * MB)
+    _collect(records)
+
+    assert records['pipe']['bytes_written'] == 0
+    assert records['file']['bytes_written'] >= 4 * MB
@@ -0,0 +1,24 @@
+"""
+頻出語分析（qualitative）
+"""
+import pytest
+
+import program.qualitative as qualitative_module
+from program.qualitative import calculate_qualitative_counts
+
+
+def _fail_with(error):
+    def tokenize_frame(*args, **kwargs):
+        raise error
+    return tokenize_frame
+
+
+def test_missing_janome_skips_analysis(df_anon, tmp_path, monkeypatch):
+    monkeypatch.setattr(qualitative_module, 'tokenize_frame', _fail_with(ImportError("No module named 'janome'")))
+    assert calculate_qualitative_counts(df_anon, str(tmp_path), token_cache=False) is None
+
+
+def test_tokenization_errors_propagate(df_anon, tmp_path, monkeypatch):
+    monkeypatch.setattr(qualitative_module, 'tokenize_frame', _fail_with(ValueError("broken token cache")))
+    with pytest.raises(ValueError, match='broken token cache'):
+        calculate_qualitative_counts(df_anon, str(tmp_path), token_cache=False)
@@ -0,0 +1,46 @@
+"""
+重回帰分析（regression）: 積和行列から求めた全部分集合・全目的変数の推定結果を statsmodels の OLS と比較する
+"""
+import numpy as np
+import pytest
+
+from conftest import ols_subsets
+from program.regression import EXPLANATORY_VARS, TARGETS, calculate_regression, gram_inverse, fit_ols
+
+
+def test_fit_ols_matches_statsmodels(df_std):
+    sm = pytest.importorskip('statsmodels.api')
+    results = calculate_regression(df_std)
+    subsets = ols_subsets(df_std)
+    assert results['subsets'] == list(subsets)
+
+    for s, (label, data) in enumerate(subsets.items()):
+        X = sm.add_constant(data[EXPLANATORY_VARS].astype(np.float64))
+        for t, target in enumerate(TARGETS):
+            model = sm.OLS(data[target].astype(np.float64), X).fit()
+            np.testing.assert_allclose(results['params'][s, :, t], model.params, rtol=1e-7, atol=1e-10)
+            np.testing.assert_allclose(results['bse'][s, :, t], model.bse, rtol=1e-7)
+            np.testing.assert_allclose(results['pvalues'][s, :, t], model.pvalues, rtol=1e-5, atol=1e-12)
+            assert results['rsquared'][s, t] == pytest.approx(model.rsquared, rel=1e-7)
+            assert results['rsquared_adj'][s, t] == pytest.approx(model.rsquared_adj, rel=1e-7)
+            assert results['fvalue'][s, t] == pytest.approx(model.fvalue, rel=1e-7)
+            assert results['f_pvalue'][s, t] == pytest.approx(model.f_pvalue, rel=1e-5, abs=1e-15)
+        assert results['nobs'][s] == len(data)
+
+
+def test_fit_ols_singular_slice_only():
+    # 特異なモデルのみ擬似逆行列となり，他のモデルはコレスキー分解の結果のまま
+    rng = np.random.default_rng(0)
+    x = np.column_stack([np.ones(50), rng.normal(size=(50, 2))])
+    y = x @ [1.0, 2.0, -1.0] + rng.normal(scale=0.1, size=50)
+    x_singular = np.column_stack([x[:, :2], x[:, 1]])
+
+    xs = np.stack([x, x_singular])
+    xtx = np.einsum('sni,snj->sij', xs, xs)
+    np.testing.assert_allclose(gram_inverse(xtx)[0], np.linalg.inv(xtx[0]), rtol=1e-9)
+    np.testing.assert_allclose(gram_inverse(xtx)[1], np.linalg.pinv(xtx[1]), rtol=1e-6, atol=1e-9)
+
+    fit = fit_ols(xtx, np.einsum('sni,sn->si', xs, np.stack([y, y]))[:, :, None],
+                  np.full((2, 1), y @ y), np.array([50.0, 50.0]))
+    np.testing.assert_allclose(fit['params'][0, :, 0], np.linalg.lstsq(x, y, rcond=None)[0], rtol=1e-9)
+    np.testing.assert_allclose(fit['params'][1, :, 0], np.linalg.lstsq(x_singular, y, rcond=None)[0], rtol=1e-6)
@@ -0,0 +1,39 @@
+"""
+被験者内標準化（standardize_within）: 参加者ごとの groupby.transform による従来の計算と比較する
+"""
+import numpy as np
+import pandas as pd
+
+from program.standardize import TARGET_COLS, standardize_within
+
+
+def _standardize_reference(df):
+    def standardize(g):
+        std = g.std()
+        mean = g.mean()
+        if pd.isna(std) or std == 0:
+            return g - mean
+        return (g - mean) / std
+
+    values = df[TARGET_COLS].astype(np.float64)
+    return values.groupby(df['PID'], observed=True).transform(standardize).to_numpy()
+
+
+def test_standardize_within_matches_groupwise(df_anon):
+    np.testing.assert_allclose(standardize_within(df_anon, TARGET_COLS), _standardize_reference(df_anon), atol=1e-12)
+
+
+def test_standardize_within_constant_participant(df_anon):
+    # 全ての回答が同じ参加者は平均を引くのみ（0）となる
+    pid = df_anon['PID'].iloc[0]
+    df = df_anon.copy()
+    df.loc[df['PID'] == pid, 'q1'] = 4
+    values = standardize_within(df, TARGET_COLS)
+    np.testing.assert_array_equal(values[(df['PID'] == pid).to_numpy(), 0], 0.0)
+    np.testing.assert_allclose(values, _standardize_reference(df), atol=1e-12)
+
+
+def test_standardize_float32(df_anon):
+    values = standardize_within(df_anon, TARGET_COLS, dtype=np.float32)
+    assert values.dtype == np.float32
+    np.testing.assert_allclose(values, _standardize_reference(df_anon), atol=1e-5)
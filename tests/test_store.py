@@ -0,0 +1,32 @@
+"""
+中間データ（store）: 再読み込みした Tidy Data の型
+"""
+import numpy as np
+import pandas as pd
+
+import program.schema as schema_module
+from program.store import save_frame, load_frame
+
+
+def test_load_frame_applies_schema(df_anon, tmp_path, monkeypatch):
+    # 型を揃える前の表（CSV から読み込んだ場合と同じ文字列・数値の列）として保存する
+    raw = df_anon.assign(PID=df_anon['PID'].astype(str).astype(object), Q1_Answer=df_anon['Q1_Answer'].astype(object))
+    save_frame(raw, str(tmp_path), 'tidy', fmt='npy')
+    # 記述回答の型が使える環境で読み込む
+    monkeypatch.setattr(schema_module, 'text_dtype', lambda: 'string')
+
+    loaded = load_frame(str(tmp_path), 'tidy', mmap=False)
+    assert isinstance(loaded['PID'].dtype, pd.CategoricalDtype)
+    assert loaded['Q1_Answer'].dtype == 'string'
+    assert loaded['q1'].dtype == df_anon['q1'].dtype
+    pd.testing.assert_frame_equal(
+        loaded.astype({'PID': str, 'Q1_Answer': object}), raw.astype({'PID': str}), check_dtype=False
+    )
+
+
+def test_load_frame_keeps_numeric_columns(df_std, tmp_path):
+    # 標準化後の値（q1〜q7 を置き換えた float64 の列）は int8 / float32 に戻さない
+    save_frame(df_std, str(tmp_path), 'standardized_data', fmt='npy')
+    loaded = load_frame(str(tmp_path), 'standardized_data')
+    assert loaded['q1'].dtype == np.float64
+    np.testing.assert_array_equal(loaded['q1'], df_std['q1'])
@@ -0,0 +1,100 @@
+"""
+十分統計量（suffstats）: 参加者を追加して更新した統計量と全参加者から直接求めた結果の比較，
+および --append で追加した参加者がパイプラインの実行後も保持されること
+"""
+import os
+import sys
+import shutil
+import subprocess
+
+import pytest
+
+from conftest import REPO_DIR, SEED, split_by_pid, assert_grid_equal, assert_strength_equal, assert_regression_equal
+from program.validation import paired_ttest_grid, merge_paired_sums, paired_ttest_from_sums
+from program.check_strength import calculate_strength_stats, strength_results_from_sums
+from program.regression import calculate_regression, regression_results_from_grams
+from program.suffstats import update_suffstats, load_suffstats, registered_pids
+from program.synthetic import generate_study
+
+
+def test_suffstats_store_matches_direct(df_anon, df_std, tmp_path):
+    stats_path = str(tmp_path / 'suffstats.sqlite')
+    first, second = split_by_pid(df_anon)
+    n_first, n_second = first['PID'].astype(str).nunique(), second['PID'].astype(str).nunique()
+
+    assert update_suffstats(first, stats_path) == n_first
+    assert update_suffstats(second, stats_path) == n_second
+    # 登録済みの参加者は追加しない
+    assert update_suffstats(first, stats_path) == 0
+
+    stats = load_suffstats(stats_path)
+    assert stats['n_participants'] == n_first + n_second
+    assert_grid_equal(paired_ttest_from_sums(merge_paired_sums([stats['validation']])), paired_ttest_grid(df_anon))
+    assert_strength_equal(strength_results_from_sums(stats['strength']), calculate_strength_stats(df_std))
+    assert_regression_equal(regression_results_from_grams(stats['grams']), calculate_regression(df_std))
+
+
+def test_suffstats_version_mismatch(df_anon, tmp_path, monkeypatch):
+    stats_path = str(tmp_path / 'suffstats.sqlite')
+    update_suffstats(df_anon, stats_path)
+    monkeypatch.setattr('program.suffstats.STATS_VERSION', 0)
+    with pytest.raises(ValueError, match='version mismatch'):
+        load_suffstats(stats_path)
+
+
+def _analyze(cwd, *args):
+    result = subprocess.run(
+        [sys.executable, os.path.join(REPO_DIR, 'analyze.py'), *args, '--no-figures'],
+        cwd=cwd, capture_output=True, text=True, check=True
+    )
+    return result.stdout
+
+
+def _snapshot(directory):
+    snapshot = {}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                snapshot[os.path.relpath(path, directory)] = f.read()
+    return snapshot
+
+
+def test_append_survives_pipeline_run(tmp_path):
+    # 最後の2人のファイルを quant_data の外に置き，--append で追加する
+    study = tmp_path / 'study'
+    generate_study(str(study), n_participants=12, seed=SEED)
+    new_dir = tmp_path / 'new'
+    os.makedirs(new_dir)
+    new_files = [str(shutil.move(str(study / 'quant_data' / f"{i:03d}_log.csv"), str(new_dir))) for i in (11, 12)]
+    stats_path = str(study / 'generated' / 'suffstats.sqlite')
+
+    _analyze(study, 'suffstats')
+    base_pids = registered_pids(stats_path)
+    assert len(base_pids) == 10
+    _analyze(study, '--append', *new_files)
+    appended_pids = registered_pids(stats_path)
+    assert len(appended_pids) == 12
+    reports = _snapshot(study / 'generated' / 'appended')
+    assert 'manipulation_check.txt' in reports
+
+    # 全ステップを実行しても，十分統計量はキャッシュから復元・再作成せず，追加したレポートも残す
+    out = _analyze(study)
+    assert "Step 'suffstats' is unchanged" in out
+    assert registered_pids(stats_path) == appended_pids
+    assert _snapshot(study / 'generated' / 'appended') == reports
+
+    # 十分統計量がない場合は作り直す
+    os.remove(stats_path)
+    _analyze(study, 'suffstats')
+    assert registered_pids(stats_path) == base_pids
+
+    # 匿名化データが変わると quant_data から作り直し，quant_data にない追加した参加者を表示する
+    _analyze(study, '--append', *new_files)
+    shutil.copy(new_files[0], study / 'quant_data')
+    out = _analyze(study, 'suffstats')
+    rebuilt_pids = registered_pids(stats_path)
+    assert len(rebuilt_pids) == 11
+    dropped = appended_pids - rebuilt_pids
+    assert len(dropped) == 1
+    assert f"(dropped): {dropped.pop()}" in out
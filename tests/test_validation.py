@@ -0,0 +1,33 @@
+"""
+操作チェック（validation）: 対応のあるt検定の表を，条件ごとの scipy.stats.ttest_rel と比較する
+"""
+import pandas as pd
+import pytest
+from scipy import stats
+
+from program.standardize import TARGET_COLS
+from program.validation import paired_ttest_grid
+
+
+def _paired_reference(df, category, level, target_q):
+    base_series = df[df['Category'] == 'base'].set_index('PID')[target_q]
+    stim_series = df[(df['Category'] == category) & (df['Level'] == level)][['PID', target_q]] \
+        .groupby('PID', observed=True).mean()[target_q]
+    merged = pd.concat([base_series, stim_series], axis=1, join='inner')
+    merged.columns = ['Base', 'Stim']
+    t_stat, p_val = stats.ttest_rel(merged['Stim'], merged['Base'], alternative='greater')
+    return len(merged), merged['Base'].mean(), merged['Stim'].mean(), t_stat, p_val
+
+
+def test_paired_ttest_grid_matches_ttest_rel(df_anon):
+    grid = paired_ttest_grid(df_anon)
+    conditions = df_anon.loc[df_anon['Category'] != 'base', ['Category', 'Level']].drop_duplicates()
+    assert len(grid) == len(conditions) * len(TARGET_COLS)
+
+    for row in grid.itertuples(index=False):
+        n, mean_base, mean_stim, t_stat, p_val = _paired_reference(df_anon, row.Category, row.Level, row.Target_Q)
+        assert row.N == n
+        assert row.Mean_Base == pytest.approx(mean_base, rel=1e-12)
+        assert row.Mean_Stim == pytest.approx(mean_stim, rel=1e-12)
+        assert row.t_stat == pytest.approx(t_stat, rel=1e-9)
+        assert row.p_val == pytest.approx(p_val, rel=1e-6, abs=1e-15)